@@ -8,6 +8,8 @@ import sys
 import time
 import xml.parsers.expat
 
+import jobTelemetry
+
 __all__ = [
 	"Error",
 	"ParseError",
@@ -156,6 +158,20 @@ class CondorUserLog(object):
 
 		return bool(pending_jobs)
 
+	def SplitByJob(self):
+		#Returns a dictionary of CondorUserLog objects, one per job id,
+		#holding the events of that job in their original order
+
+		jobs = {}
+		for event in self.events:
+			job_log = jobs.get(event.job_id)
+			if job_log is None:
+				job_log = CondorUserLog()
+				job_log.fname = self.fname
+				jobs[event.job_id] = job_log
+			job_log.events.append(event)
+		return jobs
+
 	def JobFailed(self):
 		#Returns true if all jobs exited with non-zero status or were removed
 
@@ -331,6 +347,8 @@ class CondorUserLogStats(object):
 	machine_bad_job_ids = None
 	machine_bad_run_ids = None
 
+	telemetry = None      # resources used by each phase of the jobs, see jobTelemetry.py
+
 	def __init__(self):
 
 		self.site_bad_hours = {}
@@ -351,6 +369,8 @@ class CondorUserLogStats(object):
 		self.machine_bad_job_ids = {}
 		self.machine_bad_run_ids = {}
 
+		self.telemetry = jobTelemetry.TelemetrySummary()
+
 	def __str__(self):
 		s = ""
 
@@ -420,8 +440,16 @@ class CondorUserLogStats(object):
 				string.join(bad_job_ids,",")
 			)
 
+		if self.telemetry.phases:
+			s += "\nResources used by each phase of the jobs:\n"
+			s += str(self.telemetry)
+
 		return s
 
+	def add_telemetry(self,telemetry):
+		#Adds the telemetry.json of a job, as written by jobTelemetry.py
+		self.telemetry.add(telemetry)
+
 	def add(self,ulog):
 		site = ""
 		machine = ""
@@ -537,6 +565,58 @@ def ReadCondorUserLog(fname):
 		raise
 	return ulog
 
+def JobIdKey(job_id):
+	#Returns "cluster.proc" without padding, so that job ids from text
+	#logs (e.g. "012.003"), XML logs and the index can be compared
+
+	fields = job_id.split(".")
+	if len(fields) < 2:
+		fields.append("0")
+	return "%d.%d" % (long(fields[0]),long(fields[1]))
+
+def SharedUserLogIndex(fname):
+	#Returns the name of the index of a user log shared by many jobs
+	return os.path.splitext(fname)[0] + ".index"
+
+def ReadUserLogIndex(fname):
+	#Reads the index of a shared user log, with lines of the form
+	#"<cluster> <proc> <job name>", and returns a dictionary of job
+	#names keyed by "cluster.proc"
+
+	index = {}
+	for line in open(fname,"r"):
+		fields = line.split()
+		if len(fields) != 3:
+			continue
+		try:
+			index["%d.%d" % (long(fields[0]),long(fields[1]))] = fields[2]
+		except ValueError:
+			continue
+	return index
+
+def ReadSharedUserLog(fname,index_fname=None):
+	#Reads a user log shared by many jobs in one pass and returns a
+	#dictionary of CondorUserLog objects, one per job.  If there is an
+	#index, the dictionary is keyed by job name, and the events of all
+	#submissions of a job are combined.  Otherwise, it is keyed by job id.
+
+	if index_fname is None:
+		index_fname = SharedUserLogIndex(fname)
+	index = {}
+	if os.path.exists(index_fname):
+		index = ReadUserLogIndex(index_fname)
+
+	jobs = {}
+	for job_id,job_log in ReadCondorUserLog(fname).SplitByJob().items():
+		name = index.get(JobIdKey(job_id),job_id)
+		if name in jobs:
+			#A resubmission of the job, so keep the events in time order
+			jobs[name].events.extend(job_log.events)
+			jobs[name].events.sort(key=lambda event: event.timestamp)
+		else:
+			jobs[name] = job_log
+	return jobs
+
 def main():
 	function = "--has-pending-jobs"
 	args = sys.argv[1:]
@@ -544,6 +624,34 @@ def main():
 		function = args[0]
 		args = args[1:]
 
+	if function == "--failed-jobs":
+		#Lists the jobs in a shared user log that failed
+		jobs = ReadSharedUserLog(args[0])
+		for name in sorted(jobs.keys()):
+			if jobs[name].JobFailed():
+				sys.stdout.write(name + "\n")
+		return 0
+	elif function == "--job-summary":
+		#Prints the number of jobs in a shared user log, and how many
+		#of them succeeded, failed or are not done
+		good = bad = not_done = 0
+		jobs = ReadSharedUserLog(args[0])
+		for job_log in jobs.values():
+			exit_code = None
+			for event in job_log.events:
+				if event.event_type == TERMINATED_EVENT:
+					exit_code = event.ExitCode
+					if event.ExitSignal is not None:
+						exit_code = -1
+			if exit_code is None:
+				not_done += 1
+			elif exit_code == 0:
+				good += 1
+			else:
+				bad += 1
+		sys.stdout.write("%i %i %i %i\n" % (len(jobs),good,bad,not_done))
+		return 0
+
 	ulog = ReadCondorUserLog(args[0])
 	sys.stdout.write(args[0] + "\n")
 
@@ -12,64 +12,261 @@ Example of how to use the FwkJobRep package to update a job report post processi
 """
 import os, string
 import sys
-import popen2
 import getopt
 
+try:
+	import multiprocessing
+except ImportError:
+	multiprocessing = None
+
 from ProdCommon.FwkJobRep.ReportParser import readJobReport
 
+from fileChecksum import file_checksum, ChecksumCache
+
 tmp_file_path = "/tmp"
 if os.access("/scratch",os.W_OK):
 	tmp_file_path = "/scratch"
 
 
 
-def readCksum(filename):
+checksumCaches = {}
+
+def getChecksumCache(filename):
 	"""
-	_readCksum_
+	_getChecksumCache_
 
-	Run a cksum command on a file an return the checksum value
+	Load a checksum cache once per process
 
 	"""
-	pop = popen2.Popen4("cksum %s" % filename)
-	while pop.poll() == -1:
-		exitStatus = pop.poll()
-	exitStatus = pop.poll()
-	if exitStatus:
-		return None
-	content = pop.fromchild.read()
-	value = content.strip()
-	value = content.split()[0]
-	return value
+	if filename not in checksumCaches:
+		checksumCaches[filename] = ChecksumCache(filename)
+	return checksumCaches[filename]
 
+class PfnIndex(object):
+	"""
+	_PfnIndex_
 
-def fileSize(filename):
+	Map from file name to the numbered subdirectory of pfn_path holding it,
+	as created by farmoutAnalysisJobs --output-files-per-subdir.  The
+	directories are listed once, rather than probing every subdirectory for
+	every file.  Files directly in pfn_path take precedence, then those in
+	the lowest numbered subdirectory.
+
+	"""
+	def __init__(self, pfn_path):
+		self.pfn_path = pfn_path
+		self.subdirs = {}
+		try:
+			entries = os.listdir(pfn_path)
+		except OSError:
+			entries = []
+		numbered = [int(x) for x in entries if x.isdigit()]
+		numbered.sort()
+		numbered.reverse()
+		for subdir in numbered:
+			try:
+				names = os.listdir(os.path.join(pfn_path,str(subdir)))
+			except OSError:
+				# not a directory
+				continue
+			for name in names:
+				self.subdirs[name] = str(subdir)
+		for name in entries:
+			self.subdirs[name] = ""
+
+	def resolve(self, fname):
+		"""
+		Return fname relative to pfn_path, including the subdirectory
+		where it was found
+
+		"""
+		subdir = self.subdirs.get(fname)
+		if subdir:
+			return os.path.join(subdir,fname)
+		return fname
+
+pfnIndexes = {}
+
+def getPfnIndex(pfn_path):
 	"""
-	_fileSize_
+	_getPfnIndex_
 
-	Get size of file
+	List the output directories once per process
 
 	"""
-	return os.stat(filename)[6]	
+	if pfn_path not in pfnIndexes:
+		pfnIndexes[pfn_path] = PfnIndex(pfn_path)
+	return pfnIndexes[pfn_path]
 
-def addFileStats(file):
+def addFileStats(file, cache=None):
 	"""
 	_addFileStats_
 
-	Add checksum and size info to each size
+	Add checksum and size info to each size.  If a ChecksumCache is given,
+	the file is only read if it is not in the cache or has changed.
 
 	"""
 
 	pfn = file['PFN']
 
-	file['Size'] = fileSize(pfn)
-	checkSum = readCksum(pfn)
-	file.addChecksum('cksum',checkSum)
+	# size and checksums all come from one read of the file
+	if cache is not None:
+		size, cksum, adler32 = cache.checksum(pfn)
+	else:
+		checksum = file_checksum(pfn)
+		size, cksum, adler32 = (checksum.size, checksum.cksum(),
+			checksum.adler32())
+	file['Size'] = size
+	file.addChecksum('cksum',str(cksum))
+	file.addChecksum('adler32',adler32)
 
 	return
 
+def modifyReport(inputReport, outputReport, settings):
+	"""
+	_modifyReport_
+
+	Update one job report for publication and write it to outputReport.
+	settings is a dictionary holding the dataset and path options.
+	Returns None on success or a message describing the failure.
+
+	"""
+	reports = readJobReport(inputReport)
+
+	# report is an instance of FwkJobRep.FwkJobReport class
+	# can be N in a file, so a list is always returned
+	# here I am assuming just one report per file for simplicity
+	if len(reports) <> 1:
+		return "Found %d reports in %s" % (len(reports), inputReport)
+
+	report = reports[-1]
+
+	if (len(report.files) == 0):
+		return "no output file to modify"
+
+	# CRAB requires this status == "Success"
+	# would be nice to know if the job _really_ succeeded
+	report.status = "Success"
+
+	# NOTE, ExitCode in the job report is 50117, which means
+	# "could not update exit code in job report"
+	# I think this is the default set by cmssw and it is
+	# supposed to be overridden by the job wrapper.
+	# Currently we are not setting it.  Perhaps we
+	# should save the exit code and file cksum in
+	# a log file (or poke it into the FJR) at runtime
+	# and then fix it up here if necessary.  That way,
+	# the worker node does not need access to the python
+	# code for parsing FJRs.
+
+	pfn_path = settings['pfn_path']
+	lfn_path = settings['lfn_path']
+	strip_input_file_info = settings['strip_input_file_info']
+	cache = None
+	if settings.get('checksum_cache'):
+		cache = getChecksumCache(settings['checksum_cache'])
+
+	pfnIndex = getPfnIndex(pfn_path)
+
+	for f in report.files:
+		fname = pfnIndex.resolve(f['PFN'])
+		f['PFN'] = os.path.join(pfn_path,fname)
+		f['LFN'] = os.path.join(lfn_path,fname)
+		f['SEName'] = settings['SEName']
+
+		#Generate per file stats
+		addFileStats(f, cache)
+
+		if strip_input_file_info:
+			f.inputFiles = []
+
+		datasetinfo=f.newDataset()
+		for key in DATASET_KEYS:
+			datasetinfo[key] = settings[key]
+
+	if strip_input_file_info:
+		report.inputFiles = []
+
+	# After modifying the report, save it to a file.
+	report.write(outputReport)
+	return None
+
+def modifyReportTask(task):
+	"""
+	_modifyReportTask_
+
+	Run modifyReport on an (input, output, settings) tuple, catching any
+	error so that one bad report does not stop a batch.  The output report
+	is removed if it could not be completed.
+
+	"""
+	inputReport, outputReport, settings = task
+	try:
+		error = modifyReport(inputReport, outputReport, settings)
+	except Exception, e:
+		error = "%s: %s" % (e.__class__.__name__, e)
+	if error is not None and os.path.exists(outputReport):
+		os.remove(outputReport)
+	return inputReport, outputReport, error
+
+def readBatch(fd):
+	"""
+	_readBatch_
+
+	Read pairs of input and output job report names, one pair per line
+
+	"""
+	for line in fd:
+		fields = line.split()
+		if len(fields) == 2:
+			yield fields[0], fields[1]
+
+def runBatch(pairs, settings, processes):
+	"""
+	_runBatch_
+
+	Modify all the (input, output) report pairs, using a pool of worker
+	processes when possible.  Returns the number of reports that failed.
+
+	"""
+	tasks = ((inputReport, outputReport, settings)
+		for inputReport, outputReport in pairs)
+	if multiprocessing is not None and processes > 1:
+		pool = multiprocessing.Pool(processes)
+		results = pool.imap_unordered(modifyReportTask, tasks, 10)
+	else:
+		pool = None
+		results = (modifyReportTask(task) for task in tasks)
+
+	failed = 0
+	for inputReport, outputReport, error in results:
+		if error is None:
+			print "Wrote modified report to " + outputReport
+		else:
+			sys.stderr.write("Failed to prepare framework job report for"
+				" publication: %s: %s\n" % (inputReport, error))
+			failed += 1
+		sys.stdout.flush()
+
+	if pool is not None:
+		pool.close()
+		pool.join()
+	return failed
+
+DATASET_KEYS = [
+	"PrimaryDataset",
+	"DataTier",
+	"ProcessedDataset",
+	"ApplicationFamily",
+	"ApplicationName",
+	"ApplicationVersion",
+	"PSetHash",
+]
+
 def ShowUsage():
 	msg = """
 USAGE: ModifyJobReport.py OPTIONS
+       ModifyJobReport.py --batch OPTIONS < pairs
 
 OPTIONS:
 --input-fjr
@@ -85,6 +282,11 @@ OPTIONS:
 --pfn-path
 --lfn-path
 --strip-input-file-info   (do not publish info about input files)
+--batch                   (read "<input-fjr> <output-fjr>" lines from stdin
+                           and modify them all in this one process)
+--processes=N             (number of worker processes for --batch)
+--checksum-cache=FILE     (reuse checksums of unchanged files from this
+                           file, and add new ones to it; see fileChecksum.py)
 """
 	sys.stderr.write(msg)
 
@@ -108,11 +310,18 @@ if __name__ == '__main__':
 		"SEName=",
 		"pfn-path=",
 		"lfn-path=",
-		"strip-input-file-info"
+		"strip-input-file-info",
+		"batch",
+		"processes=",
+		"checksum-cache=",
 	]
 	options,args = getopt.getopt(sys.argv[1:],"h",long_options)
 
-	strip_input_file_info = 0
+	settings = {"strip_input_file_info": 0}
+	batch = 0
+	processes = 4
+	inputReport = None
+	outputReport = None
 
 	for option,value in options:
 		if option == "--help" or option == "-h":
@@ -122,91 +331,38 @@ if __name__ == '__main__':
 			inputReport = value
 		elif option == "--output-fjr":
 			outputReport = value
-		elif option == "--PrimaryDataset":
-			PrimaryDataset = value
-		elif option == "--DataTier":
-			DataTier = value
-		elif option == "--ProcessedDataset":
-			ProcessedDataset = value
-		elif option == "--ApplicationFamily":
-			ApplicationFamily = value
-		elif option == "--ApplicationName":
-			ApplicationName = value
-		elif option == "--ApplicationVersion":
-			ApplicationVersion = value
-		elif option == "--PSetHash":
-			PSetHash = value
-		elif option == "--SEName":
-			SEName = value
+		elif option[2:] in DATASET_KEYS or option == "--SEName":
+			settings[option[2:]] = value
 		elif option == "--pfn-path":
-			pfn_path = value
+			settings["pfn_path"] = value
 		elif option == "--lfn-path":
-			lfn_path = value
+			settings["lfn_path"] = value
 		elif option == "--strip-input-file-info":
-			strip_input_file_info = 1
+			settings["strip_input_file_info"] = 1
+		elif option == "--batch":
+			batch = 1
+		elif option == "--processes":
+			processes = int(value)
+		elif option == "--checksum-cache":
+			settings["checksum_cache"] = value
 		else:
 			sys.stderr.write("Unexpected option: " + str(option) + "\n")
 			sys.exit(2)
 
-	reports = readJobReport(inputReport)
-	
-	# report is an instance of FwkJobRep.FwkJobReport class
-	# can be N in a file, so a list is always returned
-	# here I am assuming just one report per file for simplicity
-	if len(reports) <> 1:
-		sys.stderr.write("ERROR: Found %d reports in " + inputReport + "\n" % len(reports))
-		sys.exit(1)
-
-	report = reports[-1]
-
-	if (len(report.files) == 0):
-		print "no output file to modify"
+	# load before starting any workers, so they all share these
+	if settings.get("checksum_cache"):
+		getChecksumCache(settings["checksum_cache"])
+	if settings.get("pfn_path"):
+		getPfnIndex(settings["pfn_path"])
+
+	if batch:
+		failed = runBatch(readBatch(sys.stdin), settings, processes)
+		if failed:
+			sys.exit(1)
+		sys.exit(0)
+
+	error = modifyReport(inputReport, outputReport, settings)
+	if error is not None:
+		sys.stderr.write("ERROR: " + error + "\n")
 		sys.exit(1)
-
-	# CRAB requires this status == "Success"
-	# would be nice to know if the job _really_ succeeded
-	report.status = "Success"
-
-	# NOTE, ExitCode in the job report is 50117, which means
-	# "could not update exit code in job report"
-	# I think this is the default set by cmssw and it is
-	# supposed to be overridden by the job wrapper.
-	# Currently we are not setting it.  Perhaps we
-	# should save the exit code and file cksum in
-	# a log file (or poke it into the FJR) at runtime
-	# and then fix it up here if necessary.  That way,
-	# the worker node does not need access to the python
-	# code for parsing FJRs.
-
-	for f in report.files:
-		fname = f['PFN']
-		if not os.path.exists(os.path.join(pfn_path,fname)):
-			for i in range(1,100):
-				if os.path.exists(os.path.join(pfn_path,str(i),fname)):
-					fname = os.path.join(str(i),fname)
-					break
-		f['PFN'] = os.path.join(pfn_path,fname)
-		f['LFN'] = os.path.join(lfn_path,fname)
-		f['SEName'] = SEName
-
-		#Generate per file stats
-		addFileStats(f)
-
-		if strip_input_file_info:
-			f.inputFiles = []
-
-		datasetinfo=f.newDataset()
-		datasetinfo['PrimaryDataset'] = PrimaryDataset 
-		datasetinfo['DataTier'] = DataTier 
-		datasetinfo['ProcessedDataset'] = ProcessedDataset 
-		datasetinfo['ApplicationFamily'] = ApplicationFamily 
-		datasetinfo['ApplicationName'] = ApplicationName 
-		datasetinfo['ApplicationVersion'] = ApplicationVersion
-		datasetinfo['PSetHash'] = PSetHash
-
-	if strip_input_file_info:
-		report.inputFiles = []
-
-	# After modifying the report, save it to a file.
-	report.write(outputReport)
 	print "Wrote modified report to " + outputReport
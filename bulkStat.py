@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+'''
+
+Bulk file existence checks for farmout job creation.
+
+Checking input files one at a time with [ -f ] costs a separate metadata round
+trip per file, which adds up quickly on /hdfs when a workflow has tens of
+thousands of inputs.  This reads file names from stdin, stats them in a pool
+of threads, and writes the names of the files that exist to stdout in the
+order they were read.  Missing files are reported on stderr.
+
+Example:
+
+    cat files.txt | bulkStat.py --prefix=/hdfs --missing-list=missing.txt
+
+The stat_files function can also be used directly by other farmout tools.
+
+'''
+
+import os
+import Queue
+import stat
+import sys
+import threading
+from optparse import OptionParser
+
+class StatWorker(threading.Thread):
+    '''
+    StatWorker
+
+    Takes (index, path) pairs from the work queue, stats the path and puts
+    (index, stat result) in the results queue.  The stat result is None if
+    the path could not be stat-ed.
+    '''
+    def __init__(self, work_queue, results_queue):
+        super(StatWorker, self).__init__()
+        self.work_queue = work_queue
+        self.results_queue = results_queue
+
+    def run(self):
+        while True:
+            try:
+                item = self.work_queue.get()
+                # Poison pill to be done.
+                if item is None:
+                    break
+                index, path = item
+                try:
+                    result = os.stat(path)
+                except OSError:
+                    result = None
+                self.results_queue.put((index, result))
+            finally:
+                self.work_queue.task_done()
+
+def stat_files(paths, workers=20, chunk_size=2000):
+    '''
+    Generate (path, stat result) pairs in input order, with None as the stat
+    result of paths that do not exist.  Paths are taken from the input in
+    chunks, so arbitrarily long streams can be checked.
+
+    >>> list(stat_files(['/', '/no/such/file']))[1]
+    ('/no/such/file', None)
+    '''
+    work_queue = Queue.Queue()
+    results_queue = Queue.Queue()
+    stat_workers = [StatWorker(work_queue, results_queue)
+                    for i in range(workers)]
+    map(lambda x: x.start(), stat_workers)
+
+    paths = iter(paths)
+    try:
+        while True:
+            chunk = []
+            for path in paths:
+                chunk.append(path)
+                if len(chunk) >= chunk_size:
+                    break
+            if not chunk:
+                break
+            for index, path in enumerate(chunk):
+                work_queue.put((index, path))
+            work_queue.join()
+            results = [None]*len(chunk)
+            while not results_queue.empty():
+                index, result = results_queue.get()
+                results[index] = result
+            for path, result in zip(chunk, results):
+                yield path, result
+    finally:
+        # Add poison pills to stop the workers
+        for worker in stat_workers:
+            work_queue.put(None)
+        map(lambda x: x.join(), stat_workers)
+
+def is_file(stat_result):
+    ''' Equivalent of [ -f ] for a result from stat_files '''
+    return stat_result is not None and stat.S_ISREG(stat_result.st_mode)
+
+def main():
+    parser = OptionParser(usage="%prog [options] < file_list")
+    parser.add_option("--prefix", dest="prefix", default="",
+                      help="Prepend this to each file name before checking it")
+    parser.add_option("--missing-list", dest="missing_list", default="",
+                      help="Append names of missing files to this file")
+    parser.add_option("--workers", dest="workers", type="int", default=20,
+                      help="Number of files to stat in parallel")
+    (options, args) = parser.parse_args()
+
+    missing_list = None
+    if options.missing_list:
+        missing_list = open(options.missing_list, 'a')
+
+    names = (line.strip() for line in sys.stdin)
+    names = (name for name in names if name)
+    paths = (options.prefix + name for name in names)
+    prefix_len = len(options.prefix)
+
+    for path, result in stat_files(paths, workers=options.workers):
+        name = path[prefix_len:]
+        if is_file(result):
+            sys.stdout.write(name + '\n')
+            continue
+        sys.stderr.write("%s does not exist, skipping\n" % path)
+        if missing_list is not None:
+            missing_list.write(name + '\n')
+
+    if missing_list is not None:
+        missing_list.close()
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
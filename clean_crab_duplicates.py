@@ -18,60 +18,224 @@ multiple results from the resubmission which are identical. This resolves these
 duplicates by taking the newest if they are the same size, and taking the
 largest if they differ (with a warning on stderr.)
 
+Only files which tie on the resubmission index need to be compared by size,
+so only those are stat-ed, each once, and in parallel.  Sizes can also be
+given with --size-listing, as lines of "<size> <file>" (e.g. from find
+-printf '%s %p\\n'), in which case nothing is stat-ed.
+
+If the input is grouped by CRAB job (--grouped), the chosen file of each job
+is written as soon as the next job starts.  A listing sorted by job index
+is grouped, and so is one sorted by name if all its files are in one
+directory and have one output name.  If a file of a job that was already
+written turns up later, the rest of the input is read first, as without
+--grouped.  Should that file be preferred to the one already written, this
+fails, as the choice cannot be taken back.  Without --grouped the whole
+input is read first.
+
 '''
 
 import sys
-import os
+from itertools import chain
 from optparse import OptionParser
 
+import bulkStat
 
-def main(input_files, verbose=False):
+def parse_name(filename):
     '''
-    Filter a list to remove duplicates
+    Return the (CRAB job index, submission index) of an output file
+
+    >>> parse_name('/store/user/me/output_98_1_tjj.root')
+    (98, 1)
     '''
-    output_files = []
+    fields = filename.split('_')
+    return int(fields[-3]), int(fields[-2])
 
-    # Read in all files from input
-    files = [file.strip() for file in input_files]
-    # Now map the files by CRAB job ID
-    # The key is the crab job index (i.e. 98 in the docs string)
-    crab_outputs = {}
+def group_by_job(files, grouped=False):
+    '''
+    Generate (job index, [files]) for the input files.  If grouped is True
+    the input is assumed to have all the files of a job next to each other,
+    and each group is generated as soon as it is complete.  Otherwise, the
+    groups are generated in order of the job index once all input is read.
+    If a job turns up again after its group was generated, the rest of the
+    input is read first, and the job is generated again with its other
+    files.
+
+    >>> list(group_by_job(['a_2_0_x.root', 'a_1_0_x.root', 'a_2_1_y.root']))
+    [(1, ['a_1_0_x.root']), (2, ['a_2_0_x.root', 'a_2_1_y.root'])]
+    >>> list(group_by_job(['a_2_0_x.root', 'a_2_1_y.root', 'a_1_0_x.root'],
+    ...                   grouped=True))
+    [(2, ['a_2_0_x.root', 'a_2_1_y.root']), (1, ['a_1_0_x.root'])]
+    >>> list(group_by_job(['a_2_0_x.root', 'a_1_0_x.root', 'a_2_1_y.root',
+    ...                    'a_3_0_z.root'], grouped=True))
+    [(2, ['a_2_0_x.root']), (1, ['a_1_0_x.root']), (2, ['a_2_1_y.root']), (3, ['a_3_0_z.root'])]
+    '''
+    if not grouped:
+        crab_outputs = {}
+        for file in files:
+            crab_outputs.setdefault(parse_name(file)[0], []).append(file)
+        for job in sorted(crab_outputs.keys()):
+            yield job, crab_outputs[job]
+        return
+
+    current_job = None
+    current = []
+    done = set()
+    files = iter(files)
     for file in files:
-        jobid = int(file.strip().split('_')[-3])
-        crab_outputs.setdefault(jobid, []).append(file.strip())
-
-    # Now go through and resolve any conflicts
-    for job in sorted(crab_outputs.keys()):
-        job_results = crab_outputs[job]
-        # Sort the overlapping results by desirability
-        # Order:
-        # 1) submission index
-        # 2) file size
-        # 3) filename
-        # Bigger is better.
-
-        def key_func(filename):
-            subindex = int(filename.split('_')[-2])
-            size = os.path.getsize(filename)
-            return (subindex, size, filename)
-
-        job_results.sort(key=key_func, reverse=True)
-        output_files.append(job_results[0])
-        if verbose and len(job_results) > 1:
-            for skipped in job_results[1:]:
-                sys.stderr.write("Skipping %s\n" % skipped)
-    return output_files
+        job = parse_name(file)[0]
+        if job in done:
+            # Not grouped after all, so read the rest before going on
+            rest = chain(current, [file], files)
+            for group in group_by_job(rest):
+                yield group
+            return
+        if job != current_job and current:
+            done.add(current_job)
+            yield current_job, current
+            current = []
+        current_job = job
+        current.append(file)
+    if current:
+        yield current_job, current
+
+def latest_submissions(job_results):
+    '''
+    Return the files of a job with the highest submission index.  Only these
+    need their sizes compared.
+
+    >>> latest_submissions(['o_9_0_a.root', 'o_9_2_b.root', 'o_9_2_c.root'])
+    ['o_9_2_b.root', 'o_9_2_c.root']
+    '''
+    top = max([parse_name(x)[1] for x in job_results])
+    return [x for x in job_results if parse_name(x)[1] == top]
+
+def choose(job_results, sizes):
+    '''
+    Sort the overlapping results of a job by desirability and return them.
+    Order:
+    1) submission index
+    2) file size
+    3) filename
+    Bigger is better.  Files without a known size sort as smallest.
+
+    >>> choose(['o_9_1_a.root', 'o_9_1_b.root', 'o_9_0_c.root'],
+    ...        {'o_9_1_a.root': 20, 'o_9_1_b.root': 10})
+    ['o_9_1_a.root', 'o_9_1_b.root', 'o_9_0_c.root']
+    '''
+    def key_func(filename):
+        return (parse_name(filename)[1], sizes.get(filename, -1), filename)
+    return sorted(job_results, key=key_func, reverse=True)
+
+def read_size_listing(fd):
+    ''' Read "<size> <file>" lines into a dictionary '''
+    sizes = {}
+    for line in fd:
+        fields = line.strip().split(None, 1)
+        if len(fields) != 2:
+            continue
+        try:
+            sizes[fields[1]] = int(fields[0])
+        except ValueError:
+            continue
+    return sizes
+
+def clean_duplicates(input_files, grouped=False, sizes=None, prefix='',
+                     workers=20, chunk_size=500, verbose=False):
+    '''
+    Generate the chosen file for each CRAB job.  Sizes of tied files come
+    from the sizes dictionary if given, and are stat-ed otherwise, a chunk
+    of jobs at a time.
+    '''
+    files = (file.strip() for file in input_files)
+    files = (file for file in files if file)
+
+    pending = []
+    to_stat = []
+    # The file written for each job, in case the job turns up again
+    written = {}
+
+    def flush():
+        stat_sizes = {}
+        if to_stat:
+            paths = [prefix + x for x in to_stat]
+            for name, (path, result) in zip(
+                    to_stat, bulkStat.stat_files(paths, workers=workers)):
+                if result is not None:
+                    stat_sizes[name] = result.st_size
+        for job, job_results in pending:
+            ranked = choose(job_results, sizes or stat_sizes)
+            if verbose:
+                for skipped in ranked[1:]:
+                    if skipped != written.get(job):
+                        sys.stderr.write("Skipping %s\n" % skipped)
+            if job in written:
+                if ranked[0] != written[job]:
+                    raise ValueError(
+                        "%s was written for CRAB job %i, but %s, which"
+                        " turned up later, is preferred"
+                        % (written[job], job, ranked[0]))
+                continue
+            written[job] = ranked[0]
+            yield ranked[0]
+        del pending[:]
+        del to_stat[:]
+
+    for job, job_results in group_by_job(files, grouped):
+        if job in written:
+            # Chosen again along with the file already written for it
+            job_results = job_results + [written[job]]
+        pending.append((job, job_results))
+        if len(job_results) > 1 and sizes is None:
+            tied = latest_submissions(job_results)
+            if len(tied) > 1:
+                to_stat.extend(tied)
+        # Files that need no stat can be written right away
+        if len(to_stat) >= chunk_size or not to_stat:
+            for output in flush():
+                yield output
+    for output in flush():
+        yield output
+
+def main(input_files, verbose=False):
+    '''
+    Filter a list to remove duplicates
+    '''
+    return list(clean_duplicates(input_files, verbose=verbose))
 
 if __name__ == "__main__":
     parser = OptionParser()
     parser.add_option("-v", "--verbose", dest="verbose",
                       action='store_true', default=False,
                       help="Print skipped files to stderr")
+    parser.add_option("--grouped", dest="grouped",
+                      action='store_true', default=False,
+                      help="The files of each CRAB job are next to each other"
+                      " in the input, so results can be written right away")
+    parser.add_option("--size-listing", dest="size_listing", default=None,
+                      help="Take file sizes from this '<size> <file>' listing"
+                      " instead of stat-ing the files")
+    parser.add_option("--prefix", dest="prefix", default="",
+                      help="Prepend this to file names to stat them")
+    parser.add_option("--workers", dest="workers", type="int", default=20,
+                      help="Number of files to stat in parallel")
     (options, args) = parser.parse_args()
 
-    inputs = (x for x in sys.stdin.readlines())
-    outputs = main(inputs, options.verbose)
-
-    for output in outputs:
-        sys.stdout.write(output + '\n')
-
+    sizes = None
+    if options.size_listing:
+        sizes = read_size_listing(open(options.size_listing, 'r'))
+
+    # readline rather than iteration, which reads ahead
+    input_files = iter(sys.stdin.readline, '')
+    outputs = clean_duplicates(input_files, grouped=options.grouped,
+                               sizes=sizes, prefix=options.prefix,
+                               workers=options.workers,
+                               verbose=options.verbose)
+
+    try:
+        for output in outputs:
+            sys.stdout.write(output + '\n')
+            # Let the next command in the pipeline start on it
+            sys.stdout.flush()
+    except ValueError, e:
+        sys.stderr.write("clean_crab_duplicates.py: %s\n" % e)
+        sys.exit(1)
@@ -48,6 +48,19 @@ dashboard_completion() {
   fi
 }
 
+# Run a command, adding the resources it uses to the given phase of
+# telemetry.json if the telemetry helper is available.
+Telemetry() {
+  local phase=$1
+  shift
+
+  if [ "${FARMOUT_TELEMETRY}" != "" ]; then
+      python "${FARMOUT_TELEMETRY}" --phase=$phase -- "$@"
+  else
+      "$@"
+  fi
+}
+
 outputFileExists() {
   local srm_fname="$1"
 
@@ -74,25 +87,28 @@ RunWithTimeout() {
     "$@" &
     PID=$!
 
-    local start=`date "+%s"`
-    local soft_timeout_time=$(($start + $timeout))
-    local hard_timeout_time=$(($start + $timeout + 60))
-    while [ 1 ]; do
-        if ! kill -0 $PID >& /dev/null; then
-            wait $PID
-            return
-        fi
-        local now=`date "+%s"`
-        if [ $now -gt $hard_timeout_time ]; then
-            echo "Hard killing pid $PID." 2>&1
-            kill -9 $PID
-        elif [ $now -gt $soft_timeout_time ]; then
-            echo "Timed out after waiting $timeout seconds." 2>&1
-            kill $PID
-            soft_timeout_time=$hard_timeout_time
-        fi
-        sleep 1
-    done
+    # Watch for the timeout in the background, so that we can simply
+    # wait for the command and return as soon as it exits.
+    (
+        trap 'kill $sleep_pid >& /dev/null; exit 0' TERM
+        sleep $timeout &
+        sleep_pid=$!
+        wait $sleep_pid
+        echo "Timed out after waiting $timeout seconds." 2>&1
+        kill $PID
+        sleep 60 &
+        sleep_pid=$!
+        wait $sleep_pid
+        echo "Hard killing pid $PID." 2>&1
+        kill -9 $PID
+    ) &
+    local watcher=$!
+
+    wait $PID
+    local rc=$?
+    kill $watcher >& /dev/null
+    wait $watcher
+    return $rc
 }
 
 DoSrmcp() {
@@ -136,6 +152,30 @@ DoSrmcp() {
     return 1
 }
 
+StageOut() {
+    local dest_dir="$1"
+    shift
+
+    if [ "$#" = 0 ]; then
+        return 0
+    fi
+
+    # Copy the files in parallel if the stage-out helper is available
+    if [ "${FARMOUT_STAGEOUT}" != "" ]; then
+        Telemetry stageout python "${FARMOUT_STAGEOUT}" --dest-dir="$dest_dir" --remove-source "$@"
+        return
+    fi
+
+    local file
+    for file in "$@"; do
+        if ! DoSrmcp "$file" "$dest_dir/$file"; then
+            return 1
+        fi
+        rm "$file"
+    done
+    return 0
+}
+
 exitSlowly() {
     local total_runtime=$((`date "+%s"` -  $start_time))
     if [ "$total_runtime" -lt 300 ]; then
@@ -184,14 +224,33 @@ if [ "${DO_RUNTIME_CMSSW_SETUP}" = 1 ]; then
     echo
     echo "Setting up ${CMSSW_VERSION}"
 
-    if ! $scram project CMSSW "${CMSSW_VERSION}"; then
+    # Reuse the project area prepared by an earlier job on this node, if
+    # the cache helper is available
+    user_code_arg=""
+    if [ "${CMSSW_USER_CODE_TGZ}" != "" ]; then
+        user_code_arg="--user-code=${CMSSW_USER_CODE_TGZ}"
+    fi
+    cached_area=0
+    if [ "${FARMOUT_CMSSW_AREA_CACHE}" != "" ]; then
+        if Telemetry setup python "${FARMOUT_CMSSW_AREA_CACHE}" --scram=$scram \
+             $user_code_arg "${CMSSW_VERSION}" "${CMSSW_VERSION}"; then
+            cached_area=1
+        else
+            echo "Failed to set up ${CMSSW_VERSION} from the cache; setting it up here"
+            rm -rf "${CMSSW_VERSION}"
+        fi
+    fi
+fi
+
+if [ "${DO_RUNTIME_CMSSW_SETUP}" = 1 ] && [ "$cached_area" != 1 ]; then
+    if ! Telemetry setup $scram project CMSSW "${CMSSW_VERSION}"; then
         echo "Failed to set up local project area for CMSSW_VERSION ${CMSSW_VERSION}"
         exitSlowly 1
     fi
 
     # copy in user analysis files
     if [ "${CMSSW_USER_CODE_TGZ}" != "" ]; then
-        if ! tar xzf "${CMSSW_USER_CODE_TGZ}" -C "${CMSSW_VERSION}"; then
+        if ! Telemetry setup tar xzf "${CMSSW_USER_CODE_TGZ}" -C "${CMSSW_VERSION}"; then
             echo "Failed to extract ${CMSSW_USER_CODE_TGZ}"
             exitSlowly 1
         fi
@@ -203,9 +262,11 @@ if [ "${DO_RUNTIME_CMSSW_SETUP}" = 1 ]; then
     # sandbox ownership to condor" See
     # https://condor-wiki.cs.wisc.edu/index.cgi/tktview?tn=2904
 
-    find ${CMSSW_VERSION} -type d -exec chmod a+rx '{}' \;
-    chmod -R a+r ${CMSSW_VERSION}
+    Telemetry setup find ${CMSSW_VERSION} -type d -exec chmod a+rx '{}' \;
+    Telemetry setup chmod -R a+r ${CMSSW_VERSION}
+fi
 
+if [ "${DO_RUNTIME_CMSSW_SETUP}" = 1 ]; then
     cd ${CMSSW_VERSION}
 
     eval `$scram runtime -sh`
@@ -221,8 +282,7 @@ fi
 export PATH="`pwd`:$PATH"
 
 if [ "${FARMOUT_DASHBOARD_REPORTER}" != "" ]; then
-    ${FARMOUT_DASHBOARD_REPORTER} submission
-    ${FARMOUT_DASHBOARD_REPORTER} execution
+    ${FARMOUT_DASHBOARD_REPORTER} submission execution
 fi
 
 # create directory for intermediate output
@@ -284,7 +344,7 @@ for cfg in ${jobcfgs//,/ }; do
     echo "farmout: starting $cmsRun with INPUT=$INPUT and OUTPUT=$OUTPUT at `date`"
     echo "and arguments: $@"
 
-    /usr/bin/time -p -o exe_time $cmsRun "$@"
+    Telemetry run /usr/bin/time -p -o exe_time $cmsRun "$@"
     cmsRun_rc=$?
 
     echo "farmout: $cmsRun exited with status $cmsRun_rc at `date`"
@@ -292,7 +352,7 @@ for cfg in ${jobcfgs//,/ }; do
     echo "farmout: starting cmsRun $cfg at `date`"
 
     jobreport="${cfg%.*}.xml"
-    /usr/bin/time -p -o exe_time cmsRun --jobreport=$jobreport $cfg "$@"
+    Telemetry run /usr/bin/time -p -o exe_time cmsRun --jobreport=$jobreport $cfg "$@"
     cmsRun_rc=$?
 
     echo "farmout: cmsRun $cfg exited with status $cmsRun_rc at `date`"
@@ -376,31 +436,22 @@ if [ "$JOB_GENERATES_OUTPUT_NAME" != 1 ]; then
     echo "$cmsRun did not produce expected datafile $datafile"
     exitSlowly $FAIL_JOB
   fi
+fi
+
+# Copy the datafile and all other root files in the directory
 
-  if [ "$SRM_OUTPUT_DIR" != "" ]; then
-    if ! DoSrmcp "$datafile" "$SRM_OUTPUT_FILE"; then
+if [ "$SRM_OUTPUT_DIR" != "" ]; then
+  outputFiles=`ls -1 *.root 2>/dev/null`
+  if [ "$JOB_GENERATES_OUTPUT_NAME" != 1 ]; then
+    outputFiles="$datafile `echo \"$outputFiles\" | grep -v -x -F \"$datafile\"`"
+  fi
+  if ! StageOut "$SRM_OUTPUT_DIR" $outputFiles; then
       dashboard_completion 60307
       rm -f *.root
       exitSlowly 1
-    fi
-
-    rm $datafile
   fi
 fi
 
-# Copy all other root files in the directory also
-
-if [ "$SRM_OUTPUT_DIR" != "" ]; then
-  for file in `ls -1 *.root 2>/dev/null`; do
-      if ! DoSrmcp $file $SRM_OUTPUT_DIR/$file; then
-          dashboard_completion 60307
-          rm -f *.root
-	  exitSlowly 1
-      fi
-      rm $file
-  done
-fi
-
 dashboard_completion 0
 
 exit 0
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+
+'''
+
+Set up a CMSSW project area for a job from a cache kept on the worker node.
+
+With --no-shared-fs, every job used to create its CMSSW project area with
+scram project, extract the user code into it and make it readable by all,
+which can take longer than a short job itself.  cmsRun.sh runs this instead:
+
+    cmsswAreaCache.py --user-code=user_code.tgz CMSSW_5_3_9 CMSSW_5_3_9
+
+The first job on a node prepares the area in the cache, under a name made
+from the release, SCRAM_ARCH and a hash of the user code tarball.  Jobs
+which need the same area hard link its files into their own working
+directory, and then run scram b ProjectRename to move it there.  Only the
+directories are created anew.  The files of the cached area are made read
+only, so that a job cannot change them for the jobs after it.  The .SCRAM
+and config directories, which ProjectRename rewrites, are copied instead.
+If the cache is on another file system than the job, the files are copied.
+
+The cache is in $FARMOUT_CMSSW_CACHE_DIR, or in farmout-cmssw-cache-<uid>
+under $OSG_WN_TMP or /tmp.  Jobs preparing the same area wait for each
+other through a lock on the area.  Beyond --max-entries areas, the least
+recently used ones are removed, skipping any that a job is still using.
+
+If this fails, the job should set up its project area without the cache.
+
+'''
+
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+# Directories of a project area which scram b ProjectRename rewrites
+COPIED_DIRS = ['.SCRAM', 'config']
+
+LAST_USED = '.last_used'
+
+def default_cache_dir():
+    '''
+    Not in tempfile.gettempdir(), as condor may point TMPDIR to the job's
+    own scratch directory.
+    '''
+    if os.environ.get('FARMOUT_CMSSW_CACHE_DIR'):
+        return os.environ['FARMOUT_CMSSW_CACHE_DIR']
+    return os.path.join(os.environ.get('OSG_WN_TMP') or '/tmp',
+                        'farmout-cmssw-cache-%i' % os.getuid())
+
+def file_hash(filename):
+    ''' SHA1 of the contents of a file '''
+    digest = hashlib.sha1()
+    fd = open(filename, 'rb')
+    while True:
+        data = fd.read(1 << 20)
+        if not data:
+            break
+        digest.update(data)
+    fd.close()
+    return digest.hexdigest()
+
+def entry_name(version, arch, user_code_hash=None):
+    '''
+    Name of the cached area of a release and user code
+
+    >>> entry_name('CMSSW_5_3_9', 'slc5_amd64_gcc462', 'd3b07384d113edec49eaa6238ad5ff00')
+    'CMSSW_5_3_9-slc5_amd64_gcc462-d3b07384d113'
+    >>> entry_name('CMSSW_5_3_9', 'slc5_amd64_gcc462')
+    'CMSSW_5_3_9-slc5_amd64_gcc462-nousercode'
+    '''
+    return '%s-%s-%s' % (version, arch or 'noarch',
+                         (user_code_hash or 'nousercode')[:12])
+
+def lock(filename, blocking=True):
+    ''' Lock a file, returning its descriptor, or None if it is in use '''
+    fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0600)
+    flags = fcntl.LOCK_EX
+    if not blocking:
+        flags |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(fd, flags)
+    except IOError, e:
+        os.close(fd)
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return None
+        raise
+    return fd
+
+def unlock(fd):
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+def run(command, cwd=None):
+    ''' Run a command, raising OSError if it fails '''
+    sys.stdout.flush()
+    rc = subprocess.call(command, cwd=cwd)
+    if rc != 0:
+        raise OSError(rc, "%s exited with status %i" % (' '.join(command), rc))
+
+def set_permissions(top):
+    '''
+    Make directories readable and searchable by all, and files readable by
+    all but writable by nobody.  Condor privsep fails to take back a sandbox
+    with private files in it.
+    '''
+    for dir, dirs, files in os.walk(top):
+        os.chmod(dir, os.stat(dir).st_mode | 0555)
+        for name in files:
+            path = os.path.join(dir, name)
+            if os.path.islink(path):
+                continue
+            mode = os.stat(path).st_mode
+            os.chmod(path, (mode | 0444) & ~0222)
+
+def prepare(entry_dir, version, user_code, scram):
+    ''' Create the project area of an entry of the cache '''
+    tmp = '%s.tmp.%i' % (entry_dir, os.getpid())
+    os.mkdir(tmp)
+    try:
+        run([scram, 'project', 'CMSSW', version], cwd=tmp)
+        if user_code:
+            run(['tar', 'xzf', os.path.abspath(user_code),
+                 '-C', os.path.join(tmp, version)])
+        set_permissions(tmp)
+        os.rename(tmp, entry_dir)
+    except:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+def link_tree(src, dest, copied=COPIED_DIRS):
+    '''
+    Recreate the directories of src in dest, and hard link the files,
+    except those under the copied top level directories.  Files are copied
+    if they cannot be linked.  Returns the number of files linked.
+
+    >>> import tempfile
+    >>> top = tempfile.mkdtemp()
+    >>> os.makedirs(os.path.join(top, 'src', 'lib'))
+    >>> os.makedirs(os.path.join(top, 'src', 'config'))
+    >>> open(os.path.join(top, 'src', 'lib', 'a.so'), 'w').write('a')
+    >>> open(os.path.join(top, 'src', 'config', 'b'), 'w').write('b')
+    >>> link_tree(os.path.join(top, 'src'), os.path.join(top, 'dest'))
+    1
+    >>> os.stat(os.path.join(top, 'dest', 'lib', 'a.so')).st_nlink
+    2
+    >>> os.stat(os.path.join(top, 'dest', 'config', 'b')).st_nlink
+    1
+    '''
+    linked = [0]
+    can_link = [True]
+    def copy_file(source, target, link):
+        if link and can_link[0]:
+            try:
+                os.link(source, target)
+                linked[0] += 1
+                return
+            except OSError, e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+                # e.g. the cache is on another file system
+                can_link[0] = False
+        shutil.copy2(source, target)
+        if not link:
+            os.chmod(target, os.stat(target).st_mode | stat.S_IWUSR)
+
+    for dir, dirs, files in os.walk(src):
+        rel = os.path.relpath(dir, src)
+        top = rel.split(os.sep)[0]
+        link = top not in copied
+        target_dir = os.path.normpath(os.path.join(dest, rel))
+        os.mkdir(target_dir)
+        os.chmod(target_dir, 0755)
+        for name in dirs[:]:
+            path = os.path.join(dir, name)
+            if os.path.islink(path):
+                # os.walk does not follow links to directories
+                os.symlink(os.readlink(path), os.path.join(target_dir, name))
+                dirs.remove(name)
+        for name in files:
+            path = os.path.join(dir, name)
+            target = os.path.join(target_dir, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), target)
+            else:
+                copy_file(path, target, link)
+    return linked[0]
+
+def evict(cache_dir, max_entries, keep):
+    '''
+    Remove the least recently used areas beyond max_entries, other than
+    keep and those in use.
+    '''
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name == keep or '.' in name or not os.path.isdir(path):
+            continue
+        try:
+            last_used = os.path.getmtime(os.path.join(path, LAST_USED))
+        except OSError:
+            last_used = 0
+        entries.append((last_used, name))
+    entries.sort()
+    removed = []
+    # keep counts as one of the entries
+    while len(entries) > max_entries - 1:
+        last_used, name = entries.pop(0)
+        fd = lock(os.path.join(cache_dir, name + '.lock'), blocking=False)
+        if fd is None:
+            continue
+        try:
+            path = os.path.join(cache_dir, name)
+            # Out of the way at once, so no job finds it half removed
+            trash = '%s.tmp.%i' % (path, os.getpid())
+            os.rename(path, trash)
+            for dir, dirs, files in os.walk(trash):
+                os.chmod(dir, 0700)
+            shutil.rmtree(trash, ignore_errors=True)
+            removed.append(name)
+        finally:
+            unlock(fd)
+    return removed
+
+def main():
+    parser = OptionParser(usage="%prog [options] CMSSW_VERSION dest_dir")
+    parser.add_option("--user-code", dest="user_code", default=None,
+                      help="Tarball of user code to extract into the area")
+    parser.add_option("--cache-dir", dest="cache_dir",
+                      default=default_cache_dir(),
+                      help="Directory of the cache [default: %default]")
+    parser.add_option("--scram", dest="scram", default="scramv1",
+                      help="scram command [default: %default]")
+    parser.add_option("--max-entries", dest="max_entries", type="int",
+                      default=3, help="Number of areas to keep in the cache"
+                      " [default: %default]")
+    (options, args) = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error("A CMSSW version and destination are required")
+    version, dest = args
+    if os.path.exists(dest):
+        sys.stderr.write("%s already exists\n" % dest)
+        return 1
+
+    user_code_hash = None
+    if options.user_code:
+        user_code_hash = file_hash(options.user_code)
+    name = entry_name(version, os.environ.get('SCRAM_ARCH'), user_code_hash)
+
+    cache_dir = options.cache_dir
+    try:
+        os.makedirs(cache_dir, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    entry_dir = os.path.join(cache_dir, name)
+
+    start = time.time()
+    fd = lock(entry_dir + '.lock')
+    try:
+        if not os.path.isdir(entry_dir):
+            print "Preparing %s in the cache %s" % (name, cache_dir)
+            # Left by jobs which did not finish preparing it
+            for stale in os.listdir(cache_dir):
+                if stale.startswith(name + '.tmp.'):
+                    shutil.rmtree(os.path.join(cache_dir, stale),
+                                  ignore_errors=True)
+            prepare(entry_dir, version, options.user_code, options.scram)
+        else:
+            print "Using %s from the cache %s" % (name, cache_dir)
+        open(os.path.join(entry_dir, LAST_USED), 'w').close()
+        linked = link_tree(os.path.join(entry_dir, version), dest)
+    finally:
+        unlock(fd)
+    print "Linked %i files of %s in %.1f seconds" % (
+        linked, name, time.time() - start)
+
+    run([options.scram, 'b', 'ProjectRename'], cwd=dest)
+
+    fd = lock(os.path.join(cache_dir, '.lock'))
+    try:
+        for removed in evict(cache_dir, options.max_entries, name):
+            print "Removed %s from the cache" % removed
+    finally:
+        unlock(fd)
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    except (IOError, OSError), e:
+        sys.stderr.write("cmsswAreaCache.py: %s\n" % e)
+        ret = 1
+    sys.exit(ret)
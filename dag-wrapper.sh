@@ -48,9 +48,15 @@ please contact help@hep.wisc.edu.
 Thanks!
 EOF
 
-pattern=$(sed -nre '/STATUS_ERROR/!d; s/^JOB (.*) STATUS_.*/\1/p' < "${OUTPUT_DAG_FILE}.status" | tr '\n' '|')
+# Nodes of sharded steps are named <splice>+<job> in the status file
+pattern=$(sed -nre '/STATUS_ERROR/!d; s/^JOB ([^ ]*\+)?([^ ]*) STATUS_.*/\2/p' < "${OUTPUT_DAG_FILE}.status" | tr '\n' '|')
 pattern="($pattern)"
-sed -nre "s;^JOB $pattern (.*)/submit;\2/\1.err;p" < "${OUTPUT_DAG_FILE}" > "$tmpdir/errs"
+splices=$(sed -nre 's/^SPLICE [^ ]+ (.*)/\1/p' < "${OUTPUT_DAG_FILE}")
+(
+# DAGs written before the nodes shared one submit file
+sed -nre "s;^JOB $pattern (.*)/submit(\.[0-9]+)?$;\2/\1.err;p" < "${OUTPUT_DAG_FILE}"
+cat "${OUTPUT_DAG_FILE}" $splices | sed -nre "s;^VARS $pattern .* job_error=\"([^\"]*)\"$;\2;p"
+) > "$tmpdir/errs"
 
 if [ -s "$tmpdir/errs" ]; then
     (
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+
+'''
+
+Write the DAG of a farmoutAnalysisJobs workflow in one pass.
+
+farmoutAnalysisJobs --output-dag-file lists the nodes of a workflow step in a
+node file, one tab separated line per job:
+
+    <job> <initial dir> <arguments> <input files> <stdout> <stderr> <log> <output file> <parent jobs>
+
+where the parent jobs are separated by spaces.  This writes one submit
+description shared by all of the nodes, with the per-job commands taken from
+DAG VARS, and appends the nodes to the DAG:
+
+    dagBuilder.py --nodes=dag_nodes.txt --submit-header=submit \\
+        --dag=/path/to/workflow.dag --outputs=dag_outputs.txt
+
+Steps with more than --shard-size nodes are split into shards, each written
+to its own DAG file and included with SPLICE, so that no single DAG file
+grows without bound.  With --max-jobs, the nodes of the step are put in a
+category which DAGMan lets run at most that many jobs at once.
+
+The output file of each job is written to --outputs, as lines of
+"<job> <DAG node> <output file>", where the node is the splice that holds the
+job if the step is sharded.  A later step gives this file as --parents-from,
+so it can find its inputs and the nodes it depends on without reading the
+submit files of the earlier step.  DAGMan cannot make a node depend on a node
+inside a splice, so a step that depends on a sharded step waits for the
+whole shard of each parent, and a job that fails in a shard blocks the
+children of every job in it.  Sharding is therefore off unless asked for.
+
+'''
+
+import os
+import sys
+from optparse import OptionParser
+
+NODE_FIELDS = ['job', 'initialdir', 'arguments', 'inputs', 'stdout',
+               'stderr', 'log', 'output', 'parents']
+
+# DAG VARS of the node fields.  Names of submit commands cannot be used,
+# as the VARS would replace the commands themselves.
+NODE_VARS = [('initialdir', 'job_dir'), ('arguments', 'job_args'),
+             ('inputs', 'job_inputs'), ('stdout', 'job_stdout'),
+             ('stderr', 'job_stderr'), ('log', 'job_log')]
+
+SUBMIT_COMMANDS = '''
+InitialDir           = $(job_dir)
+Arguments            = "$(job_args)"
+Transfer_Input_Files = $(job_inputs)
+output               = $(job_stdout)
+error                = $(job_stderr)
+Log                  = $(job_log)
+Queue
+'''
+
+def read_nodes(filename):
+    '''
+    Read the node file into a list of dictionaries
+
+    >>> from StringIO import StringIO
+    >>> nodes = read_nodes(StringIO("a\\t/s/a\\tx.py a.root /o\\tx.py\\t"
+    ...                             "a.out\\ta.err\\ta.log\\t/o/a.root\\tp q\\n"))
+    >>> nodes[0]['job'], nodes[0]['parents']
+    ('a', ['p', 'q'])
+    '''
+    fd = filename
+    if not hasattr(fd, 'read'):
+        fd = open(filename, 'r')
+    nodes = []
+    for line in fd:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != len(NODE_FIELDS):
+            continue
+        node = dict(zip(NODE_FIELDS, fields))
+        node['parents'] = node['parents'].split()
+        nodes.append(node)
+    return nodes
+
+def read_outputs(fd):
+    '''
+    Read an outputs file into a dictionary of job -> (node, output).  The
+    jobs of a later step know their parents by the names of their input
+    files, so the jobs are also listed under the name of their output file.
+
+    >>> from StringIO import StringIO
+    >>> outputs = read_outputs(StringIO("a s_dag_shard0 /o/a-out.root\\n"))
+    >>> outputs['a'] == outputs['a-out']
+    True
+    '''
+    if not hasattr(fd, 'read'):
+        fd = open(fd, 'r')
+    outputs = {}
+    for line in fd:
+        fields = line.split()
+        if len(fields) != 3:
+            continue
+        job, node, output = fields
+        outputs[job] = (node, output)
+        name = os.path.basename(output)
+        if name.endswith('.root'):
+            outputs.setdefault(name[:-5], (node, output))
+    return outputs
+
+def quote_var(value):
+    '''
+    Quote a value for DAG VARS
+
+    >>> print quote_var('x.py a.root \\'a=""b""\\'')
+    "x.py a.root 'a=\\"\\"b\\"\\"'"
+    '''
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+def node_lines(node, category=None):
+    ''' JOB, VARS and CATEGORY lines of a node '''
+    job = node['job']
+    lines = ['JOB %s %s\n' % (job, node['submit_file'])]
+    vars = ['%s=%s' % (var, quote_var(node[field]))
+            for field, var in NODE_VARS]
+    # Absolute, so the error output of failed jobs can be found from the DAG
+    vars.append('job_error=%s' % quote_var(
+        os.path.join(node['initialdir'], node['stderr'])))
+    lines.append('VARS %s %s\n' % (job, ' '.join(vars)))
+    if category:
+        lines.append('CATEGORY %s %s\n' % (job, category))
+    return lines
+
+def split(items, size):
+    '''
+    Split items into consecutive groups of at most size items
+
+    >>> split(range(5), 2)
+    [[0, 1], [2, 3], [4]]
+    '''
+    return [items[i:i+size] for i in range(0, len(items), size)]
+
+def unique_name(dir, stem, ext):
+    ''' A file name in dir that does not exist yet '''
+    name = os.path.join(dir, stem + ext)
+    n = 1
+    while os.path.exists(name):
+        name = os.path.join(dir, '%s.%i%s' % (stem, n, ext))
+        n += 1
+    return name
+
+def build_dag(nodes, submit_file, dag_file, work_dir, step_name,
+              parent_outputs=None, shard_size=0, max_jobs=0):
+    '''
+    Append the nodes of a step to the DAG, sharded if there are more than
+    shard_size of them.  Returns a list of (job, DAG node, output file).
+    '''
+    parent_outputs = parent_outputs or {}
+    for node in nodes:
+        node['submit_file'] = submit_file
+
+    def parent_refs(nodes):
+        refs = []
+        seen = set()
+        for node in nodes:
+            for parent in node['parents']:
+                ref = parent_outputs.get(parent, (parent, None))[0]
+                if ref not in seen:
+                    seen.add(ref)
+                    refs.append(ref)
+        return refs
+
+    dag = []
+    outputs = []
+    if shard_size <= 0 or len(nodes) <= shard_size:
+        category = max_jobs and step_name or None
+        for node in nodes:
+            dag.extend(node_lines(node, category))
+            refs = parent_refs([node])
+            if refs:
+                dag.append('PARENT %s CHILD %s\n'
+                           % (' '.join(refs), node['job']))
+            outputs.append((node['job'], node['job'], node['output']))
+        if max_jobs:
+            dag.append('MAXJOBS %s %i\n' % (category, max_jobs))
+    else:
+        # A category shared by the shards must be global, marked with a +
+        category = max_jobs and ('+' + step_name) or None
+        for i, shard in enumerate(split(nodes, shard_size)):
+            shard_file = unique_name(work_dir, 'dag_shard%i' % i, '.dag')
+            splice = '%s_%s' % (step_name,
+                                os.path.basename(shard_file)[:-4].replace('.', '_'))
+            lines = []
+            for node in shard:
+                lines.extend(node_lines(node, category))
+                outputs.append((node['job'], splice, node['output']))
+            fd = open(shard_file, 'w')
+            fd.write(''.join(lines))
+            fd.close()
+            dag.append('SPLICE %s %s\n' % (splice, shard_file))
+            refs = parent_refs(shard)
+            if refs:
+                dag.append('PARENT %s CHILD %s\n' % (' '.join(refs), splice))
+        if max_jobs:
+            dag.append('MAXJOBS %s %i\n' % (category, max_jobs))
+
+    fd = open(dag_file, 'a')
+    fd.write(''.join(dag))
+    fd.close()
+    return outputs
+
+def write_submit_file(header_file, submit_file):
+    ''' The submit description shared by all nodes of a step '''
+    fd = open(submit_file, 'w')
+    fd.write(open(header_file, 'r').read())
+    fd.write(SUBMIT_COMMANDS)
+    fd.close()
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--nodes", dest="nodes",
+                      help="Node file written by farmoutAnalysisJobs")
+    parser.add_option("--submit-header", dest="submit_header",
+                      help="Submit commands common to all jobs")
+    parser.add_option("--dag", dest="dag", help="DAG file to append to")
+    parser.add_option("--outputs", dest="outputs",
+                      help="Write the output file of each job here")
+    parser.add_option("--parents-from", dest="parents_from", default=None,
+                      help="Outputs file of the step this one depends on")
+    parser.add_option("--step-name", dest="step_name", default=None,
+                      help="Name of the step, used for shards and categories"
+                      " [default: name of the node file's directory]")
+    parser.add_option("--shard-size", dest="shard_size", type="int",
+                      default=0, help="Split steps with more nodes than this"
+                      " into splices (0 for never) [default: %default]")
+    parser.add_option("--max-jobs", dest="max_jobs", type="int", default=0,
+                      help="Maximum number of jobs of the step to run at once"
+                      " (0 for no limit) [default: %default]")
+    (options, args) = parser.parse_args()
+
+    for required in ('nodes', 'submit_header', 'dag', 'outputs'):
+        if getattr(options, required) is None:
+            parser.error("--%s is required" % required.replace('_', '-'))
+
+    work_dir = os.path.dirname(os.path.abspath(options.nodes))
+    step_name = options.step_name or os.path.basename(work_dir)
+    # DAGMan does not allow '+' or '.' in node and category names
+    step_name = step_name.replace('+', '_').replace('.', '_')
+
+    nodes = read_nodes(options.nodes)
+    if not nodes:
+        sys.stderr.write("No jobs to add to %s\n" % options.dag)
+        open(options.outputs, 'a').close()
+        return 0
+
+    parent_outputs = {}
+    if options.parents_from and os.path.exists(options.parents_from):
+        parent_outputs = read_outputs(options.parents_from)
+
+    submit_file = unique_name(work_dir, 'dag', '.sub')
+    write_submit_file(options.submit_header, submit_file)
+    outputs = build_dag(nodes, submit_file, options.dag, work_dir, step_name,
+                        parent_outputs, options.shard_size, options.max_jobs)
+
+    fd = open(options.outputs, 'a')
+    fd.write(''.join(['%s %s %s\n' % x for x in outputs]))
+    fd.close()
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
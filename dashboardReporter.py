@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+'''
+
+Send a batch of messages to the CMS dashboard from one process.
+
+farmout_dashboard.sh gives this the messages of all the phases it reports
+on stdin, one per line.  Each message is a list of shell quoted param=value
+words, as given to report.py from the cmsdashboard_reporter package:
+
+    MonitorID='task' MonitorJobID='1_https://sid' ExeTime='10' ExeExitCode='0'
+
+The dashboard API is loaded once and all messages are sent through one ApMon
+instance and its UDP socket.  ApMon is given a second to send its last
+packets when it is freed, which is now paid once per batch rather than once
+per message.  Each message is logged to report.log as report.py does.
+
+ApMon does not report errors from sending a packet, so the only failure that
+can be seen is that no ApMon instance with a destination can be made, e.g.
+if the dashboard host cannot be resolved.  This is retried a few times, and
+if it still fails the messages are kept in a queue file, by default
+.dashboard-queue in the current directory.  They are sent ahead of the
+messages of the next batch sent from that directory.
+
+Example, sending to a local listener instead of the dashboard:
+
+    dashboardReporter.py --reporter-dir=cmsdashboard_reporter \\
+        --destination=localhost:8884 < messages.txt
+
+'''
+
+import os
+import shlex
+import sys
+import time
+from optparse import OptionParser
+
+QUEUE_NAME = '.dashboard-queue'
+
+def load_dashboard_api(reporter_dir=None):
+    ''' The DashboardAPI module of the reporter package, or None '''
+    if reporter_dir:
+        sys.path.insert(0, os.path.abspath(reporter_dir))
+    try:
+        import DashboardAPI
+    except ImportError:
+        return None
+    return DashboardAPI
+
+def parse_message(line):
+    '''
+    Split a message into the param=value arguments report.py would get
+
+    >>> parse_message("MonitorID='t' MonitorJobID='1_https://s' exe='cms Run'")
+    ['MonitorID=t', 'MonitorJobID=1_https://s', 'exe=cms Run']
+    '''
+    return shlex.split(line)
+
+class MessageQueue(object):
+    '''
+    MessageQueue
+
+    Messages which could not be sent, kept one per line in a file.
+
+    >>> import tempfile
+    >>> queue = MessageQueue(os.path.join(tempfile.mkdtemp(), QUEUE_NAME))
+    >>> queue.put(["a='1'", "b='2'"])
+    >>> queue.take()
+    ["a='1'", "b='2'"]
+    >>> queue.take()
+    []
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+
+    def take(self):
+        ''' Remove and return the queued messages '''
+        if not os.path.exists(self.filename):
+            return []
+        messages = [x.rstrip('\n') for x in open(self.filename, 'r')]
+        os.remove(self.filename)
+        return [x for x in messages if x.strip()]
+
+    def put(self, messages):
+        if not messages:
+            return
+        fd = open(self.filename, 'a')
+        fd.write(''.join([x + '\n' for x in messages]))
+        fd.close()
+
+class DashboardReporter(object):
+    '''
+    DashboardReporter
+
+    Sends messages through one ApMon instance of the dashboard API.
+    '''
+    def __init__(self, api, destination=None, retries=3, retry_wait=2.0,
+                 max_rate=None, log=None):
+        self.api = api
+        self.retries = retries
+        self.retry_wait = retry_wait
+        self.max_rate = max_rate
+        self.log = log or (lambda x: None)
+        if destination:
+            # Same options as the dashboard destination
+            options = self.api.apmonConf.values()[0]
+            self.api.apmonConf = {destination: options}
+            self.api.apmonUseUrl = False
+
+    def connect(self):
+        ''' Return the ApMon instance, or None if it has no destination '''
+        for attempt in range(self.retries):
+            if attempt:
+                time.sleep(self.retry_wait*attempt)
+                # Let the API try to make an instance again
+                self.api.apmonInit = False
+            apm = self.api.getApmonInstance()
+            if apm is not None and apm.initializedOK():
+                if self.max_rate:
+                    apm.setMaxMsgRate(self.max_rate)
+                return apm
+            self.api.apmonInstance = None
+            self.log("No dashboard destination (attempt %i of %i)"
+                     % (attempt + 1, self.retries))
+        return None
+
+    def send(self, messages):
+        '''
+        Send the messages, returning those that could not be sent.
+        '''
+        if not messages:
+            return []
+        if self.connect() is None:
+            return messages
+        api = self.api
+        for message in messages:
+            contextArgs, paramArgs = api.filterArgs(
+                api.readArgs(parse_message(message)))
+            context = api.getContext(contextArgs)
+            taskId = context['MonitorID']
+            jobId = context['MonitorJobID']
+            # The same log lines as report.py, which jobExitSummary.py reads
+            api.logger('SENDING with Task:%s Job:%s' % (taskId, jobId))
+            api.logger('params : ' + repr(paramArgs))
+            api.apmonSend(taskId, jobId, paramArgs)
+        api.apmonFree()
+        return []
+
+def main():
+    parser = OptionParser(usage="%prog [options] < messages")
+    parser.add_option("--reporter-dir", dest="reporter_dir",
+                      default=os.environ.get('CMS_DASHBOARD_REPORTER'),
+                      help="Directory of the cmsdashboard_reporter package"
+                      " [default: $CMS_DASHBOARD_REPORTER]")
+    parser.add_option("--destination", dest="destination", default=None,
+                      help="Send to this host:port instead of the dashboard")
+    parser.add_option("--queue", dest="queue", default=QUEUE_NAME,
+                      help="Keep messages which could not be sent in this"
+                      " file, and send them with the next batch"
+                      " [default: %default]")
+    parser.add_option("--retries", dest="retries", type="int", default=3,
+                      help="Attempts to find a destination [default: %default]")
+    parser.add_option("--max-rate", dest="max_rate", type="int", default=None,
+                      help="Messages per second ApMon may send before it"
+                      " drops them [default: ApMon's]")
+    (options, args) = parser.parse_args()
+
+    api = load_dashboard_api(options.reporter_dir)
+    if api is None:
+        sys.stderr.write("Cannot import DashboardAPI from %s. Dashboard will"
+                         " not be updated.\n" % options.reporter_dir)
+        return 1
+
+    def log(message):
+        sys.stderr.write(message + '\n')
+
+    queue = MessageQueue(options.queue)
+    messages = queue.take()
+    messages.extend([x.rstrip('\n') for x in sys.stdin if x.strip()])
+    reporter = DashboardReporter(api, options.destination, options.retries,
+                                 max_rate=options.max_rate, log=log)
+    unsent = reporter.send(messages)
+    queue.put(unsent)
+    if unsent:
+        log("Queued %i messages in %s" % (len(unsent), options.queue))
+        return 1
+    print "Parameters sent to Dashboard."
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
@@ -0,0 +1,150 @@
+'''
+
+Local cache of DBS dataset catalogues.
+
+A catalogue is the list of files of a dataset, with the (run, lumi) sections
+in each file, as returned by CRAB's DataDiscovery.  Fetching one can take
+minutes for a large dataset, so catalogues are kept in a cache directory,
+one file per query, and reused until they are older than the time to live.
+
+Catalogue files are JSON lines: a header
+
+    {"query": {...}, "created": 1300000000}
+
+followed by one line per file:
+
+    {"file": "/store/...", "lumis": [[run, lumi], ...]}
+
+The same format is used to record the response of DBS to a query, so that a
+recording can stand in for DBS later:
+
+    dbsMaskFiles.py --record=zmumu.json /Zmumu/.../RECO mask.json
+    dbsMaskFiles.py --recorded-dbs=zmumu.json /Zmumu/.../RECO mask.json
+
+'''
+
+import os
+import time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+def default_cache_dir():
+    return os.environ.get('FARMOUT_DBS_CACHE',
+                          os.path.expanduser('~/.farmout/dbs_cache'))
+
+def query_key(query):
+    '''
+    Name of the cache file for a query, which is a dictionary of strings
+
+    >>> query_key({'dataset': '/A/B/RECO', 'runselection': ''})
+    '18372251cbcbfdd0b19df6e27c176cdab13fe5d0.json'
+    '''
+    items = sorted(query.items())
+    return sha1(repr(items)).hexdigest() + '.json'
+
+def read_catalogue(filename):
+    '''
+    Return the header of a catalogue file and a generator of its
+    (file, lumis) entries.  The entries are read as they are generated.
+    '''
+    fd = open(filename, 'r')
+    header = json.loads(fd.readline())
+    def entries():
+        try:
+            for line in fd:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                yield entry['file'], entry['lumis']
+        finally:
+            fd.close()
+    return header, entries()
+
+def write_catalogue(filename, query, entries):
+    '''
+    Generate the (file, lumis) entries while writing them to a catalogue
+    file.  The file is written under a temporary name and only renamed into
+    place once all entries have been generated, so an interrupted write
+    never leaves an incomplete catalogue behind.
+
+    >>> import tempfile
+    >>> name = os.path.join(tempfile.mkdtemp(), 'c.json')
+    >>> entries = [('/store/a.root', [(1, 2), (1, 3)]), ('/store/b.root', [])]
+    >>> list(write_catalogue(name, {'dataset': '/A/B/C'}, entries)) == entries
+    True
+    >>> header, entries = read_catalogue(name)
+    >>> header['query']
+    {u'dataset': u'/A/B/C'}
+    >>> list(entries)
+    [(u'/store/a.root', [[1, 2], [1, 3]]), (u'/store/b.root', [])]
+    '''
+    dir = os.path.dirname(filename)
+    if dir and not os.path.isdir(dir):
+        os.makedirs(dir)
+    tmp = '%s.%i.tmp' % (filename, os.getpid())
+    fd = open(tmp, 'w')
+    try:
+        fd.write(json.dumps({'query': query, 'created': int(time.time())})
+                 + '\n')
+        for file, lumis in entries:
+            fd.write(json.dumps({'file': file, 'lumis': list(lumis)}) + '\n')
+            yield file, lumis
+        fd.close()
+        os.rename(tmp, filename)
+    finally:
+        if not fd.closed:
+            fd.close()
+            os.remove(tmp)
+
+class CatalogueCache(object):
+    '''
+    CatalogueCache
+
+    Catalogues stored in a directory, keyed by query, which expire after
+    ttl seconds.
+
+    >>> import tempfile
+    >>> cache = CatalogueCache(tempfile.mkdtemp(), ttl=3600)
+    >>> query = {'dataset': '/A/B/C'}
+    >>> print cache.lookup(query)
+    None
+    >>> list(cache.store(query, [('/store/a.root', [(1, 2)])]))
+    [('/store/a.root', [(1, 2)])]
+    >>> list(cache.lookup(query))
+    [(u'/store/a.root', [[1, 2]])]
+    >>> print CatalogueCache(cache.dir, ttl=-1).lookup(query)
+    None
+    '''
+    def __init__(self, dir, ttl=24*3600):
+        self.dir = dir
+        self.ttl = ttl
+
+    def path(self, query):
+        return os.path.join(self.dir, query_key(query))
+
+    def lookup(self, query):
+        ''' Generator of the cached entries, or None if missing or expired '''
+        path = self.path(query)
+        if not os.path.exists(path):
+            return None
+        try:
+            header, entries = read_catalogue(path)
+        except (IOError, ValueError):
+            return None
+        if header.get('query') != query:
+            return None
+        if time.time() - header.get('created', 0) > self.ttl:
+            return None
+        return entries
+
+    def store(self, query, entries):
+        ''' Generate the entries while adding them to the cache '''
+        return write_catalogue(self.path(query), query, entries)
@@ -8,12 +8,27 @@ Author: Evan K. Friis, UW Madison
 Retrieve a list of logical file names from a DBS dataset that have valid lumi
 blocks in them.  The luminosity mask is defined by a JSON file.
 
+The catalogue of all files in the dataset and their lumi sections is fetched
+from DBS through CRAB, and the mask and run range are applied to it locally
+(see lumiMask.py).  The catalogue is cached (see dbsCatalogue.py) and reused
+by later submissions, with any mask, until it is older than --cache-ttl
+hours.  With --recorded-dbs, a catalogue recorded earlier with --record is
+used in place of DBS, and CRAB is not needed.
+
+With --lumi-counts, each file is followed by its number of masked lumi
+sections, as planJobs.py --event-counts expects.
+
 '''
 
 import sys
 import logging
 import tempfile
 
+from dbsCatalogue import (CatalogueCache, default_cache_dir, read_catalogue,
+                          write_catalogue)
+from expandRunRange import RunRange
+from lumiMask import LumiMask
+
 try:
     import DataDiscovery
 except ImportError:
@@ -22,19 +37,44 @@ except ImportError:
 try:
     import RecoLuminosity.LumiDB.argparse as argparse
 except ImportError:
-    argparse = None
-
-def main():
-    if DataDiscovery is None:
-        sys.stderr.write("Could not import CRAB DataDiscovery tool!\n"
-                "Make sure your environment is setup for crab.\n"
-                "https://twiki.cern.ch/twiki/bin/view/CMSPublic/SWGuideCrab\n")
-    elif argparse is None:
-        sys.stderr.write("Could not import argparse from RecoLuminosity.LumiDB\n"
-                    "Make sure your environment is setup for CMSSW\n")
-    if not all((DataDiscovery, argparse)):
-        return 100
-        
+    try:
+        import argparse
+    except ImportError:
+        argparse = None
+
+class CatalogueError(Exception):
+    pass
+
+def check_lumis(file_lumis):
+    '''
+    Generate the (file, lumis) entries of a catalogue, raising
+    CatalogueError at the end if it has files but none has lumis, which is
+    what DBS returns when it was not asked for lumis
+
+    >>> list(check_lumis([('/store/a.root', [(1, 2)]), ('/store/b.root', [])]))
+    [('/store/a.root', [(1, 2)]), ('/store/b.root', [])]
+    >>> list(check_lumis([]))
+    []
+    >>> list(check_lumis([('/store/a.root', [])]))
+    Traceback (most recent call last):
+    ...
+    CatalogueError: the catalogue has 1 files but no lumi sections
+    '''
+    n_files = 0
+    has_lumis = False
+    for file, lumis in file_lumis:
+        n_files += 1
+        if lumis:
+            has_lumis = True
+        yield file, lumis
+    if n_files and not has_lumis:
+        raise CatalogueError(
+            'the catalogue has %i files but no lumi sections' % n_files)
+
+def fetch_lumis(dataset):
+    '''
+    Query DBS through CRAB and generate (file, [lumis in file])
+    '''
     # Set up some global nonsense that crab uses
     import common
     common.logger = logging
@@ -47,6 +87,25 @@ def main():
 
     common.work_space = Workspace()
 
+    # DataDiscovery only asks DBS for the lumis of the files when splitting
+    # by lumi, or masking, which is done afterwards by lumiMask.py
+    cfg = {
+        'CMSSW.lumis_per_job' : '1',
+    }
+
+    # Build the data discovery service
+    discovery = DataDiscovery.DataDiscovery(dataset, cfg, None)
+    discovery.fetchDBSInfo()
+
+    # Get a dictionary with key = file, value = [lumis in file]
+    return discovery.getLumis().iteritems()
+
+def main():
+    if argparse is None:
+        sys.stderr.write("Could not import argparse from RecoLuminosity.LumiDB\n"
+                    "Make sure your environment is setup for CMSSW\n")
+        return 100
+
     parser = argparse.ArgumentParser(
         description='Determine the relevant subset of files from a DBS dataset'
         ' using the given JSON lumi mask.\n\n'
@@ -59,42 +118,113 @@ def main():
                         help='Path to JSON file mask')
 
     parser.add_argument('--run-range', default='', dest='runrange', type=str,
-                        help='Use a given runrange.  Format: START-END')
+                        help='Use a given runrange.  Format: START-END[,RUN,...]')
 
     parser.add_argument('-v', default=False, const=True, action='store_const',
                         help='Log information to stderr')
 
-    args = parser.parse_args()
+    parser.add_argument('--cache-dir', default=default_cache_dir(),
+                        dest='cache_dir', type=str,
+                        help='Directory of cached DBS catalogues')
 
-    cfg = {
-        'CMSSW.lumi_mask' : args.json,
-    }
+    parser.add_argument('--cache-ttl', default=24., dest='cache_ttl',
+                        type=float,
+                        help='Hours before a cached catalogue is queried'
+                        ' again; 0 disables the cache')
 
-    if args.runrange:
-        cfg['CMSSW.runselection'] = args.runrange
+    parser.add_argument('--recorded-dbs', default='', dest='recorded_dbs',
+                        type=str,
+                        help='Use a catalogue recorded with --record instead'
+                        ' of DBS')
+
+    parser.add_argument('--record', default='', dest='record', type=str,
+                        help='Record the catalogue to this file')
+
+    parser.add_argument('--lumi-counts', default=False, const=True,
+                        action='store_const', dest='lumi_counts',
+                        help='Write the number of masked lumis after each'
+                        ' file')
+
+    parser.add_argument('--stream', default=False, const=True,
+                        action='store_const',
+                        help='Flush each file as soon as it is known')
+
+    args = parser.parse_args()
 
     if args.v:
         sys.stderr.write('Masking dataset: %s\n' % args.dataset)
         sys.stderr.write('with json: %s\n' % args.json)
 
-    # Build the data discovery service
-    discovery = DataDiscovery.DataDiscovery(args.dataset, cfg, None)
-    discovery.fetchDBSInfo()
+    runs = None
+    if args.runrange:
+        try:
+            runs = RunRange.parse([args.runrange])
+        except (TypeError, ValueError), e:
+            sys.stderr.write('Invalid --run-range: %s\n' % e.message)
+            return 1
+    mask = LumiMask.from_json(args.json, runs)
+
+    query = {
+        'dataset' : args.dataset,
+    }
 
-    # Get a dictionary with key = file, value = [valid lumis in file]
-    file_to_lumi_map = discovery.getLumis()
+    if args.recorded_dbs:
+        header, file_lumis = read_catalogue(args.recorded_dbs)
+        file_lumis = check_lumis(file_lumis)
+        if header.get('query') != query:
+            sys.stderr.write('%s was recorded for a different dataset\n'
+                             % args.recorded_dbs)
+            return 1
+    else:
+        cache = None
+        file_lumis = None
+        if args.cache_ttl > 0:
+            cache = CatalogueCache(args.cache_dir, args.cache_ttl*3600)
+            file_lumis = cache.lookup(query)
+            if file_lumis is not None:
+                file_lumis = check_lumis(file_lumis)
+                if args.v:
+                    sys.stderr.write('Using cached catalogue %s\n'
+                                     % cache.path(query))
+        if file_lumis is None:
+            if DataDiscovery is None:
+                sys.stderr.write("Could not import CRAB DataDiscovery tool!\n"
+                        "Make sure your environment is setup for crab.\n"
+                        "https://twiki.cern.ch/twiki/bin/view/CMSPublic/SWGuideCrab\n")
+                return 100
+            # Checked before it is cached, so that a catalogue without
+            # lumis is never stored
+            file_lumis = check_lumis(fetch_lumis(args.dataset))
+            if cache is not None:
+                file_lumis = cache.store(query, file_lumis)
+
+    if args.record:
+        file_lumis = write_catalogue(args.record, query, file_lumis)
+
+    n_files = [0]
+    def count_files(file_lumis):
+        for item in file_lumis:
+            n_files[0] += 1
+            yield item
 
-    n_files = len(file_to_lumi_map)
     n_masked = 0
     # We only care about files with valid lumis in them
-    for file, lumi in file_to_lumi_map.iteritems():
-        if lumi:
+    try:
+        for file, n_lumis in mask.apply(count_files(file_lumis)):
             n_masked += 1
-            sys.stdout.write(file + '\n')
+            if args.lumi_counts:
+                sys.stdout.write('%s %i\n' % (file, n_lumis))
+            else:
+                sys.stdout.write(file + '\n')
+            if args.stream:
+                sys.stdout.flush()
+    except CatalogueError, e:
+        sys.stderr.write('Invalid catalogue of %s: %s\n' % (args.dataset, e))
+        return 1
 
     if args.v:
         sys.stderr.write(
-            'After masking (%i/%i) files remain.\n' % (n_masked, n_files))
+            'After masking (%i/%i) files remain.\n' % (n_masked, n_files[0]))
 
 if __name__ == "__main__":
     try:
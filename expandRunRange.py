@@ -9,6 +9,16 @@ Example:
     >> expandRunRange.py 1,2,3-7,9
     >> 1,2,3,4,5,6,7,9
 
+The ranges are kept as merged, sorted intervals by the RunRange class, so a
+wide range like 1-400000 costs no more than a single run.  Rather than
+expanding the runs, a compact form of the ranges or a DBS query predicate
+can be printed:
+
+    >> expandRunRange.py --compact 9,1-5,3-7
+    >> 1-7,9
+    >> expandRunRange.py --dbs-predicate 1-7,9
+    >> ((run >= 1 and run <= 7) or run = 9)
+
 Run unit test with: python -m doctest expandRunRange.py
 
 Author: Evan K. Friis, UW Madison
@@ -17,19 +27,150 @@ Author: Evan K. Friis, UW Madison
 
 import sys
 import re
+import bisect
+from optparse import OptionParser
 
-def main():
-    # Get all command line arguments
-    arguments = sys.argv[1:]
+def main(argv=None):
+    '''
+    >>> main(['--compact', '9,1-5', '3-7'])
+    1-7,9
+    >>> main(['--dbs-predicate', '1-400000'])
+    ((run >= 1 and run <= 400000))
+    >>> main(['4-2'])
+    1
+    '''
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = OptionParser(usage="%prog [options] runs...")
+    parser.add_option("--compact", dest="compact", action="store_true",
+                      default=False, help="Print merged ranges instead of"
+                      " every run")
+    parser.add_option("--dbs-predicate", dest="dbs_predicate",
+                      action="store_true", default=False,
+                      help="Print a DBS query predicate selecting the runs")
+    (options, arguments) = parser.parse_args(argv)
     try:
-        output_runs = expandRunRange(arguments)
+        runs = RunRange.parse(arguments)
     except (TypeError, ValueError), e:
         sys.stderr.write("%s: %s\n" % (sys.argv[0], e.message))
         return 1
-    sys.stdout.write(','.join('%i' % x for x in output_runs) + '\n')
+    if options.dbs_predicate:
+        sys.stdout.write(runs.dbs_predicate() + '\n')
+    elif options.compact:
+        sys.stdout.write(str(runs) + '\n')
+    else:
+        separator = ''
+        for run in runs:
+            sys.stdout.write('%s%i' % (separator, run))
+            separator = ','
+        sys.stdout.write('\n')
 
 range_matcher = re.compile('(?P<start>\d+)-(?P<end>\d+)')
 
+class RunRange(object):
+    '''
+    RunRange
+
+    A set of runs, stored as sorted, non-overlapping (first, last)
+    intervals.  Membership is a binary search and iteration generates the
+    runs one at a time, so the size of a range does not matter.
+
+    >>> runs = RunRange([(5, 7), (1, 2), (3, 4), (10, 400000)])
+    >>> runs.intervals
+    [(1, 7), (10, 400000)]
+    >>> 8 in runs, 3 in runs, 400000 in runs
+    (False, True, True)
+    >>> len(runs)
+    399998
+    >>> list(RunRange([(2, 4), (9, 9)]))
+    [2, 3, 4, 9]
+    '''
+    def __init__(self, intervals=()):
+        self.intervals = []
+        for first, last in sorted(intervals):
+            if self.intervals and first <= self.intervals[-1][1] + 1:
+                if last > self.intervals[-1][1]:
+                    self.intervals[-1] = (self.intervals[-1][0], last)
+            else:
+                self.intervals.append((first, last))
+        self._firsts = [x[0] for x in self.intervals]
+
+    @classmethod
+    def parse(cls, runrange):
+        '''
+        Build a RunRange from a list of comma separated runs and ranges
+
+        >>> print RunRange.parse(['1,2,3', '4,5-7', '', '12-20,15'])
+        1-7,12-20
+        '''
+        intervals = []
+        # Look at each cleaned argument
+        for arg in ','.join(runrange).split(','):
+            # Skip blank arguments
+            if not arg:
+                continue
+            # Check if it's a range
+            match = range_matcher.match(arg)
+            if match:
+                start = int(match.group('start'))
+                end = int(match.group('end'))
+                if end < start:
+                    raise TypeError("end of range %s is less than the start"
+                                    % arg)
+                intervals.append((start, end))
+            else:
+                try:
+                    run = int(arg)
+                except ValueError, e:
+                    e.message = "can't parse argument %r" % arg
+                    raise
+                intervals.append((run, run))
+        return cls(intervals)
+
+    def __contains__(self, run):
+        index = bisect.bisect_right(self._firsts, run) - 1
+        return index >= 0 and run <= self.intervals[index][1]
+
+    def __iter__(self):
+        for first, last in self.intervals:
+            run = first
+            while run <= last:
+                yield run
+                run += 1
+
+    def __len__(self):
+        return sum([last - first + 1 for first, last in self.intervals])
+
+    def __nonzero__(self):
+        return bool(self.intervals)
+
+    def __str__(self):
+        ranges = []
+        for first, last in self.intervals:
+            if first == last:
+                ranges.append('%i' % first)
+            else:
+                ranges.append('%i-%i' % (first, last))
+        return ','.join(ranges)
+
+    def dbs_predicate(self, name='run'):
+        '''
+        A DBS query predicate selecting these runs, with one term per
+        interval.  Each term is in parentheses of its own, so the query does
+        not depend on the precedence of and over or.
+
+        >>> RunRange([(1, 1), (3, 5)]).dbs_predicate()
+        '(run = 1 or (run >= 3 and run <= 5))'
+        '''
+        terms = []
+        for first, last in self.intervals:
+            if first == last:
+                terms.append('%s = %i' % (name, first))
+            else:
+                terms.append('(%s >= %i and %s <= %i)'
+                             % (name, first, name, last))
+        return '(%s)' % ' or '.join(terms)
+
 def expandRunRange(runrange):
     '''
     Concatenate a range of arguments
@@ -42,31 +183,7 @@ def expandRunRange(runrange):
     1,2,3,4,5,6,7
 
     '''
-
-    # Turn into a single comma separated list
-    joined_arguments = ','.join(runrange)
-    output_runs = []
-    # Look at each cleaned argument
-    for arg in joined_arguments.split(','):
-        # Skip blank arguments
-        if not arg:
-            continue
-        # Check if it's a range
-        match = range_matcher.match(arg)
-        if match:
-            start = int(match.group('start'))
-            end = int(match.group('end'))
-            if end < start:
-                raise TypeError("end of range %s is less than the start" % arg)
-            output_runs.extend(range(start, end+1))
-        else:
-            try:
-                output_runs.append(int(arg))
-            except ValueError, e:
-                e.message = "can't parse argument %r" % arg
-                raise
-
-    return output_runs
+    return list(RunRange.parse(runrange))
 
 if __name__ == "__main__":
     try:
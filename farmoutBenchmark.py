@@ -0,0 +1,722 @@
+#!/usr/bin/env python
+
+'''
+
+Measure the parsers which summarize a submission, on synthetic inputs.
+
+The inputs of a submission of --jobs jobs are generated in a temporary
+directory, or in --data-dir to keep them for later runs:
+
+    submit/<job>/<job>.log      condor user log of the job, with evictions,
+                                reconnect failures and job ad information
+    submit/<job>/<job>.xml      framework job report, with --lumis lumi
+                                sections; truncated if the job failed
+    submit/<job>/report.log     dashboard report log
+    submit/<job>/telemetry.json resources used by each phase of the job
+    submit/jobs.log             the same events in one shared user log,
+    submit/jobs.index           with its index
+    submit-xml/<job>/<job>.log  the user logs in XML
+
+and then read by each benchmark:
+
+    userlog_text    CondorUserLog.ReadCondorUserLog of the text user logs
+    userlog_xml     CondorUserLog.ReadCondorUserLog of the XML user logs
+    userlog_shared  CondorUserLog.ReadSharedUserLog of the shared user log
+    userlog_stats   CondorUserLogStats.add of the text user logs
+    job_report      jobReportSummary.parse_job_report of each job report
+    job_reports     jobReportSummary.parse_job_reports, for each --workers
+    report_log      jobExitSummary.parse_file of each job
+    report_logs     jobExitSummary.ReportLogReader threads, for each --workers
+
+Each benchmark runs --repeat times in a process of its own, and the fastest
+run is kept, along with the peak resident set size of the process.  Only
+the parsing is timed, not the reading of its inputs in userlog_stats.
+
+    farmoutBenchmark.py --save-baseline=baseline.json
+
+keeps the results, and
+
+    farmoutBenchmark.py --baseline=baseline.json
+
+compares with them, exiting with status 1 if a benchmark is more than
+--tolerance slower, or uses more than --tolerance more memory.  Baselines
+are only comparable on the same host with the same --jobs and --lumis.
+
+'''
+
+import glob
+import json
+import os
+import platform
+import Queue
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import traceback
+from optparse import OptionParser
+
+import CondorUserLog as ULog
+import jobExitSummary
+import jobReportSummary
+import jobTelemetry
+
+PARAMETERS_NAME = 'benchmark.json'
+
+SITES = ['T2_US_Wisconsin', 'T2_US_Nebraska', 'T2_US_Purdue', 'T2_US_UCSD',
+         'T2_US_MIT', 'T2_US_Caltech', 'T2_US_Florida', 'T2_CH_CERN']
+
+# Lumi sections of a job report which are split between its input files
+INPUT_FILES = 2
+
+XML_TYPES = {
+    ULog.SUBMIT_EVENT: 'SubmitEvent',
+    ULog.EXECUTING_EVENT: 'ExecuteEvent',
+    ULog.EVICTED_EVENT: 'JobEvictedEvent',
+    ULog.TERMINATED_EVENT: 'JobTerminatedEvent',
+    ULog.RECONNECT_FAILED_EVENT: 'JobReconnectFailedEvent',
+    ULog.JOB_AD_INFORMATION_EVENT: 'JobAdInformationEvent',
+    6: 'JobImageSizeEvent',
+}
+
+class BenchmarkError(Exception):
+    pass
+
+def job_name(proc):
+    return 'job-%05i' % proc
+
+def job_history(rng, cluster, proc, t):
+    '''
+    Events of a job, as a list of (type, time, attributes), where the
+    attributes are a list of (name, value)
+
+    >>> events = job_history(random.Random(1), 100, 0, 0)
+    >>> events[0][0], events[-1][0]
+    (0, 5)
+    '''
+    events = [(ULog.SUBMIT_EVENT, t,
+               [('SubmitHost', '<128.104.55.1:9618>')])]
+    attempt = 0
+    while True:
+        attempt += 1
+        t += rng.randint(60, 1800)
+        site = rng.choice(SITES)
+        host = '10.%i.%i.%i' % (rng.randint(0, 255), rng.randint(0, 255),
+                                rng.randint(1, 254))
+        slot = 'slot%i@node%i.%s' % (rng.randint(1, 16), rng.randint(1, 500),
+                                     site.lower())
+        # Reconnect failures often happen before the job ever executes
+        executed = rng.random() > 0.02
+        if executed:
+            events.append((ULog.EXECUTING_EVENT, t,
+                           [('ExecuteHost', '<%s:9618>' % host)]))
+            events.append((ULog.JOB_AD_INFORMATION_EVENT, t,
+                           [('MachineAttrGLIDEIN_Site0', '"%s"' % site),
+                            ('MachineAttrName0', '"%s"' % slot),
+                            ('Size', str(rng.randint(500000, 3000000)))]))
+        runtime = rng.randint(600, 7200)
+        # Image size updates are most of the events of a long job
+        for i in range(runtime / 1800):
+            events.append((6, t + (i + 1) * 1800,
+                           [('Size', str(rng.randint(500000, 3000000)))]))
+        t += runtime
+
+        end = rng.random()
+        if attempt < 4 and (end < 0.02 or not executed):
+            events.append((ULog.RECONNECT_FAILED_EVENT, t,
+                           [('Reason', '"Job disconnected too long:'
+                             ' JobLeaseDuration (1200 seconds) expired"'),
+                            ('StartdName', '"%s"' % slot)]))
+        elif attempt < 4 and end < 0.12:
+            events.append((ULog.EVICTED_EVENT, t,
+                           [('Checkpointed', 'false'),
+                            ('RunRemoteUsage', '"Usr 0 00:10:00, Sys 0 00:00:01"')]))
+        else:
+            end = rng.random()
+            if end < 0.9:
+                termination = [('TerminatedNormally', 'true'),
+                               ('ReturnValue', '0')]
+            elif end < 0.97:
+                termination = [('TerminatedNormally', 'true'),
+                               ('ReturnValue', str(rng.choice([1, 65, 84])))]
+            else:
+                termination = [('TerminatedNormally', 'false'),
+                               ('TerminatedBySignal', str(rng.choice([9, 11])))]
+            events.append((ULog.TERMINATED_EVENT, t, termination +
+                           [('RunRemoteUsage', '"Usr 0 00:50:00, Sys 0 00:00:10"'),
+                            ('SentBytes', '0'), ('ReceivedBytes', '1024')]))
+            return events
+
+def attributes(event):
+    result = {}
+    for name, value in event[2]:
+        result[name] = value
+    return result
+
+def format_text(cluster, proc, event):
+    ''' An event of a job as condor writes it in a text user log '''
+    event_type, t, attrs = event
+    values = attributes(event)
+    header = '%03i (%03i.%03i.000) %s ' % (
+        event_type, cluster, proc, time.strftime('%m/%d %H:%M:%S',
+                                                  time.localtime(t)))
+    if event_type == ULog.SUBMIT_EVENT:
+        lines = [header + 'Job submitted from host: ' + values['SubmitHost']]
+    elif event_type == ULog.EXECUTING_EVENT:
+        lines = [header + 'Job executing on host: ' + values['ExecuteHost']]
+    elif event_type == ULog.JOB_AD_INFORMATION_EVENT:
+        lines = [header + 'Job ad information event triggered.']
+        lines.extend(['%s = %s' % attr for attr in attrs])
+    elif event_type == 6:
+        lines = [header + 'Image size of job updated: ' + values['Size'],
+                 '\t%i  -  MemoryUsage of job (MB)' % (
+                     long(values['Size']) / 1024),
+                 '\t%s  -  ResidentSetSize of job (KB)' % values['Size']]
+    elif event_type == ULog.RECONNECT_FAILED_EVENT:
+        lines = [header + 'Job reconnection failed',
+                 '    ' + values['Reason'].strip('"'),
+                 '    Can not reconnect to %s, rescheduling job'
+                 % values['StartdName'].strip('"')]
+    elif event_type == ULog.EVICTED_EVENT:
+        lines = [header + 'Job was evicted.',
+                 '\t(0) Job was not checkpointed.',
+                 '\t\tUsr 0 00:10:00, Sys 0 00:00:01  -  Run Remote Usage',
+                 '\t\tUsr 0 00:00:00, Sys 0 00:00:00  -  Run Local Usage',
+                 '\t0  -  Run Bytes Sent By Job',
+                 '\t0  -  Run Bytes Received By Job']
+    elif event_type == ULog.TERMINATED_EVENT:
+        lines = [header + 'Job terminated.']
+        if values['TerminatedNormally'] == 'true':
+            lines.append('\t(1) Normal termination (return value %s)'
+                         % values['ReturnValue'])
+        else:
+            lines.append('\t(0) Abnormal termination (signal %s)'
+                         % values['TerminatedBySignal'])
+            lines.append('\t(0) No core file')
+        lines.extend([
+            '\t\tUsr 0 00:50:00, Sys 0 00:00:10  -  Run Remote Usage',
+            '\t\tUsr 0 00:00:00, Sys 0 00:00:00  -  Run Local Usage',
+            '\t\tUsr 0 00:50:00, Sys 0 00:00:10  -  Total Remote Usage',
+            '\t\tUsr 0 00:00:00, Sys 0 00:00:00  -  Total Local Usage',
+            '\t0  -  Run Bytes Sent By Job',
+            '\t1024  -  Run Bytes Received By Job',
+            '\t0  -  Total Bytes Sent By Job',
+            '\t1024  -  Total Bytes Received By Job'])
+    lines.append('...')
+    return '\n'.join(lines) + '\n'
+
+def xml_value(value):
+    if value in ('true', 'false'):
+        return '<b v="%s"/>' % value[0]
+    if value.isdigit():
+        return '<i>%s</i>' % value
+    value = value.strip('"').replace('&', '&amp;')
+    return '<s>%s</s>' % value.replace('<', '&lt;').replace('>', '&gt;')
+
+def format_xml(cluster, proc, event):
+    ''' An event of a job as condor writes it in an XML user log '''
+    event_type, t, attrs = event
+    lines = ['<c>',
+             '    <a n="MyType"><s>%s</s></a>' % XML_TYPES[event_type],
+             '    <a n="EventTypeNumber"><i>%i</i></a>' % event_type,
+             '    <a n="EventTime"><s>%s</s></a>' % time.strftime(
+                 '%Y-%m-%dT%H:%M:%S', time.localtime(t)),
+             '    <a n="Cluster"><i>%i</i></a>' % cluster,
+             '    <a n="Proc"><i>%i</i></a>' % proc,
+             '    <a n="Subproc"><i>0</i></a>']
+    for name, value in attrs:
+        lines.append('    <a n="%s">%s</a>' % (name, xml_value(value)))
+    lines.append('</c>')
+    return '\n'.join(lines) + '\n'
+
+def job_report(proc, lumis, run, failed):
+    '''
+    Framework job report of a job, with its lumi sections split between
+    its input files
+
+    >>> report = job_report(0, 4, 1, False)
+    >>> report.count('<LumiSection'), report.count('<InputFile>')
+    (8, 2)
+    '''
+    first = proc * lumis + 1
+    lumi_ids = range(first, first + lumis)
+    events_per_lumi = 100
+    lines = ['<FrameworkJobReport>']
+    per_file = (lumis + INPUT_FILES - 1) / INPUT_FILES
+    for i in range(INPUT_FILES):
+        file_lumis = lumi_ids[i * per_file:(i + 1) * per_file]
+        lines.extend([
+            '<InputFile>',
+            '<State  Value="closed"/>',
+            '<LFN>/store/data/Run2012A/DoubleMu/AOD/%i/input_%i.root</LFN>'
+            % (run, proc * INPUT_FILES + i),
+            '<PFN>root://cmsxrootd.hep.wisc.edu//store/data/Run2012A/'
+            'DoubleMu/AOD/%i/input_%i.root</PFN>'
+            % (run, proc * INPUT_FILES + i),
+            '<InputType>primaryFiles</InputType>',
+            '<EventsRead>%i</EventsRead>' % (len(file_lumis) * events_per_lumi),
+            '<Runs>',
+            '<Run ID="%i">' % run])
+        lines.extend(['   <LumiSection ID="%i"/>' % lumi for lumi in file_lumis])
+        lines.extend(['</Run>', '</Runs>', '</InputFile>'])
+    lines.extend([
+        '<File>',
+        '<LFN></LFN>',
+        '<PFN>%s.root</PFN>' % job_name(proc),
+        '<Catalog></Catalog>',
+        '<ModuleLabel>out</ModuleLabel>',
+        '<TotalEvents>%i</TotalEvents>' % (lumis * events_per_lumi / 10),
+        '<Runs>',
+        '<Run ID="%i">' % run])
+    lines.extend(['   <LumiSection ID="%i"/>' % lumi for lumi in lumi_ids])
+    lines.extend(['</Run>', '</Runs>', '</File>',
+                  '<ReadBranches>',
+                  '</ReadBranches>',
+                  '<PerformanceReport>',
+                  '  <PerformanceSummary Metric="Timing">',
+                  '    <Metric Name="TotalJobTime" Value="3456.7"/>',
+                  '  </PerformanceSummary>',
+                  '</PerformanceReport>',
+                  '</FrameworkJobReport>'])
+    report = '\n'.join(lines) + '\n'
+    if failed:
+        # The report of a job which crashed ends where cmsRun stopped
+        report = report[:len(report) / 2]
+    return report
+
+def report_log(cluster, proc, exit_code, exe_time):
+    ''' Dashboard report log of a job, as report.py writes it '''
+    task = 'farmout_benchmark_%i' % cluster
+    job = '%i_https://submit.hep.wisc.edu/%i.%i' % (proc, cluster, proc)
+    messages = [
+        {'taskId': task, 'jobId': job, 'application': 'CMSSW_5_3_9',
+         'exe': 'cmsRun', 'tool': 'farmout', 'scheduler': 'condor',
+         'taskType': 'analysis', 'vo': 'cms', 'user': 'benchmark',
+         'GridName': '/DC=org/DC=doegrids/OU=People/CN=Farmout Benchmark'},
+        {'SyncGridJobId': 'https://submit.hep.wisc.edu/%i.%i'
+         % (cluster, proc), 'SyncCE': 'T2_US_Wisconsin'},
+        {'ExeTime': str(exe_time), 'ExeExitCode': str(exit_code),
+         'ExeCPU': str(exe_time * 9 / 10)},
+        {'JobExitCode': str(exit_code)},
+    ]
+    lines = []
+    for params in messages:
+        lines.append('SENDING with Task:%s Job:%s' % (task, job))
+        lines.append('params : ' + repr(params))
+    return '\n'.join(lines) + '\n'
+
+def telemetry(exe_time, rng):
+    ''' telemetry.json of a job, as jobTelemetry.py writes it '''
+    phases = {}
+    for name, wall_time in (('setup', 60), ('run', exe_time),
+                            ('stageout', 30)):
+        phase = {'commands': 1, 'wall_time': float(wall_time),
+                 'user_time': wall_time * 0.8, 'sys_time': wall_time * 0.05,
+                 'max_rss_kb': rng.randint(100000, 2000000),
+                 'read_chars': rng.randint(0, 1 << 31),
+                 'write_chars': rng.randint(0, 1 << 28)}
+        phase['peak_rss_kb'] = phase['max_rss_kb']
+        phases[name] = phase
+    return {'host': 'node.hep.wisc.edu', 'phases': phases,
+            'phase_order': ['setup', 'run', 'stageout']}
+
+def write(filename, data):
+    fd = open(filename, 'w')
+    fd.write(data)
+    fd.close()
+
+def generate(data_dir, jobs, lumis, seed):
+    ''' Write the inputs of a submission of jobs into data_dir '''
+    rng = random.Random(seed)
+    cluster = 1000 + seed
+    submit = os.path.join(data_dir, 'submit')
+    submit_xml = os.path.join(data_dir, 'submit-xml')
+    os.makedirs(submit)
+    os.makedirs(submit_xml)
+    # In the current year, which the text user logs leave out
+    start = time.mktime((time.localtime().tm_year, 1, 2, 0, 0, 0, 0, 0, -1))
+    shared = []
+    index = []
+    for proc in range(jobs):
+        name = job_name(proc)
+        events = job_history(rng, cluster, proc,
+                             start + rng.randint(0, 3600))
+        shared.extend([(event[1], proc, event) for event in events])
+        index.append('%i %i %s\n' % (cluster, proc, name))
+
+        job_dir = os.path.join(submit, name)
+        os.mkdir(job_dir)
+        write(os.path.join(job_dir, name + '.log'), ''.join(
+            [format_text(cluster, proc, event) for event in events]))
+        os.mkdir(os.path.join(submit_xml, name))
+        write(os.path.join(submit_xml, name, name + '.log'), ''.join(
+            [format_xml(cluster, proc, event) for event in events]))
+
+        values = attributes(events[-1])
+        exit_code = long(values.get('ReturnValue') or
+                         128 + long(values['TerminatedBySignal']))
+        write(os.path.join(job_dir, name + '.xml'),
+              job_report(proc, lumis, 190000 + proc / 100, exit_code != 0))
+        exe_time = rng.randint(600, 7200)
+        write(os.path.join(job_dir, 'report.log'),
+              report_log(cluster, proc, exit_code, exe_time))
+        write(os.path.join(job_dir, jobTelemetry.TELEMETRY_NAME),
+              json.dumps(telemetry(exe_time, rng), indent=1, sort_keys=True))
+
+    shared.sort()
+    write(os.path.join(submit, 'jobs.log'), ''.join(
+        [format_text(cluster, proc, event) for t, proc, event in shared]))
+    write(os.path.join(submit, 'jobs.index'), ''.join(index))
+
+def prepare(data_dir, parameters):
+    '''
+    Generate the inputs in data_dir, unless it already has those of the
+    same parameters
+    '''
+    parameters_file = os.path.join(data_dir, PARAMETERS_NAME)
+    if os.path.exists(parameters_file):
+        if json.load(open(parameters_file, 'r')) == parameters:
+            return False
+        raise BenchmarkError("%s holds inputs of other parameters, see %s"
+                             % (data_dir, parameters_file))
+    if os.path.exists(data_dir) and os.listdir(data_dir):
+        raise BenchmarkError("%s is not empty" % data_dir)
+    generate(data_dir, parameters['jobs'], parameters['lumis'],
+             parameters['seed'])
+    write(parameters_file, json.dumps(parameters, sort_keys=True) + '\n')
+    return True
+
+def job_files(data_dir, pattern, submit='submit'):
+    return sorted(glob.glob(os.path.join(data_dir, submit, '*', pattern)))
+
+# Each benchmark reads what it needs from data_dir, and returns a function
+# which does the timed work and returns the number of jobs it handled.
+
+def userlog_text(data_dir, workers):
+    logs = job_files(data_dir, 'job-*.log')
+    def run():
+        for log in logs:
+            ULog.ReadCondorUserLog(log)
+        return len(logs)
+    return run
+
+def userlog_xml(data_dir, workers):
+    logs = job_files(data_dir, 'job-*.log', 'submit-xml')
+    def run():
+        for log in logs:
+            ULog.ReadCondorUserLog(log)
+        return len(logs)
+    return run
+
+def userlog_shared(data_dir, workers):
+    log = os.path.join(data_dir, 'submit', 'jobs.log')
+    def run():
+        return len(ULog.ReadSharedUserLog(log))
+    return run
+
+def userlog_stats(data_dir, workers):
+    ulogs = [ULog.ReadCondorUserLog(log)
+             for log in job_files(data_dir, 'job-*.log')]
+    def run():
+        stats = ULog.CondorUserLogStats()
+        for ulog in ulogs:
+            stats.add(ulog)
+        return len(ulogs)
+    return run
+
+def job_report_serial(data_dir, workers):
+    reports = job_files(data_dir, 'job-*.xml')
+    def run():
+        for report in reports:
+            fd = open(report, 'r')
+            jobReportSummary.parse_job_report(fd)
+            fd.close()
+        return len(reports)
+    return run
+
+def job_reports(data_dir, workers):
+    reports = job_files(data_dir, 'job-*.xml')
+    def run():
+        jobReportSummary.parse_job_reports(reports, reader_workers=workers)
+        return len(reports)
+    return run
+
+def report_log_serial(data_dir, workers):
+    job_dirs = [os.path.dirname(x) for x in job_files(data_dir, 'report.log')]
+    def run():
+        for job_dir in job_dirs:
+            jobExitSummary.parse_file(job_dir)
+        return len(job_dirs)
+    return run
+
+def report_logs(data_dir, workers):
+    job_dirs = [os.path.dirname(x) for x in job_files(data_dir, 'report.log')]
+    def run():
+        # As jobExitSummary.py reads a submit directory
+        input_queue = Queue.Queue()
+        output_queue = Queue.Queue()
+        readers = [jobExitSummary.ReportLogReader(input_queue, output_queue)
+                   for i in range(workers)]
+        map(lambda x: x.start(), readers)
+        for job_dir in job_dirs:
+            input_queue.put(job_dir)
+        for reader in readers:
+            input_queue.put(None)
+        input_queue.join()
+        summary = jobTelemetry.TelemetrySummary()
+        while not output_queue.empty():
+            result, job_dir, job_telemetry = output_queue.get()
+            if job_telemetry:
+                summary.add(job_telemetry)
+        return len(job_dirs)
+    return run
+
+# name, function, whether it is run for each number of workers
+BENCHMARKS = [
+    ('userlog_text', userlog_text, False),
+    ('userlog_xml', userlog_xml, False),
+    ('userlog_shared', userlog_shared, False),
+    ('userlog_stats', userlog_stats, False),
+    ('job_report', job_report_serial, False),
+    ('job_reports', job_reports, True),
+    ('report_log', report_log_serial, False),
+    ('report_logs', report_logs, True),
+]
+
+def measure(benchmark, data_dir, workers, repeat):
+    '''
+    Run a benchmark in a process of its own, so that its peak resident set
+    size is its own, and return its fastest run
+
+    >>> def sleep(data_dir, workers):
+    ...     def run():
+    ...         time.sleep(0.01)
+    ...         return 1
+    ...     return run
+    >>> result = measure(sleep, '.', 1, 2)
+    >>> result['jobs'], result['seconds'] >= 0.01, result['peak_rss_kb'] > 0
+    (1, True, True)
+    '''
+    sys.stdout.flush()
+    sys.stderr.flush()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            try:
+                os.close(read_fd)
+                run = benchmark(data_dir, workers)
+                best = None
+                for i in range(repeat):
+                    start = time.time()
+                    jobs = run()
+                    seconds = time.time() - start
+                    if best is None or seconds < best:
+                        best = seconds
+                os.write(write_fd, json.dumps({'jobs': jobs, 'seconds': best}))
+                status = 0
+            except:
+                traceback.print_exc()
+        finally:
+            os._exit(status)
+
+    os.close(write_fd)
+    output = ''
+    while True:
+        data = os.read(read_fd, 4096)
+        if not data:
+            break
+        output += data
+    os.close(read_fd)
+    wpid, status, rusage = os.wait4(pid, 0)
+    if status != 0 or not output:
+        raise BenchmarkError("%s failed" % benchmark.__name__)
+    result = json.loads(output)
+    result['seconds'] = round(result['seconds'], 4)
+    # kB on Linux
+    result['peak_rss_kb'] = rusage.ru_maxrss
+    return result
+
+def result_key(name, workers):
+    '''
+    >>> result_key('job_reports', 5), result_key('job_report', None)
+    ('job_reports/5', 'job_report')
+    '''
+    if workers is None:
+        return name
+    return '%s/%i' % (name, workers)
+
+def rate(result):
+    return result['jobs'] / max(result['seconds'], 1e-6)
+
+def compare(results, baseline, tolerance):
+    '''
+    Regressions of the results from a baseline, as a list of messages
+
+    >>> baseline = {'a': {'jobs': 100, 'seconds': 1.0, 'peak_rss_kb': 102400}}
+    >>> compare({'a': {'jobs': 100, 'seconds': 1.1, 'peak_rss_kb': 102400}},
+    ...         baseline, 0.2)
+    []
+    >>> compare({'a': {'jobs': 100, 'seconds': 2.0, 'peak_rss_kb': 153600}},
+    ...         baseline, 0.2)
+    ['a: 50 jobs/s, 50% slower than 100', 'a: peak RSS 150 MB, 50% more than 100']
+    '''
+    regressions = []
+    for key in sorted(results.keys()):
+        if key not in baseline:
+            continue
+        result = results[key]
+        before = baseline[key]
+        if rate(result) < rate(before) * (1 - tolerance):
+            regressions.append("%s: %i jobs/s, %i%% slower than %i" % (
+                key, rate(result), 100 * (1 - rate(result) / rate(before)),
+                rate(before)))
+        if result['peak_rss_kb'] > before['peak_rss_kb'] * (1 + tolerance):
+            regressions.append("%s: peak RSS %i MB, %i%% more than %i" % (
+                key, result['peak_rss_kb'] / 1024,
+                100 * (float(result['peak_rss_kb']) / before['peak_rss_kb'] - 1),
+                before['peak_rss_kb'] / 1024))
+    return regressions
+
+def format_results(results, keys, baseline):
+    s = "%-20s %8s %9s %10s %8s %9s %10s\n" % ("Benchmark", "Jobs", "Seconds", "Jobs/s", "Speedup", "Peak RSS", "Baseline")
+    s += "%-20s %8s %9s %10s %8s %9s %10s\n" % (         "",     "",        "",       "",        "",     "(MB)",   "Jobs/s")
+    s += "%-20s %8s %9s %10s %8s %9s %10s\n" % ("---------", "----", "-------", "------", "-------", "--------", "--------")
+    first = {}
+    for key in keys:
+        result = results[key]
+        name = key.split('/')[0]
+        first.setdefault(name, rate(result))
+        before = ""
+        if key in baseline:
+            before = "%i" % rate(baseline[key])
+        s += "%-20s %8i %9.3f %10i %8.2f %9i %10s\n" % (
+            key,
+            result['jobs'],
+            result['seconds'],
+            rate(result),
+            # Compared with the fewest workers
+            rate(result) / first[name],
+            result['peak_rss_kb'] / 1024,
+            before,
+        )
+    return s
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--jobs", dest="jobs", type="int", default=1000,
+                      help="Number of jobs to generate [default: %default]")
+    parser.add_option("--lumis", dest="lumis", type="int", default=100,
+                      help="Lumi sections of each job report"
+                      " [default: %default]")
+    parser.add_option("--seed", dest="seed", type="int", default=1,
+                      help="Seed of the generated inputs [default: %default]")
+    parser.add_option("--data-dir", dest="data_dir", default=None,
+                      help="Directory to keep the generated inputs in,"
+                      " and to reuse them from")
+    parser.add_option("--generate-only", dest="generate_only",
+                      action="store_true", default=False,
+                      help="Only generate the inputs in --data-dir")
+    parser.add_option("--benchmarks", dest="benchmarks",
+                      default=",".join([x[0] for x in BENCHMARKS]),
+                      help="Comma separated benchmarks to run"
+                      " [default: %default]")
+    parser.add_option("--workers", dest="workers", default="1,2,5,10",
+                      help="Comma separated numbers of workers of the"
+                      " threaded benchmarks [default: %default]")
+    parser.add_option("--repeat", dest="repeat", type="int", default=3,
+                      help="Runs of each benchmark [default: %default]")
+    parser.add_option("--baseline", dest="baseline", default=None,
+                      help="Compare with the results kept in this file")
+    parser.add_option("--save-baseline", dest="save_baseline", default=None,
+                      help="Keep the results in this file")
+    parser.add_option("--tolerance", dest="tolerance", type="float",
+                      default=0.2, help="Fraction by which a benchmark may"
+                      " be slower or use more memory than its baseline"
+                      " [default: %default]")
+    (options, args) = parser.parse_args()
+
+    if args:
+        parser.error("No arguments are expected")
+    if options.generate_only and not options.data_dir:
+        parser.error("--generate-only requires --data-dir")
+    known = [x[0] for x in BENCHMARKS]
+    names = options.benchmarks.split(",")
+    for name in names:
+        if name not in known:
+            parser.error("Unknown benchmark %s" % name)
+    try:
+        workers = [int(x) for x in options.workers.split(",")]
+    except ValueError:
+        parser.error("--workers must be comma separated numbers")
+
+    parameters = {'jobs': options.jobs, 'lumis': options.lumis,
+                  'seed': options.seed}
+    baseline = {}
+    if options.baseline:
+        kept = json.load(open(options.baseline, 'r'))
+        if kept['parameters'] != parameters or kept['host'] != socket.gethostname():
+            sys.stderr.write("Warning: %s is of %s on %s, not of %s on %s\n" % (
+                options.baseline, kept['parameters'], kept['host'],
+                parameters, socket.gethostname()))
+        baseline = kept['results']
+
+    data_dir = options.data_dir
+    if data_dir is None:
+        data_dir = tempfile.mkdtemp(prefix='farmoutBenchmark.')
+    try:
+        start = time.time()
+        if prepare(data_dir, parameters):
+            print "Generated %i jobs in %s in %.1f seconds" % (
+                options.jobs, data_dir, time.time() - start)
+        if options.generate_only:
+            return 0
+
+        results = {}
+        keys = []
+        for name, benchmark, threaded in BENCHMARKS:
+            if name not in names:
+                continue
+            for count in (threaded and workers or [None]):
+                key = result_key(name, count)
+                results[key] = measure(benchmark, data_dir, count or 1,
+                                       options.repeat)
+                keys.append(key)
+    finally:
+        if options.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    print format_results(results, keys, baseline),
+
+    if options.save_baseline:
+        tmp = options.save_baseline + '.tmp'
+        fd = open(tmp, 'w')
+        json.dump({'parameters': parameters, 'host': socket.gethostname(),
+                   'python': platform.python_version(),
+                   'time': int(time.time()), 'results': results},
+                  fd, indent=1, sort_keys=True)
+        fd.write('\n')
+        fd.close()
+        os.rename(tmp, options.save_baseline)
+
+    regressions = compare(results, baseline, options.tolerance)
+    if regressions:
+        print ""
+        print "Regressions from %s:" % options.baseline
+        for regression in regressions:
+            print "  " + regression
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    except BenchmarkError, e:
+        sys.stderr.write("farmoutBenchmark.py: %s\n" % e)
+        ret = 2
+    sys.exit(ret)
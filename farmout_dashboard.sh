@@ -48,11 +48,32 @@ build_dashboard_args() {
     done
 }
 
+# Messages are collected here, one per line, and sent together by
+# send_dashboard_messages.
+dboard_messages=""
+
 report_to_dashboard() {
-    # We have to use 'eval' here because the arguments contain
-    # quotes around values that contain spaces, and we need these
-    # quotes to be interpreted by the shell.
-    eval python ${CMS_DASHBOARD_REPORTER}/report.py "$1"
+    dboard_messages="${dboard_messages}$1
+"
+}
+
+send_dashboard_messages() {
+    if [ -z "${dboard_messages}" ]; then
+        return 0
+    fi
+    dboard_reporter=$(dirname $0)/dashboardReporter.py
+    if [ -f "${dboard_reporter}" ]; then
+        # One process and ApMon instance for all of the messages
+        echo -n "${dboard_messages}" | \
+            python ${dboard_reporter} --reporter-dir=${CMS_DASHBOARD_REPORTER}
+        return
+    fi
+    echo -n "${dboard_messages}" | while read -r message; do
+        # We have to use 'eval' here because the arguments contain
+        # quotes around values that contain spaces, and we need these
+        # quotes to be interpreted by the shell.
+        eval python ${CMS_DASHBOARD_REPORTER}/report.py "$message"
+    done
 }
 
 report_task_meta() {
@@ -131,20 +152,24 @@ fi
 # Without this, the completion time of the job never gets updated.
 dboard_jobId="${dboard_jobId}_${dboard_sid}"
 
-task=$1
-
-if [ "$task" = "" ]; then
+if [ "$1" = "" ]; then
     echo "You must specify what option to use for reporting to the dashboard."
 fi
 
-if [ "$task" = "submission" ] || [ "$task" = "all" ]; then
-    report_submission
-fi
+# Several tasks may be given, e.g. "submission execution", and are all
+# reported in one batch.
+for task in "$@"; do
+    if [ "$task" = "submission" ] || [ "$task" = "all" ]; then
+        report_submission
+    fi
 
-if [ "$task" = "execution" ] || [ "$task" = "all" ]; then
-    report_execution
-fi
+    if [ "$task" = "execution" ] || [ "$task" = "all" ]; then
+        report_execution
+    fi
 
-if [ "$task" = "completion" ] || [ "$task" = "all" ]; then
-    report_completion
-fi
+    if [ "$task" = "completion" ] || [ "$task" = "all" ]; then
+        report_completion
+    fi
+done
+
+send_dashboard_messages
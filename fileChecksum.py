@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+'''
+
+Compute file sizes and checksums in one streaming pass.
+
+The POSIX cksum CRC (as printed by the cksum program) and the adler32
+checksum are both computed from the same large reads of the file, using the
+CRC and adler32 routines in zlib, so no external process is needed and the
+cost is dominated by reading the file.
+
+zlib implements the bit-reflected form of the CRC-32 polynomial that cksum
+uses.  Reversing the bits of every input byte, running the reflected CRC with
+no initial or final inversion and reversing the bits of the result gives the
+unreflected CRC that cksum is defined with.
+
+Example:
+
+    fileChecksum.py out.root
+    1742356582 1048576 3a9b01c3 out.root
+
+prints the cksum CRC, size, adler32 checksum and name of each file.
+
+Checksums can be kept in a cache file, keyed by path, size and modification
+time, so that a file is only read again when it has changed.  The cache can
+be filled ahead of time by scanning whole directories in parallel, e.g. in
+the background while jobs are still finishing:
+
+    fileChecksum.py --cache=checksums.txt --scan --processes=8 /hdfs/store/user/me/out &
+
+'''
+
+import os
+import sys
+import zlib
+from optparse import OptionParser
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+BLOCK_SIZE = 8*1024*1024
+
+def _reverse_byte(x):
+    result = 0
+    for i in range(8):
+        result = (result << 1) | ((x >> i) & 1)
+    return result
+
+# Translation table which reverses the bits of each byte
+_REVERSE_BITS = ''.join([chr(_reverse_byte(x)) for x in range(256)])
+
+def _reverse32(x):
+    return ((_reverse_byte(x & 0xff) << 24) |
+            (_reverse_byte((x >> 8) & 0xff) << 16) |
+            (_reverse_byte((x >> 16) & 0xff) << 8) |
+            _reverse_byte((x >> 24) & 0xff))
+
+def _signed32(x):
+    ''' zlib wants a C int for the running value on older pythons '''
+    x &= 0xffffffff
+    if x >= 0x80000000:
+        x -= 0x100000000
+    return x
+
+class Checksum(object):
+    '''
+    Checksum
+
+    Running size, POSIX cksum CRC and adler32 checksum of a stream of data.
+
+    >>> c = Checksum()
+    >>> c.update('123456789')
+    >>> c.size, c.cksum(), c.adler32()
+    (9, 930766865, '091e01de')
+    >>> c = Checksum()
+    >>> c.cksum()
+    4294967295
+    '''
+    def __init__(self):
+        self.size = 0
+        # Bare CRC register, without zlib's inversions
+        self.crc = 0
+        self.adler = 1
+
+    def update(self, data):
+        self.size += len(data)
+        self.adler = zlib.adler32(data, self.adler)
+        self._update_crc(data)
+
+    def _update_crc(self, data):
+        self.crc = ~zlib.crc32(data.translate(_REVERSE_BITS),
+                               _signed32(~self.crc)) & 0xffffffff
+
+    def cksum(self):
+        ''' The CRC printed by the cksum program '''
+        # cksum appends the length, least significant byte first
+        saved = self.crc
+        length = []
+        n = self.size
+        while n:
+            length.append(chr(n & 0xff))
+            n >>= 8
+        self._update_crc(''.join(length))
+        result = ~_reverse32(self.crc) & 0xffffffff
+        self.crc = saved
+        return result
+
+    def adler32(self):
+        ''' The adler32 checksum, as 8 hex digits '''
+        return "%08x" % (self.adler & 0xffffffff)
+
+def file_checksum(path, block_size=BLOCK_SIZE):
+    ''' Read the file once and return its Checksum '''
+    checksum = Checksum()
+    fd = open(path, 'rb')
+    try:
+        while True:
+            block = fd.read(block_size)
+            if not block:
+                break
+            checksum.update(block)
+    finally:
+        fd.close()
+    return checksum
+
+def adler32_file(path, block_size=BLOCK_SIZE):
+    '''
+    Adler32 checksum of a file, as 8 hex digits
+
+    >>> import tempfile
+    >>> fd = tempfile.NamedTemporaryFile()
+    >>> fd.write('Wikipedia'); fd.flush()
+    >>> adler32_file(fd.name)
+    '11e60398'
+    '''
+    value = 1
+    fd = open(path, 'rb')
+    try:
+        while True:
+            block = fd.read(block_size)
+            if not block:
+                break
+            value = zlib.adler32(block, value)
+    finally:
+        fd.close()
+    return "%08x" % (value & 0xffffffff)
+
+class ChecksumCache(object):
+    '''
+    ChecksumCache
+
+    Checksums of files, stored in a file with one line per file of the form
+    "<cksum> <size> <adler32> <mtime> <path>".  An entry is only used if the
+    size and modification time of the file still match.  New entries are
+    appended with a single write each, so several processes may add to the
+    same cache at once.
+
+    >>> import tempfile
+    >>> dir = tempfile.mkdtemp()
+    >>> data = os.path.join(dir, 'data')
+    >>> open(data, 'w').write('123456789')
+    >>> cache = ChecksumCache(os.path.join(dir, 'cache'))
+    >>> cache.checksum(data)
+    (9, 930766865, '091e01de')
+    >>> ChecksumCache(os.path.join(dir, 'cache')).lookup(data)
+    (9, 930766865, '091e01de')
+    >>> open(data, 'a').write('0')
+    >>> print ChecksumCache(os.path.join(dir, 'cache')).lookup(data)
+    None
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        self.fd = None
+        if os.path.exists(filename):
+            for line in open(filename, 'r'):
+                fields = line.rstrip('\n').split(' ', 4)
+                # A line may be incomplete if a writer was interrupted
+                if len(fields) != 5:
+                    continue
+                try:
+                    cksum, size, adler32, mtime, path = fields
+                    self.entries[path] = (int(size), int(mtime),
+                                          int(cksum), adler32)
+                except ValueError:
+                    continue
+
+    def lookup(self, path, stat_result=None):
+        ''' Return (size, cksum, adler32) if cached and unchanged '''
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        if stat_result is None:
+            stat_result = os.stat(path)
+        size, mtime, cksum, adler32 = entry
+        if size != stat_result.st_size or mtime != int(stat_result.st_mtime):
+            return None
+        return size, cksum, adler32
+
+    def add(self, path, stat_result, cksum, adler32):
+        size = stat_result.st_size
+        mtime = int(stat_result.st_mtime)
+        self.entries[path] = (size, mtime, cksum, adler32)
+        if self.fd is None:
+            self.fd = os.open(self.filename,
+                              os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        os.write(self.fd, "%i %i %s %i %s\n"
+                 % (cksum, size, adler32, mtime, path))
+
+    def checksum(self, path):
+        ''' Return (size, cksum, adler32), reading the file only if needed '''
+        stat_result = os.stat(path)
+        result = self.lookup(path, stat_result)
+        if result is not None:
+            return result
+        checksum = file_checksum(path)
+        self.add(path, stat_result, checksum.cksum(), checksum.adler32())
+        return checksum.size, checksum.cksum(), checksum.adler32()
+
+def _scan_task(path):
+    # Stat before reading, so a file modified meanwhile is not trusted later
+    try:
+        stat_result = os.stat(path)
+        checksum = file_checksum(path)
+    except (IOError, OSError), e:
+        return path, None, str(e)
+    return path, stat_result, (checksum.cksum(), checksum.adler32())
+
+def scan(dirs, cache, processes=1, log=None):
+    '''
+    Add every file under the given directories that is not already in the
+    cache, reading up to processes files at a time.  Returns the number of
+    files added.
+    '''
+    log = log or (lambda x: None)
+    paths = []
+    for dir in dirs:
+        for root, subdirs, files in os.walk(dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if cache.lookup(path) is None:
+                        paths.append(path)
+                except OSError:
+                    continue
+    log("%i files to checksum" % len(paths))
+
+    if multiprocessing is not None and processes > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_scan_task, paths)
+    else:
+        pool = None
+        results = (_scan_task(path) for path in paths)
+
+    n_added = 0
+    for path, stat_result, result in results:
+        if stat_result is None:
+            log("%s: %s" % (path, result))
+            continue
+        cache.add(path, stat_result, result[0], result[1])
+        n_added += 1
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return n_added
+
+def main():
+    parser = OptionParser(usage="%prog [options] file...\n"
+                          "       %prog --cache=FILE --scan dir...")
+    parser.add_option("--cache", dest="cache", default=None,
+                      help="Look up and store checksums in this file")
+    parser.add_option("--scan", dest="scan", action="store_true",
+                      default=False, help="Add all files under the given"
+                      " directories to the cache")
+    parser.add_option("--processes", dest="processes", type="int",
+                      default=4, help="Number of files to read at once with"
+                      " --scan [default: %default]")
+    (options, args) = parser.parse_args()
+
+    cache = None
+    if options.cache:
+        cache = ChecksumCache(options.cache)
+
+    if options.scan:
+        if cache is None:
+            parser.error("--scan requires --cache")
+        def log(message):
+            sys.stderr.write(message + '\n')
+        n_added = scan(args, cache, options.processes, log)
+        log("Added %i files to %s" % (n_added, options.cache))
+        return 0
+
+    status = 0
+    for path in args:
+        try:
+            if cache is not None:
+                size, cksum, adler32 = cache.checksum(path)
+            else:
+                checksum = file_checksum(path)
+                size, cksum, adler32 = (checksum.size, checksum.cksum(),
+                                        checksum.adler32())
+        except (IOError, OSError), e:
+            sys.stderr.write("%s: %s\n" % (path, e.strerror))
+            status = 1
+            continue
+        print "%i %i %s %s" % (cksum, size, adler32, path)
+    return status
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
@@ -10,6 +10,9 @@ Example:
     jobExitSummary.py MySubmitDir_Zjets
     jobExitSummary.py MySubmitDir_*
 
+The resources used by each phase of the jobs are summarized too, for jobs
+which recorded them in telemetry.json (see jobTelemetry.py).
+
 Author: Evan K. Friis, UW Madison
 
 '''
@@ -21,6 +24,8 @@ import os
 import json
 import glob
 
+import jobTelemetry
+
 # Copied from https://twiki.cern.ch/twiki/bin/view/CMS/JobExitCodes
 # on Dec. 6th 2011
 JOB_EXIT_CODES = {
@@ -202,7 +207,9 @@ class ReportLogReader(threading.Thread):
                 if file_to_read is None:
                     break
                 result = parse_file(file_to_read)
-                self.results.put( (result, file_to_read) )
+                telemetry = jobTelemetry.read_telemetry(
+                    os.path.join(file_to_read, jobTelemetry.TELEMETRY_NAME))
+                self.results.put( (result, file_to_read, telemetry) )
             except KeyboardInterrupt:
                 sys.exit(2)
             finally:
@@ -249,8 +256,12 @@ if __name__ == "__main__":
         input_queue.join()
 
         outputs = []
+        telemetry = jobTelemetry.TelemetrySummary()
         while not output_queue.empty():
-            outputs.append(output_queue.get()[0])
+            result, dir, job_telemetry = output_queue.get()
+            outputs.append(result)
+            if job_telemetry:
+                telemetry.add(job_telemetry)
 
         jobExitCodes = {}
         for output in outputs:
@@ -265,3 +276,8 @@ if __name__ == "__main__":
         print "-------------------------------------------------------------------"
         for k, v in jobExitCodes.iteritems():
             print "%-10s %5i   %-40s" % (k, v, JOB_EXIT_CODES.get(k, 'Unknown error code!'))
+
+        if telemetry.phases:
+            print ""
+            print "Resources used by each phase of the jobs:"
+            print telemetry,
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+'''
+
+Read and update the manifest of the jobs in a submit directory.
+
+farmoutAnalysisJobs and farmoutRandomSeedJobs write jobs.manifest in the
+submit directory, with a tab separated line for each job they create:
+
+    job <name> <job dir> <output dir> <output file> <input files>
+
+where the input files are separated by commas.  Lines of the form
+
+    status <name> <done|failed> <time>
+
+are appended as the jobs finish.  Later lines for a job replace earlier
+ones, so a job that is created again has no status until it finishes again.
+
+Nothing but the manifest has to be read to find the outputs, inputs or job
+reports of a submission.  With --update, the status of the jobs which have
+not succeeded yet is first taken from their condor user logs:
+
+    jobManifest.py --update --outputs --status=done jobs.manifest
+
+prints the output files of the jobs which have succeeded.
+
+'''
+
+import os
+import re
+import sys
+import time
+from optparse import OptionParser
+
+import CondorUserLog
+
+MANIFEST_NAME = 'jobs.manifest'
+
+def local_path(url):
+    '''
+    Local path of an output file given by a srm URL
+
+    >>> local_path('srm://se.wisc.edu:8443/srm/v2/server?SFN=/hdfs/store/a.root')
+    '/hdfs/store/a.root'
+    >>> local_path('/scratch/a.root')
+    '/scratch/a.root'
+    '''
+    return re.sub('^srm://.*?SFN=', '', url)
+
+class JobManifest(object):
+    '''
+    JobManifest
+
+    The jobs of a submit directory, in the order they were first created.
+    Each job is a dictionary with the name, dir, output_dir, output, inputs
+    and status of the job.
+
+    >>> import tempfile
+    >>> manifest = JobManifest(os.path.join(tempfile.mkdtemp(), MANIFEST_NAME))
+    >>> manifest.add_job('a', 'a', '/o/1', 'a.root', ['x.root', 'y.root'])
+    >>> manifest.add_job('b', 'b', '/o/1', 'b.root', [])
+    >>> manifest.set_status('a', 'done')
+    >>> manifest = JobManifest(manifest.filename)
+    >>> [(x['name'], x['status']) for x in manifest.jobs()]
+    [('a', 'done'), ('b', None)]
+    >>> manifest.outputs('done')
+    ['/o/1/a.root']
+    >>> manifest.job_report('a') == os.path.join(manifest.dir, 'a', 'a.xml')
+    True
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.dir = os.path.dirname(os.path.abspath(filename))
+        self.names = []
+        self.entries = {}
+        self.fd = None
+        if os.path.exists(filename):
+            for line in open(filename, 'r'):
+                self._read_line(line)
+
+    def _read_line(self, line):
+        fields = line.rstrip('\n').split('\t')
+        # A line may be incomplete if a writer was interrupted
+        if fields[0] == 'job' and len(fields) == 6:
+            name = fields[1]
+            if name not in self.entries:
+                self.names.append(name)
+            self.entries[name] = {
+                'name': name,
+                'dir': fields[2],
+                'output_dir': fields[3],
+                'output': fields[4],
+                'inputs': [x for x in fields[5].split(',') if x],
+                'status': None,
+            }
+        elif fields[0] == 'status' and len(fields) == 4:
+            if fields[1] in self.entries:
+                self.entries[fields[1]]['status'] = fields[2]
+
+    def _append(self, fields):
+        if self.fd is None:
+            self.fd = os.open(self.filename,
+                              os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        line = '\t'.join(fields) + '\n'
+        os.write(self.fd, line)
+        self._read_line(line)
+
+    def add_job(self, name, dir, output_dir, output, inputs):
+        self._append(['job', name, dir, output_dir, output, ','.join(inputs)])
+
+    def set_status(self, name, status):
+        ''' Record the status of a job, if it has changed '''
+        if self.entries[name]['status'] != status:
+            self._append(['status', name, status, str(int(time.time()))])
+
+    def jobs(self, statuses=None):
+        ''' The jobs with one of the given statuses, or all jobs '''
+        jobs = [self.entries[name] for name in self.names]
+        if statuses is not None:
+            jobs = [x for x in jobs if x['status'] in statuses]
+        return jobs
+
+    def outputs(self, *statuses):
+        return ['%s/%s' % (x['output_dir'], x['output'])
+                for x in self.jobs(statuses or None)]
+
+    def job_dir(self, name):
+        return os.path.join(self.dir, self.entries[name]['dir'])
+
+    def job_report(self, name):
+        return os.path.join(self.job_dir(name), name + '.xml')
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+def job_status(ulog):
+    ''' done, failed, or None if the job has not finished '''
+    if not ulog.events or ulog.HasPendingJobs():
+        return None
+    if ulog.JobFailed():
+        return 'failed'
+    return 'done'
+
+def update(manifest):
+    '''
+    Record the status of the jobs which have not succeeded yet, from the
+    shared user log of the submit directory and the user logs of the jobs.
+    Returns the number of jobs whose status changed.
+    '''
+    shared_logs = {}
+    shared_log = os.path.join(manifest.dir, 'jobs.log')
+    if os.path.exists(CondorUserLog.SharedUserLogIndex(shared_log)):
+        shared_logs = CondorUserLog.ReadSharedUserLog(shared_log)
+
+    n_changed = 0
+    for job in manifest.jobs():
+        if job['status'] == 'done':
+            continue
+        name = job['name']
+        ulog = shared_logs.get(name)
+        if ulog is None:
+            fname = os.path.join(manifest.job_dir(name), name + '.log')
+            if not os.path.exists(fname) or not os.path.getsize(fname):
+                continue
+            ulog = CondorUserLog.ReadCondorUserLog(fname)
+        status = job_status(ulog)
+        if status is not None and status != job['status']:
+            manifest.set_status(name, status)
+            n_changed += 1
+    return n_changed
+
+def main():
+    parser = OptionParser(usage="%prog [options] manifest|submit_dir")
+    parser.add_option("--update", dest="update", action="store_true",
+                      default=False, help="First record the status of"
+                      " finished jobs from their user logs")
+    parser.add_option("--status", dest="status", default=None,
+                      help="Only list jobs with one of these comma separated"
+                      " statuses; 'none' for unfinished jobs")
+    parser.add_option("--outputs", dest="list", action="store_const",
+                      const="outputs", help="List the output files")
+    parser.add_option("--inputs", dest="list", action="store_const",
+                      const="inputs", help="List the input files")
+    parser.add_option("--job-reports", dest="list", action="store_const",
+                      const="job_reports", help="List the job reports")
+    parser.add_option("--local", dest="local", action="store_true",
+                      default=False, help="List output files by local path"
+                      " rather than srm URL")
+    parser.add_option("--summary", dest="list", action="store_const",
+                      const="summary", help="Print the number of jobs of"
+                      " each status")
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("A manifest or submit directory is required")
+    filename = args[0]
+    if os.path.isdir(filename):
+        filename = os.path.join(filename, MANIFEST_NAME)
+    if not os.path.exists(filename):
+        sys.stderr.write("No such manifest: %s\n" % filename)
+        return 1
+
+    manifest = JobManifest(filename)
+    if options.update:
+        update(manifest)
+    manifest.close()
+
+    statuses = None
+    if options.status:
+        statuses = [x != 'none' and x or None
+                    for x in options.status.split(',')]
+    jobs = manifest.jobs(statuses)
+
+    if options.list == 'outputs':
+        for job in jobs:
+            output = '%s/%s' % (job['output_dir'], job['output'])
+            if options.local:
+                output = local_path(output)
+            sys.stdout.write(output + '\n')
+    elif options.list == 'inputs':
+        for job in jobs:
+            for input in job['inputs']:
+                sys.stdout.write(input + '\n')
+    elif options.list == 'job_reports':
+        for job in jobs:
+            sys.stdout.write(manifest.job_report(job['name']) + '\n')
+    elif options.list == 'summary':
+        counts = {}
+        for job in jobs:
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+        # Same columns as CondorUserLog.py --job-summary
+        sys.stdout.write("%i %i %i %i\n" % (
+            len(jobs), counts.get('done', 0), counts.get('failed', 0),
+            counts.get(None, 0)))
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
@@ -19,6 +19,9 @@ import threading
 
 from itertools import chain
 
+from jobManifest import JobManifest, MANIFEST_NAME
+from jobManifest import update as update_manifest
+
 # Prefer the bare metal version
 try:
     from xml.etree.cElementTree import ElementTree
@@ -421,9 +424,13 @@ def main():
         'and compute the lumi json summary and skim efficiency.'
     )
 
-    parser.add_argument('job_reports', type=str, nargs='+',
+    parser.add_argument('job_reports', type=str, nargs='*',
                         help='Path (or wildcard) to .xml job reports')
 
+    parser.add_argument('--manifest', type=str, default='', dest='manifest',
+                        help='Read the job reports of the jobs in this job'
+                        ' manifest (or submit dir) which succeeded')
+
     parser.add_argument('--json-out', type=str, default='', dest='json_out',
                         help='Write run-lumi summary to file.')
 
@@ -452,6 +459,18 @@ def main():
     # Flatten the list of input files
     files = chain(*[glob.glob(file) for file in args.job_reports])
 
+    if args.manifest:
+        manifest_file = args.manifest
+        if os.path.isdir(manifest_file):
+            manifest_file = os.path.join(manifest_file, MANIFEST_NAME)
+        manifest = JobManifest(manifest_file)
+        update_manifest(manifest)
+        manifest.close()
+        files = chain(files, [manifest.job_report(x['name'])
+                              for x in manifest.jobs(['done'])])
+    elif not args.job_reports:
+        parser.error('No job reports given')
+
     try:
         result = parse_job_reports(files, verbose=True,
                                    overlaps_ok=args.overlaps_ok)
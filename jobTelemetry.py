@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+
+'''
+
+Run a command of a farmout job and record the resources it used.
+
+cmsRun.sh runs the commands of each phase of a job through this, e.g.
+
+    jobTelemetry.py --phase=run -- cmsRun --jobreport=job.xml job.py
+
+and the totals of each phase are kept in telemetry.json in the job's working
+directory, which is transferred back with the job's other outputs.  Commands
+given the same phase are added together.  For each phase this records:
+
+    commands         number of commands run in the phase
+    wall_time        seconds from start to exit of the commands
+    user_time        user CPU seconds of the commands and their children
+    sys_time         system CPU seconds of the commands and their children
+    cpu_efficiency   (user_time + sys_time) / wall_time
+    max_rss_kb       largest resident set size of any single process
+    peak_rss_kb      largest total resident set size of all processes of a
+                     command at once, as sampled every --interval seconds
+    read_bytes       bytes read from storage
+    write_bytes      bytes written to storage
+    read_chars       bytes read by read system calls, including from the
+                     network
+    write_chars      bytes written by write system calls
+
+The CPU times and largest resident set size come from the rusage given by
+wait4.  The I/O counts come from /proc/self/io, which includes the I/O of
+the children a process has waited for, so they need not be sampled.  Only
+the total resident set size is sampled, from /proc/<pid>/statm of the
+process tree, which costs a few reads every --interval seconds.
+
+jobExitSummary.py and analyze_condor_userlogs add up the telemetry of the
+jobs of a submission.
+
+'''
+
+import errno
+import math
+import os
+import signal
+import socket
+import sys
+import time
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    json = None
+
+TELEMETRY_NAME = 'telemetry.json'
+
+PAGE_KB = os.sysconf('SC_PAGE_SIZE') / 1024
+
+# How each field of a phase is combined over commands or jobs
+SUMMED_FIELDS = ['commands', 'wall_time', 'user_time', 'sys_time',
+                 'read_bytes', 'write_bytes', 'read_chars', 'write_chars']
+MAX_FIELDS = ['max_rss_kb', 'peak_rss_kb']
+
+IO_FIELDS = {'read_bytes': 'read_bytes', 'write_bytes': 'write_bytes',
+             'rchar': 'read_chars', 'wchar': 'write_chars'}
+
+def read_io(pid='self'):
+    '''
+    I/O counts of a process from /proc/<pid>/io, or {} if not available
+
+    >>> sorted(read_io().keys()) in ([], sorted(IO_FIELDS.values()))
+    True
+    '''
+    counts = {}
+    try:
+        for line in open('/proc/%s/io' % pid, 'r'):
+            name, value = line.split(':', 1)
+            if name in IO_FIELDS:
+                counts[IO_FIELDS[name]] = long(value)
+    except (IOError, ValueError):
+        return {}
+    return counts
+
+def process_tree(pid):
+    ''' pid and the pids of all its descendants '''
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            stat = open('/proc/%s/stat' % entry, 'r').read()
+        except IOError:
+            continue
+        # The command name in parentheses may contain spaces
+        ppid = int(stat[stat.rfind(')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    pids = []
+    pending = [pid]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, []))
+    return pids
+
+def tree_rss_kb(pid):
+    ''' Total resident set size of a process and its descendants '''
+    total = 0
+    for pid in process_tree(pid):
+        try:
+            total += int(open('/proc/%i/statm' % pid, 'r').read().split()[1])
+        except (IOError, IndexError, ValueError):
+            continue
+    return total * PAGE_KB
+
+def merge_phase(total, phase):
+    '''
+    Add the telemetry of a phase to a total
+
+    >>> total = {}
+    >>> merge_phase(total, {'commands': 1, 'wall_time': 2.0, 'user_time': 1.0,
+    ...                     'sys_time': 0.0, 'max_rss_kb': 100})
+    >>> merge_phase(total, {'commands': 1, 'wall_time': 2.0, 'user_time': 2.0,
+    ...                     'sys_time': 0.0, 'max_rss_kb': 50})
+    >>> total['max_rss_kb'], total['cpu_efficiency']
+    (100, 0.75)
+    '''
+    for field in SUMMED_FIELDS:
+        if field in phase:
+            value = total.get(field, 0) + phase[field]
+            if isinstance(value, float):
+                value = round(value, 3)
+            total[field] = value
+    for field in MAX_FIELDS:
+        if field in phase:
+            total[field] = max(total.get(field, 0), phase[field])
+    if total.get('wall_time'):
+        total['cpu_efficiency'] = round(
+            (total.get('user_time', 0) + total.get('sys_time', 0))
+            / total['wall_time'], 3)
+
+def read_telemetry(filename):
+    ''' The telemetry of a job, or None if it has none '''
+    if json is None or not os.path.exists(filename):
+        return None
+    try:
+        return json.load(open(filename, 'r'))
+    except ValueError:
+        return None
+
+def percentile(values, fraction):
+    '''
+    The value below which the given fraction of the values lie
+
+    >>> percentile([4, 1, 3, 2], 0.5), percentile([4, 1, 3, 2], 0.95)
+    (2, 4)
+    '''
+    values = sorted(values)
+    index = int(math.ceil(fraction * len(values))) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+class TelemetrySummary(object):
+    '''
+    TelemetrySummary
+
+    Totals of each phase over the telemetry of many jobs, and the peak
+    resident set size of each job, from which the memory to request for
+    such jobs can be chosen.
+
+    >>> summary = TelemetrySummary()
+    >>> for rss in (100*1024, 300*1024):
+    ...     summary.add({'phase_order': ['run'], 'phases': {'run': {
+    ...         'commands': 1, 'wall_time': 3600.0, 'user_time': 1800.0,
+    ...         'sys_time': 0.0, 'peak_rss_kb': rss}}})
+    >>> summary.phases['run']['cpu_efficiency'], summary.job_peak_rss_kb
+    (0.5, [102400, 307200])
+    '''
+    def __init__(self):
+        self.phase_order = []
+        self.phases = {}
+        self.phase_jobs = {}
+        self.job_peak_rss_kb = []
+
+    def add(self, telemetry):
+        phases = telemetry.get('phases', {})
+        peak_rss_kb = 0
+        for name in telemetry.get('phase_order') or sorted(phases.keys()):
+            if name not in phases:
+                continue
+            if name not in self.phases:
+                self.phase_order.append(name)
+                self.phases[name] = {}
+            merge_phase(self.phases[name], phases[name])
+            self.phase_jobs[name] = self.phase_jobs.get(name, 0) + 1
+            peak_rss_kb = max(peak_rss_kb, phases[name].get('peak_rss_kb', 0))
+        if peak_rss_kb:
+            self.job_peak_rss_kb.append(peak_rss_kb)
+
+    def __str__(self):
+        if not self.phases:
+            return ""
+        s = "%15s %11s %11s %11s %11s %11s %11s\n" % ("Phase", "Jobs", "Wall",  "CPU", "Max RSS", "Read", "Written")
+        s += "%15s %11s %11s %11s %11s %11s %11s\n" % (     "",     "", "Hours", "Eff.",    "(MB)", "(GB)",    "(GB)")
+        s += "%15s %11s %11s %11s %11s %11s %11s\n" % ("-----", "----", "-----", "----",   "-----", "----",    "----")
+        for name in self.phase_order:
+            phase = self.phases[name]
+            s += "%15s %11s %11.1f %11.2f %11i %11.1f %11.1f\n" % (
+                name,
+                self.phase_jobs[name],
+                phase.get('wall_time', 0)/3600.0,
+                phase.get('cpu_efficiency', 0),
+                phase.get('peak_rss_kb', 0)/1024,
+                # Including the input read over the network
+                phase.get('read_chars', 0)/1e9,
+                phase.get('write_chars', 0)/1e9,
+            )
+        if self.job_peak_rss_kb:
+            s += "\nPeak RSS of a job (MB): median %i, 95%% %i, max %i\n" % (
+                percentile(self.job_peak_rss_kb, 0.5)/1024,
+                percentile(self.job_peak_rss_kb, 0.95)/1024,
+                max(self.job_peak_rss_kb)/1024)
+        return s
+
+def add_phase(filename, name, phase):
+    ''' Add the telemetry of a command to a phase of a telemetry file '''
+    telemetry = read_telemetry(filename) or {}
+    telemetry.setdefault('host', socket.gethostname())
+    telemetry.setdefault('phase_order', [])
+    if name not in telemetry['phase_order']:
+        telemetry['phase_order'].append(name)
+    merge_phase(telemetry.setdefault('phases', {}).setdefault(name, {}),
+                phase)
+    tmp = filename + '.tmp'
+    fd = open(tmp, 'w')
+    json.dump(telemetry, fd, indent=1, sort_keys=True)
+    fd.write('\n')
+    fd.close()
+    os.rename(tmp, filename)
+
+def run(command, interval=10.0):
+    '''
+    Run a command, returning its exit status as the shell would give it and
+    the telemetry of the command
+
+    >>> status, phase = run(['true'])
+    >>> status, phase['commands']
+    (0, 1)
+    '''
+    io_before = read_io()
+    start = time.time()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.execvp(command[0], command)
+        except OSError, e:
+            sys.stderr.write("%s: %s\n" % (command[0], e.strerror))
+        os._exit(127)
+
+    # Pass signals on, so that the command can be stopped through this
+    def forward(signum, frame):
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, forward)
+
+    peak_rss_kb = 0
+    next_sample = start
+    while True:
+        try:
+            wpid, status, rusage = os.wait4(pid, os.WNOHANG)
+        except OSError, e:
+            # Interrupted by a forwarded signal
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if wpid == pid:
+            break
+        now = time.time()
+        if now >= next_sample:
+            peak_rss_kb = max(peak_rss_kb, tree_rss_kb(pid))
+            next_sample = now + interval
+        time.sleep(min(0.2, interval))
+
+    phase = {
+        'commands': 1,
+        'wall_time': round(time.time() - start, 3),
+        'user_time': round(rusage.ru_utime, 3),
+        'sys_time': round(rusage.ru_stime, 3),
+        # kB on Linux
+        'max_rss_kb': rusage.ru_maxrss,
+        'peak_rss_kb': max(peak_rss_kb, rusage.ru_maxrss),
+    }
+    io_after = read_io()
+    for field, value in io_after.items():
+        phase[field] = value - io_before.get(field, 0)
+
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status), phase
+    return os.WEXITSTATUS(status), phase
+
+def main():
+    parser = OptionParser(usage="%prog [options] -- command [args]")
+    parser.add_option("--phase", dest="phase", default="run",
+                      help="Phase of the job the command belongs to"
+                      " [default: %default]")
+    parser.add_option("--output", dest="output", default=TELEMETRY_NAME,
+                      help="Telemetry file to add to [default: %default]")
+    parser.add_option("--interval", dest="interval", type="float",
+                      default=10.0, help="Seconds between samples of the"
+                      " total resident set size [default: %default]")
+    parser.disable_interspersed_args()
+    (options, args) = parser.parse_args()
+
+    if not args:
+        parser.error("A command is required")
+
+    status, phase = run(args, options.interval)
+    if json is not None:
+        try:
+            add_phase(options.output, options.phase, phase)
+        except (IOError, OSError), e:
+            sys.stderr.write("Cannot write %s: %s\n" % (options.output, e))
+    # The exit status of the command, as if it had been run directly
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
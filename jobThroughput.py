@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+
+'''
+
+Keep a time series of the idle, running, held and completed jobs of farmout
+workflows, from the events in their condor user logs.
+
+farmoutJobMonitor used to run condor_q every minute to count the jobs of a
+user.  This reads the user logs of each workflow instead, so the schedd is
+never queried and the time of every change is exact to the minute.  Each
+run only reads what has been added to the logs since the last run, from the
+offsets kept in .jobThroughput.state in the workflow directory together
+with the state of each job.
+
+    jobThroughput.py --total=$HOME/jobMonitor.log /scratch/farmout_logs/$USER/*
+
+The counts of each workflow are appended to jobThroughput.log in its
+directory, and the sum over all the workflows to the --total file, only
+when they change.  There is at most one line per --resolution seconds;
+changes within that time are merged into the last of them.  The lines have
+the form of those of jobMonitor.log, which updateJobMonitorGraph.pl plots:
+
+    <month>-<day>-<hour>:<min> <total> <idle> <running> <held> <completed> <unix time>
+
+where the total counts the jobs still in the queue, as condor_q does.
+
+With --plot, the --total series is drawn with gnuplot, reduced to at most
+--max-points points, and with --on-change a command is run, but only when
+the series has changed.  The current counts of the --total series are
+written to stdout as "<total> <idle> <running> <held> <completed>".
+
+A workflow directory is a submit directory, or the directory of its logs
+in farmout_logs, where farmoutAnalysisJobs links the logs of every job.
+
+'''
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    json = None
+
+STATE_NAME = '.jobThroughput.state'
+SERIES_NAME = 'jobThroughput.log'
+SERIES_HEADER = 'MonthDayHourMin Total Idle Running Held Completed Time\n'
+
+# Logs which are not condor user logs
+EXCLUDE_LOGS = re.compile(r'^((report)|(farmoutRandomSeedJobs)|(farmoutAnalysisJobs))\.log$')
+
+COUNTED = ['idle', 'running', 'held', 'completed']
+
+# State of a job after each kind of user log event
+EVENT_STATES = {
+    0: 'idle',         # submitted
+    1: 'running',      # executing
+    2: 'idle',         # executable error
+    4: 'idle',         # evicted
+    5: 'completed',    # terminated
+    7: 'idle',         # shadow exception
+    9: 'removed',      # aborted
+    12: 'held',
+    13: 'idle',        # released
+    24: 'idle',        # reconnect failed
+}
+
+EVENT_HEADER = re.compile(r'^(\d{3}) \((\d+)\.(\d+)\.\d+\) (\S+) (\S+)')
+
+def event_time(date_str, time_str, year):
+    '''
+    Unix time of a user log event.  Older logs give no year.
+
+    >>> event_time('2014-03-01', '12:00:00', None) == event_time('03/01', '12:00:00', 2014)
+    True
+    '''
+    time_str = time_str.split('.')[0]
+    if '-' in date_str:
+        t = time.strptime(date_str + ' ' + time_str, '%Y-%m-%d %H:%M:%S')
+    else:
+        t = time.strptime('%i/%s %s' % (year, date_str, time_str),
+                          '%Y/%m/%d %H:%M:%S')
+    return time.mktime(t)
+
+def parse_events(data, year):
+    '''
+    Return the (time, job id, event type) of the complete events in data,
+    and the length of data they take up.  An event is complete once the
+    "..." line after it has been written.
+
+    >>> data = """000 (012.003.000) 03/01 12:00:00 Job submitted from host: <1.2.3.4>
+    ... ...
+    ... 001 (012.003.000) 03/01 12:05:00 Job executing on host: <1.2.3.5>
+    ... """
+    >>> events, used = parse_events(data, 2014)
+    >>> [(x[1], x[2]) for x in events], used == data.index('001')
+    ([('12.3', 0)], True)
+    '''
+    events = []
+    used = 0
+    header = None
+    pos = 0
+    while True:
+        end = data.find('\n', pos)
+        if end < 0:
+            break
+        line = data[pos:end]
+        pos = end + 1
+        if line == '...':
+            if header is not None:
+                events.append(header)
+            header = None
+            used = pos
+            continue
+        if header is None:
+            m = EVENT_HEADER.match(line)
+            if m:
+                job_id = '%i.%i' % (int(m.group(2)), int(m.group(3)))
+                header = (event_time(m.group(4), m.group(5), year), job_id,
+                          int(m.group(1)))
+    return events, used
+
+def find_logs(dir):
+    ''' The condor user logs of a workflow directory '''
+    logs = []
+    for path, dirs, files in os.walk(dir):
+        for name in files:
+            if name.endswith('.log') and name != SERIES_NAME and \
+               not EXCLUDE_LOGS.match(name):
+                logs.append(os.path.join(path, name))
+    return logs
+
+def counts(jobs):
+    '''
+    (total, idle, running, held, completed) of a dictionary of job states
+
+    >>> counts({'1.0': 'idle', '1.1': 'held', '1.2': 'completed', '1.3': 'removed'})
+    (2, 1, 0, 1, 1)
+    '''
+    n = dict([(x, 0) for x in COUNTED])
+    for state in jobs.values():
+        if state in n:
+            n[state] += 1
+    return (n['idle'] + n['running'] + n['held'], n['idle'], n['running'],
+            n['held'], n['completed'])
+
+def format_point(t, point):
+    return '%s %i %i %i %i %i %i\n' % (
+        (time.strftime('%m-%d-%H:%M', time.localtime(t)),) + tuple(point)
+        + (int(t),))
+
+def append_series(filename, points):
+    ''' Append (time, counts) points to a series file '''
+    new = not os.path.exists(filename)
+    fd = open(filename, 'a')
+    if new:
+        fd.write(SERIES_HEADER)
+    fd.write(''.join([format_point(t, point) for t, point in points]))
+    fd.close()
+
+def read_series(lines):
+    ''' The (time, counts) points of the lines of a series file '''
+    points = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) != 7 or not fields[1].isdigit():
+            continue
+        points.append((int(fields[6]), tuple([int(x) for x in fields[1:6]])))
+    return points
+
+def last_point(filename):
+    ''' The last (time, counts) point of a series file, or None '''
+    if not os.path.exists(filename):
+        return None
+    fd = open(filename, 'r')
+    fd.seek(0, 2)
+    fd.seek(max(0, fd.tell() - 4096))
+    points = read_series(fd.read().splitlines())
+    fd.close()
+    return points and points[-1] or None
+
+def add_point(points, t, point):
+    ''' Add a point, replacing the last point if it has the same time '''
+    if points and points[-1][0] == t:
+        points[-1] = (t, point)
+    else:
+        points.append((t, point))
+
+def changes(before, points):
+    '''
+    The points whose counts differ from those of the point before
+
+    >>> changes((1,), [(0, (1,)), (60, (2,)), (120, (2,))])
+    [(60, (2,))]
+    '''
+    result = []
+    for t, point in points:
+        if point != before:
+            result.append((t, point))
+        before = point
+    return result
+
+def downsample(points, max_points):
+    '''
+    Reduce points to at most max_points, keeping the last point of each
+    equal interval of time
+
+    >>> downsample([(t, (t,)) for t in range(10)], 3)
+    [(2, (2,)), (5, (5,)), (9, (9,))]
+    '''
+    if len(points) <= max_points:
+        return points
+    start = points[0][0]
+    width = float(points[-1][0] - start) / max_points or 1
+    reduced = {}
+    for t, point in points:
+        bucket = min(int((t - start) / width), max_points - 1)
+        reduced[bucket] = (t, point)
+    return [reduced[x] for x in sorted(reduced.keys())]
+
+class Workflow(object):
+    '''
+    Workflow
+
+    The jobs of the user logs of a workflow directory, and the offset up
+    to which each log has been read.
+    '''
+    def __init__(self, dir, resolution=60):
+        self.dir = dir
+        self.resolution = resolution
+        self.state_file = os.path.join(dir, STATE_NAME)
+        self.series_file = os.path.join(dir, SERIES_NAME)
+        self.offsets = {}
+        self.jobs = {}
+        self.last_time = 0
+        if os.path.exists(self.state_file):
+            try:
+                state = json.load(open(self.state_file, 'r'))
+                self.offsets = state['offsets']
+                self.jobs = state['jobs']
+                self.last_time = state['last_time']
+            except (ValueError, KeyError):
+                pass
+
+    def read_events(self):
+        ''' The events added to the logs since the last update '''
+        events = []
+        for log in find_logs(self.dir):
+            try:
+                st = os.stat(log)
+            except OSError:
+                continue
+            # Relative, so the directory may be given by any path
+            name = os.path.relpath(log, self.dir)
+            offset = self.offsets.get(name, 0)
+            if st.st_size < offset:
+                # A new log in place of the old one
+                offset = 0
+            if st.st_size == offset:
+                continue
+            fd = open(log, 'r')
+            fd.seek(offset)
+            data = fd.read()
+            fd.close()
+            new_events, used = parse_events(
+                data, time.localtime(st.st_mtime).tm_year)
+            for t, job_id, event_type in new_events:
+                if t > st.st_mtime + 86400:
+                    # Written last year, in a log which gives no year
+                    lt = time.localtime(t)
+                    t = time.mktime((lt.tm_year - 1,) + tuple(lt)[1:8] + (-1,))
+                events.append((t, job_id, event_type))
+            self.offsets[name] = offset + used
+        events.sort()
+        return events
+
+    def update(self):
+        '''
+        Apply the new events, returning the counts before them and the new
+        (time, counts) points, at most one per resolution seconds.
+        '''
+        before = counts(self.jobs)
+        points = []
+        for t, job_id, event_type in self.read_events():
+            state = EVENT_STATES.get(event_type)
+            if state is None:
+                continue
+            self.jobs[job_id] = state
+            # Never before a point which has already been written
+            t = max(int(t) - int(t) % self.resolution, self.last_time)
+            add_point(points, t, counts(self.jobs))
+            self.last_time = t
+        return before, changes(before, points)
+
+    def save(self, points):
+        if points:
+            append_series(self.series_file, points)
+        tmp = self.state_file + '.tmp'
+        fd = open(tmp, 'w')
+        json.dump({'offsets': self.offsets, 'jobs': self.jobs,
+                   'last_time': self.last_time}, fd)
+        fd.close()
+        os.rename(tmp, self.state_file)
+
+def total_points(updates):
+    '''
+    Sum the counts of several workflows, given the counts of each before
+    its new points and the points, into points of the total
+
+    >>> total_points([((1, 1, 0, 0, 0), [(60, (0, 0, 0, 0, 1))]),
+    ...               ((2, 2, 0, 0, 0), [(0, (2, 1, 1, 0, 0))])])
+    [(0, (3, 2, 1, 0, 0)), (60, (2, 1, 1, 0, 1))]
+    '''
+    current = [list(before) for before, points in updates]
+    all_points = []
+    for i, (before, points) in enumerate(updates):
+        for t, point in points:
+            all_points.append((t, i, point))
+    all_points.sort()
+    totals = []
+    for t, i, point in all_points:
+        current[i] = list(point)
+        add_point(totals, t, tuple([sum(x) for x in zip(*current)]))
+    return totals
+
+def plot(points, png, title, max_points=500):
+    ''' Draw the idle, running and held jobs stacked, as updateJobMonitorGraph.pl does '''
+    fd, data_file = tempfile.mkstemp(suffix='.dat')
+    os.write(fd, ''.join([format_point(t, point)
+                          for t, point in downsample(points, max_points)]))
+    os.close(fd)
+    script = '''set terminal png transparent nocrop enhanced size 620,280
+set output '%(png)s'
+set grid
+set title "%(title)s"
+set xlabel "Time (Hours)"
+set ylabel "Number of Jobs"
+set key reverse Left outside
+set xdata time
+set timefmt "%%m-%%d-%%H:%%M"
+set format x "%%H:%%M"
+set style fill solid 1.00 noborder
+plot "%(data)s" using 1:($3+$4+$5) title "Idle" with boxes, '' using 1:($4+$5) title "Running" with boxes, '' using 1:5 title "Held" with boxes
+''' % {'png': png, 'title': title.replace('"', "'"), 'data': data_file}
+    try:
+        gnuplot = subprocess.Popen(['gnuplot'], stdin=subprocess.PIPE)
+        gnuplot.communicate(script)
+        return gnuplot.returncode == 0
+    finally:
+        os.remove(data_file)
+
+def main():
+    parser = OptionParser(usage="%prog [options] workflow_dir [...]")
+    parser.add_option("--total", dest="total", default=None,
+                      help="Append the sum over all workflows to this file")
+    parser.add_option("--resolution", dest="resolution", type="int",
+                      default=60, help="Seconds between points of the"
+                      " series [default: %default]")
+    parser.add_option("--plot", dest="plot", default=None,
+                      help="Draw the --total series to this PNG file")
+    parser.add_option("--title", dest="title", default="Jobs",
+                      help="Title of the plot [default: %default]")
+    parser.add_option("--max-points", dest="max_points", type="int",
+                      default=500, help="Points to plot at most"
+                      " [default: %default]")
+    parser.add_option("--on-change", dest="on_change", default=None,
+                      help="Shell command to run if the --total series"
+                      " changed")
+    (options, args) = parser.parse_args()
+
+    if json is None:
+        sys.stderr.write("jobThroughput.py needs the json module\n")
+        return 1
+
+    updates = []
+    for dir in args:
+        if not os.path.isdir(dir):
+            continue
+        workflow = Workflow(dir, options.resolution)
+        before, points = workflow.update()
+        try:
+            workflow.save(points)
+        except (IOError, OSError), e:
+            sys.stderr.write("Cannot save the series of %s: %s\n" % (dir, e))
+        updates.append((before, points))
+
+    current = (0, 0, 0, 0, 0)
+    if updates:
+        current = tuple([sum(x) for x in zip(*[
+            points and points[-1][1] or before for before, points in updates])])
+
+    if options.total:
+        last = last_point(options.total)
+        if last is None:
+            # Start a new series with the counts as they are now
+            now = int(time.time())
+            totals = [(now - now % options.resolution, current)]
+        else:
+            # Never before the last point written
+            totals = []
+            for t, point in total_points(updates):
+                add_point(totals, max(t, last[0]), point)
+            totals = changes(last[1], totals)
+        if totals:
+            append_series(options.total, totals)
+            if options.plot:
+                plot(read_series(open(options.total, 'r')), options.plot,
+                     options.title, options.max_points)
+            if options.on_change:
+                subprocess.call(options.on_change, shell=True)
+
+    sys.stdout.write("%i %i %i %i %i\n" % current)
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
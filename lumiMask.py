@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+'''
+
+Apply a JSON luminosity mask to the lumi sections of each file of a dataset.
+
+The mask is the usual CMS JSON file mapping runs to lists of [first, last]
+lumi section ranges.  The lumi sections of each file come either from a
+listing with one "<file> <run> <lumi>" line per lumi section, such as the
+output of a DBS "find file,run,lumi" query, or from a catalogue written by
+dbsCatalogue.py.  For every file with lumi sections in the mask, the file and
+the number of those lumi sections are written to stdout:
+
+    lumiMask.py --run-range=160404-163869 Cert_160404-163869.json lumis.txt
+    /store/data/Run2011A/.../F4A8.root 12
+
+The output can be given to planJobs.py --event-counts, to split jobs by the
+number of masked lumi sections.  With --files-only, only the file names are
+written.
+
+The lumi sections of a file are sorted and walked together with the sorted
+ranges of the mask, so masking takes time proportional to the number of lumi
+sections.
+
+'''
+
+import sys
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from dbsCatalogue import read_catalogue
+from expandRunRange import RunRange
+
+class LumiMask(object):
+    '''
+    LumiMask
+
+    The lumi sections selected by a mask, as sorted, merged (first, last)
+    ranges for each run.  If a RunRange is given, only runs in it are
+    selected.
+
+    >>> mask = LumiMask({'1': [[5, 9], [1, 2], [3, 3]], '4': [[10, 20]]})
+    >>> mask.ranges[1]
+    [(1, 3), (5, 9)]
+    >>> (1, 4) in mask, (1, 9) in mask, (2, 1) in mask
+    (False, True, False)
+    >>> mask.count([(4, 10), (1, 1), (1, 4), (1, 5), (4, 21), (1, 5)])
+    3
+    >>> LumiMask({'1': [[1, 2]], '4': [[10, 20]]}, RunRange([(2, 5)])).runs()
+    [4]
+    '''
+    def __init__(self, mask, runs=None):
+        self.ranges = {}
+        for run, lumi_ranges in mask.iteritems():
+            run = int(run)
+            if runs is not None and run not in runs:
+                continue
+            merged = []
+            for first, last in sorted([tuple(x) for x in lumi_ranges]):
+                if merged and first <= merged[-1][1] + 1:
+                    if last > merged[-1][1]:
+                        merged[-1] = (merged[-1][0], last)
+                else:
+                    merged.append((first, last))
+            self.ranges[run] = merged
+
+    @classmethod
+    def from_json(cls, filename, runs=None):
+        return cls(json.load(open(filename, 'r')), runs)
+
+    def runs(self):
+        return sorted(self.ranges.keys())
+
+    def __contains__(self, run_lumi):
+        return self.count([run_lumi]) == 1
+
+    def count(self, lumis):
+        ''' Number of distinct (run, lumi) sections in the mask '''
+        n_selected = 0
+        current_run = None
+        ranges = ()
+        index = 0
+        previous = None
+        for run_lumi in sorted(lumis):
+            if run_lumi == previous:
+                continue
+            previous = run_lumi
+            run, lumi = run_lumi
+            if run != current_run:
+                current_run = run
+                ranges = self.ranges.get(run, ())
+                index = 0
+            # Both are sorted, so ranges passed by are never needed again
+            while index < len(ranges) and ranges[index][1] < lumi:
+                index += 1
+            if index < len(ranges) and ranges[index][0] <= lumi:
+                n_selected += 1
+        return n_selected
+
+    def apply(self, file_lumis):
+        ''' Generate (file, number of masked lumis) for files in the mask '''
+        for file, lumis in file_lumis:
+            n_selected = self.count(lumis)
+            if n_selected:
+                yield file, n_selected
+
+def read_lumi_listing(fd):
+    '''
+    Generate (file, [(run, lumi), ...]) from "<file> <run> <lumi>" lines.
+    The files are generated in the order they first appear.
+
+    >>> from StringIO import StringIO
+    >>> list(read_lumi_listing(StringIO("/store/a.root 1 2\\njunk\\n"
+    ...                                 "/store/b.root 1 7\\n"
+    ...                                 "/store/a.root 1 3\\n")))
+    [('/store/a.root', [(1, 2), (1, 3)]), ('/store/b.root', [(1, 7)])]
+    '''
+    lumis = {}
+    order = []
+    for line in fd:
+        fields = line.split()
+        if len(fields) != 3:
+            continue
+        try:
+            run_lumi = (int(fields[1]), int(fields[2]))
+        except ValueError:
+            continue
+        file = fields[0]
+        if file not in lumis:
+            lumis[file] = []
+            order.append(file)
+        lumis[file].append(run_lumi)
+    for file in order:
+        yield file, lumis.pop(file)
+
+def main():
+    parser = OptionParser(
+        usage="%prog [options] mask.json [lumi_listing]\n"
+        "       %prog [options] --catalogue=FILE mask.json")
+    parser.add_option("--run-range", dest="run_range", default="",
+                      help="Only select runs in these ranges,"
+                      " e.g. 160404-163869")
+    parser.add_option("--catalogue", dest="catalogue", default=None,
+                      help="Take the lumi sections of each file from this"
+                      " dbsCatalogue.py catalogue")
+    parser.add_option("--files-only", dest="files_only", action="store_true",
+                      default=False, help="Only write the file names")
+    (options, args) = parser.parse_args()
+
+    if len(args) not in (1, 2) or (options.catalogue and len(args) != 1):
+        parser.error("A mask and one lumi listing or catalogue are required")
+
+    runs = None
+    if options.run_range:
+        try:
+            runs = RunRange.parse([options.run_range])
+        except (TypeError, ValueError), e:
+            parser.error("Invalid --run-range: %s" % e.message)
+    mask = LumiMask.from_json(args[0], runs)
+
+    if options.catalogue:
+        header, file_lumis = read_catalogue(options.catalogue)
+    elif len(args) == 2 and args[1] != '-':
+        file_lumis = read_lumi_listing(open(args[1], 'r'))
+    else:
+        file_lumis = read_lumi_listing(sys.stdin)
+
+    for file, n_selected in mask.apply(file_lumis):
+        if options.files_only:
+            sys.stdout.write(file + '\n')
+        else:
+            sys.stdout.write('%s %i\n' % (file, n_selected))
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
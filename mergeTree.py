@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+'''
+
+Merge many root files through a tree of partial merges.
+
+A single hadd (or mergeFiles.C) over thousands of inputs opens them one after
+the other in one process.  This splits the inputs into groups of at most
+--fanin files, merges each group into a partial output, and repeats on the
+partial outputs until one file is left, so the number of sequential merge
+stages grows with the logarithm of the number of inputs.  The merges of each
+stage run --processes at a time on the local machine.
+
+Example:
+
+    mergeTree.py --fanin=20 --processes=4 --work-dir=/scratch/me/tree \\
+        out.root input_list.txt
+
+The input list has one file per line; "-" reads it from stdin.  With
+--fanin=0 the inputs are merged in one step, which is what each node of an
+emitted DAG does.
+
+With --dag=FILE, nothing is merged.  Instead a DAG is written with one node
+per merge, together with the submit file and input lists it uses.  The
+partial outputs are passed between nodes through --work-dir, so it must be
+on a filesystem shared by the worker nodes.
+
+'''
+
+import os
+import Queue
+import subprocess
+import sys
+import threading
+from optparse import OptionParser
+
+class MergeCommand(object):
+    '''
+    MergeCommand
+
+    Runs either hadd or the mergeFiles.C macro to merge a list of files.
+    '''
+    def __init__(self, macro=None):
+        self.macro = macro
+
+    def __call__(self, output, inputs):
+        ''' Merge inputs into output and return the exit status '''
+        if self.macro is None:
+            return self.call(['hadd', output] + list(inputs))
+        list_file = output + '.list'
+        fd = open(list_file, 'w')
+        for input in inputs:
+            fd.write(input + '\n')
+        fd.close()
+        try:
+            return self.call(
+                ['root', '-b', '-l', '-q', '%s("%s","list-in-file:%s")'
+                 % (self.macro, output, list_file)])
+        finally:
+            os.remove(list_file)
+
+    def call(self, command):
+        try:
+            return subprocess.call(command)
+        except OSError, e:
+            sys.stderr.write("Failed to run %s: %s\n" % (command[0], e))
+            return 127
+
+def split(items, n):
+    '''
+    Split items into n groups of nearly equal size, keeping their order
+
+    >>> split(range(7), 3)
+    [[0, 1, 2], [3, 4], [5, 6]]
+    '''
+    size, extra = divmod(len(items), n)
+    groups = []
+    start = 0
+    for i in range(n):
+        end = start + size + (i < extra and 1 or 0)
+        groups.append(items[start:end])
+        start = end
+    return groups
+
+def plan_merge_tree(inputs, output, fanin, work_dir):
+    '''
+    Plan the merges needed to combine inputs into output, merging at most
+    fanin files at a time.  Returns a list of stages, each a list of
+    (output, inputs) merges which only depend on earlier stages.
+
+    >>> plan = plan_merge_tree(['f%i' % i for i in range(10)], 'out', 3, 'w')
+    >>> [len(stage) for stage in plan]
+    [4, 2, 1]
+    >>> plan[1]
+    [('w/partial_1_0.root', ['w/partial_0_0.root', 'w/partial_0_1.root']), ('w/partial_1_1.root', ['w/partial_0_2.root', 'w/partial_0_3.root'])]
+    >>> plan[-1]
+    [('out', ['w/partial_1_0.root', 'w/partial_1_1.root'])]
+    >>> plan_merge_tree(['a', 'b'], 'out', 0, 'w')
+    [[('out', ['a', 'b'])]]
+    '''
+    stages = []
+    level = 0
+    current = list(inputs)
+    while fanin > 1 and len(current) > fanin:
+        n_groups = (len(current) + fanin - 1)//fanin
+        stage = []
+        for i, group in enumerate(split(current, n_groups)):
+            stage.append((os.path.join(work_dir, 'partial_%i_%i.root'
+                                       % (level, i)), group))
+        stages.append(stage)
+        current = [x[0] for x in stage]
+        level += 1
+    stages.append([(output, current)])
+    return stages
+
+class MergeTreeWorker(threading.Thread):
+    '''
+    MergeTreeWorker
+
+    Takes (output, inputs) merges from the work queue, runs them, and puts
+    (output, exit status) in the results queue.
+    '''
+    def __init__(self, work_queue, results_queue, merge_command):
+        super(MergeTreeWorker, self).__init__()
+        self.work_queue = work_queue
+        self.results_queue = results_queue
+        self.merge_command = merge_command
+
+    def run(self):
+        while True:
+            try:
+                item = self.work_queue.get()
+                # Poison pill to be done.
+                if item is None:
+                    break
+                output, inputs = item
+                self.results_queue.put(
+                    (output, self.merge_command(output, inputs)))
+            finally:
+                self.work_queue.task_done()
+
+def run_merge_tree(plan, merge_command, processes=1, log=None):
+    '''
+    Run the stages of a merge plan, with up to processes merges at once.
+    Partial outputs are removed once they have been merged.  Returns True
+    on success.
+    '''
+    log = log or (lambda x: None)
+    work_queue = Queue.Queue()
+    results_queue = Queue.Queue()
+    workers = [MergeTreeWorker(work_queue, results_queue, merge_command)
+               for i in range(max(processes, 1))]
+    map(lambda x: x.start(), workers)
+    success = True
+    try:
+        for i, stage in enumerate(plan):
+            log("Merge stage %i of %i: %i merges"
+                % (i + 1, len(plan), len(stage)))
+            for output, inputs in stage:
+                # Partial output left over from an interrupted attempt
+                if i < len(plan) - 1 and os.path.exists(output):
+                    os.remove(output)
+                work_queue.put((output, inputs))
+            work_queue.join()
+            while not results_queue.empty():
+                output, rc = results_queue.get()
+                if rc != 0:
+                    log("ERROR: merge into %s exited with status %i"
+                        % (output, rc))
+                    success = False
+            if not success:
+                break
+            if i > 0:
+                for output, inputs in stage:
+                    for input in inputs:
+                        os.remove(input)
+    finally:
+        for worker in workers:
+            work_queue.put(None)
+        map(lambda x: x.join(), workers)
+    return success
+
+def write_merge_dag(plan, dag_file, work_dir, merge_args):
+    '''
+    Write a DAG with one node per merge in the plan.  Each node runs this
+    script with --fanin=0 on an input list written to work_dir.
+    '''
+    submit_file = os.path.join(work_dir, 'mergeTree.sub')
+    fd = open(submit_file, 'w')
+    fd.write('''Universe             = vanilla
+Executable           = %(exe)s
+GetEnv               = true
+Arguments            = "--fanin=0 %(merge_args)s $(output) $(input_list)"
+Output               = %(work_dir)s/$(node).out
+Error                = %(work_dir)s/$(node).err
+Log                  = %(work_dir)s/mergeTree.log
+Notification         = never
+Queue
+''' % {'exe': os.path.abspath(sys.argv[0]),
+       'merge_args': merge_args, 'work_dir': work_dir})
+    fd.close()
+
+    dag = open(dag_file, 'w')
+    node_names = {}
+    for i, stage in enumerate(plan):
+        for j, (output, inputs) in enumerate(stage):
+            node = 'merge_%i_%i' % (i, j)
+            node_names[output] = node
+            input_list = os.path.join(work_dir, node + '.list')
+            fd = open(input_list, 'w')
+            for input in inputs:
+                fd.write(input + '\n')
+            fd.close()
+            dag.write('JOB %s %s\n' % (node, submit_file))
+            dag.write('VARS %s node="%s" output="%s" input_list="%s"\n'
+                      % (node, node, output, input_list))
+            parents = [node_names[x] for x in inputs if x in node_names]
+            if parents:
+                dag.write('PARENT %s CHILD %s\n' % (' '.join(parents), node))
+    dag.close()
+
+def read_input_list(filename):
+    fd = sys.stdin
+    if filename != '-':
+        fd = open(filename, 'r')
+    return [line.strip() for line in fd if line.strip()]
+
+def main():
+    parser = OptionParser(usage="%prog [options] output_file input_list")
+    parser.add_option("--fanin", dest="fanin", type="int", default=20,
+                      help="Maximum number of files per merge; 0 merges"
+                      " everything at once [default: %default]")
+    parser.add_option("--processes", dest="processes", type="int",
+                      default=1, help="Number of merges to run at once"
+                      " [default: %default]")
+    parser.add_option("--work-dir", dest="work_dir",
+                      help="Directory for partial merge outputs")
+    parser.add_option("--merge-macro", dest="macro", default=None,
+                      help="Merge with this mergeFiles.C rather than hadd")
+    parser.add_option("--dag", dest="dag", default=None,
+                      help="Write a DAG of the merges to this file instead"
+                      " of running them")
+    (options, args) = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error("An output file and an input list are required")
+    output, input_list = args
+    inputs = read_input_list(input_list)
+    if not inputs:
+        sys.stderr.write("No input files to merge\n")
+        return 1
+
+    work_dir = options.work_dir or (output + '.tree')
+    plan = plan_merge_tree(inputs, output, options.fanin, work_dir)
+    if len(plan) > 1 and not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+
+    def log(message):
+        sys.stdout.write(message + '\n')
+        sys.stdout.flush()
+
+    if options.dag:
+        # The nodes may run in a different directory
+        output = os.path.abspath(output)
+        work_dir = os.path.abspath(work_dir)
+        plan = plan_merge_tree(inputs, output, options.fanin, work_dir)
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+        merge_args = ''
+        if options.macro:
+            merge_args = '--merge-macro=%s' % os.path.abspath(options.macro)
+        write_merge_dag(plan, options.dag, work_dir, merge_args)
+        log("Wrote %i merge nodes in %i stages to %s"
+            % (sum([len(x) for x in plan]), len(plan), options.dag))
+        return 0
+
+    if not run_merge_tree(plan, MergeCommand(options.macro),
+                          processes=options.processes, log=log):
+        return 1
+    if len(plan) > 1:
+        try:
+            os.rmdir(work_dir)
+        except OSError:
+            pass
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+
+'''
+
+Pack the binaries, libraries, python and data directories of a CMSSW
+project area into a tarball, reusing the last tarball if nothing changed.
+
+packUserCode used to run tar czf over the same files on every submission.
+This first makes a manifest of the files to pack, with the SHA1 of each
+file's contents.  If the manifest is the same as that of the last tarball
+made from the project area, that tarball is reused without reading the
+files again.  Files whose size and modification time are unchanged are not
+hashed again either.  The last tarball and its manifest are kept in
+tmp/farmout-user-code in the project area:
+
+    packUserCode.py $CMSSW_BASE /path/to/submit/dir/user_code.tgz
+
+Otherwise, the tarball is written with its entries sorted by name and the
+owner of every entry set to root, so the same files always give the same
+tarball.  Files keep their modification times, so that the .pyc files of the
+python directories still match their sources when extracted.  Files with the
+same contents, mode and modification time are stored once, with hard links
+to the first of them.  The tar stream is compressed in
+chunks of --chunk-size bytes by --workers threads, each chunk becoming a
+member of a multi-member gzip file, which tar and gzip read as one.
+
+As before, bin, lib and python are packed, with every data directory at
+most three levels below src and every python directory below src.  Symbolic
+links are packed as links.
+
+'''
+
+import errno
+import hashlib
+import os
+import Queue
+import shutil
+import stat
+import sys
+import tarfile
+import threading
+import zlib
+from optparse import OptionParser
+
+CACHE_DIR = os.path.join('tmp', 'farmout-user-code')
+TOP_DIRS = ['bin', 'lib', 'python']
+
+def find_dirs(top, name, maxdepth=None):
+    '''
+    Directories called name below top, following symbolic links as find -L
+    does, sorted
+
+    >>> import tempfile
+    >>> base = tempfile.mkdtemp()
+    >>> os.makedirs(os.path.join(base, 'src', 'A', 'B', 'data'))
+    >>> os.makedirs(os.path.join(base, 'src', 'A', 'B', 'x', 'data'))
+    >>> [os.path.relpath(x, base) for x in
+    ...  find_dirs(os.path.join(base, 'src'), 'data', maxdepth=3)]
+    ['src/A/B/data']
+    '''
+    found = []
+    seen = set()
+    depth0 = top.rstrip(os.sep).count(os.sep)
+    for dir, dirs, files in os.walk(top, followlinks=True):
+        real = os.path.realpath(dir)
+        if real in seen:
+            # A loop of symbolic links
+            dirs[:] = []
+            continue
+        seen.add(real)
+        depth = dir.count(os.sep) - depth0
+        if depth and os.path.basename(dir) == name:
+            found.append(dir)
+        if maxdepth is not None and depth >= maxdepth:
+            dirs[:] = []
+    return sorted(found)
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    fd = open(path, 'rb')
+    while True:
+        data = fd.read(1 << 20)
+        if not data:
+            break
+        digest.update(data)
+    fd.close()
+    return digest.hexdigest()
+
+class Manifest(object):
+    '''
+    Manifest
+
+    The entries to pack, one per line of the form
+
+        <type> <mode> <size> <mtime> <sha1 or link target> <name>
+
+    where type is d, f or l.  The modification times of files are packed
+    with them, and tell which files need to be hashed again.  Those of
+    directories and links are not kept.
+
+    >>> m = Manifest([('f', 0644, 3, 10, 'abc', 'lib/a.so')])
+    >>> str(Manifest.parse(str(m)).entries[0][4])
+    'abc'
+    >>> m.contents() == Manifest([('f', 0644, 3, 99, 'abc', 'lib/a.so')]).contents()
+    False
+    '''
+    def __init__(self, entries):
+        self.entries = entries
+
+    def __str__(self):
+        return ''.join(['%s %o %i %i %s %s\n' % x for x in self.entries])
+
+    def contents(self):
+        return list(self.entries)
+
+    def hashes(self):
+        ''' Dictionary of name -> (size, mtime, sha1) of the files '''
+        hashes = {}
+        for type, mode, size, mtime, value, name in self.entries:
+            if type == 'f':
+                hashes[name] = (size, mtime, value)
+        return hashes
+
+    @staticmethod
+    def parse(text):
+        entries = []
+        for line in text.splitlines():
+            fields = line.split(' ', 5)
+            if len(fields) != 6:
+                continue
+            type, mode, size, mtime, value, name = fields
+            entries.append((type, int(mode, 8), int(size), int(mtime),
+                            value, name))
+        return Manifest(entries)
+
+def list_paths(release_area):
+    ''' The paths to pack, relative to the release area '''
+    paths = list(TOP_DIRS)
+    src = os.path.join(release_area, 'src')
+    if os.path.isdir(src):
+        # Only things of the form Package/SubPackage/data
+        for dir in find_dirs(src, 'data', maxdepth=3) + find_dirs(src, 'python'):
+            paths.append(os.path.relpath(dir, release_area))
+    return paths
+
+def make_manifest(release_area, paths, old_hashes=None):
+    ''' Manifest of the given paths and everything below them '''
+    old_hashes = old_hashes or {}
+    entries = {}
+    def add(name):
+        path = os.path.join(release_area, name)
+        st = os.lstat(path)
+        mode = stat.S_IMODE(st.st_mode)
+        if stat.S_ISLNK(st.st_mode):
+            entries[name] = ('l', mode, 0, 0, os.readlink(path), name)
+        elif stat.S_ISDIR(st.st_mode):
+            entries[name] = ('d', mode, 0, 0, '-', name)
+        elif stat.S_ISREG(st.st_mode):
+            mtime = int(st.st_mtime)
+            old = old_hashes.get(name)
+            if old is not None and old[:2] == (st.st_size, mtime):
+                sha1 = old[2]
+            else:
+                sha1 = file_hash(path)
+            entries[name] = ('f', mode, st.st_size, mtime, sha1, name)
+
+    for top in paths:
+        top_path = os.path.join(release_area, top)
+        if not os.path.lexists(top_path):
+            raise IOError(errno.ENOENT, "No such file or directory: %s"
+                          % top_path)
+        add(top)
+        if os.path.islink(top_path):
+            continue
+        for dir, dirs, files in os.walk(top_path):
+            for name in dirs + files:
+                add(os.path.normpath(os.path.join(
+                    top, os.path.relpath(os.path.join(dir, name), top_path))))
+    return Manifest([entries[x] for x in sorted(entries.keys())])
+
+class ParallelGzipWriter(object):
+    '''
+    ParallelGzipWriter
+
+    A file object which gzips what is written to it, in chunks compressed
+    in parallel.  Each chunk is a member of a multi-member gzip file.  The
+    output only depends on the data, level and chunk size.
+
+    >>> from StringIO import StringIO
+    >>> import gzip
+    >>> out = StringIO()
+    >>> writer = ParallelGzipWriter(out, workers=3, chunk_size=10)
+    >>> writer.write('x' * 25 + 'y' * 25)
+    >>> writer.close()
+    >>> gzip.GzipFile(fileobj=StringIO(out.getvalue())).read() == 'x' * 25 + 'y' * 25
+    True
+    '''
+    def __init__(self, fileobj, workers=4, chunk_size=4 << 20, level=6):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.level = level
+        self.buffer = []
+        self.buffered = 0
+        self.pending = []
+        self.max_pending = 2 * workers
+        self.queue = Queue.Queue()
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._compress_chunks)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _compress_chunks(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            # wbits of 31 gives a gzip member, with no name and a zero time
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+            chunk['result'] = compressor.compress(chunk['data']) + \
+                              compressor.flush()
+            chunk['done'].set()
+
+    def _submit(self, data):
+        chunk = {'data': data, 'result': None, 'done': threading.Event()}
+        self.pending.append(chunk)
+        self.queue.put(chunk)
+        while len(self.pending) > self.max_pending:
+            self._write_oldest()
+
+    def _write_oldest(self):
+        chunk = self.pending.pop(0)
+        chunk['done'].wait()
+        self.fileobj.write(chunk['result'])
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.chunk_size:
+            data = ''.join(self.buffer)
+            offset = 0
+            while len(data) - offset >= self.chunk_size:
+                self._submit(data[offset:offset + self.chunk_size])
+                offset += self.chunk_size
+            self.buffer = [data[offset:]]
+            self.buffered = len(data) - offset
+
+    def close(self):
+        if self.buffered or not self.pending:
+            self._submit(''.join(self.buffer))
+        self.buffer = []
+        self.buffered = 0
+        while self.pending:
+            self._write_oldest()
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+def write_tarball(release_area, manifest, fileobj):
+    ''' Write the entries of the manifest as a tar stream '''
+    tar = tarfile.open(mode='w|', fileobj=fileobj,
+                       format=tarfile.GNU_FORMAT)
+    stored = {}
+    for type, mode, size, mtime, value, name in manifest.entries:
+        info = tarfile.TarInfo(name)
+        info.mode = mode
+        info.mtime = mtime
+        info.uid = info.gid = 0
+        info.uname = info.gname = ''
+        if type == 'd':
+            info.type = tarfile.DIRTYPE
+            tar.addfile(info)
+        elif type == 'l':
+            info.type = tarfile.SYMTYPE
+            info.linkname = value
+            tar.addfile(info)
+        elif (value, mode, mtime) in stored:
+            # Same as a file already in the tarball.  A hard link is
+            # extracted with the mode and modification time of the file it
+            # links to, so only files which share those are linked.
+            info.type = tarfile.LNKTYPE
+            info.linkname = stored[(value, mode, mtime)]
+            tar.addfile(info)
+        else:
+            stored[(value, mode, mtime)] = name
+            info.size = size
+            fd = open(os.path.join(release_area, name), 'rb')
+            tar.addfile(info, fd)
+            fd.close()
+    tar.close()
+
+def link_or_copy(source, dest):
+    tmp = '%s.tmp.%i' % (dest, os.getpid())
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copyfile(source, tmp)
+    os.rename(tmp, dest)
+
+def cpu_count():
+    try:
+        return max(1, os.sysconf('SC_NPROCESSORS_ONLN'))
+    except (ValueError, OSError, AttributeError):
+        return 1
+
+def main():
+    parser = OptionParser(usage="%prog [options] CMSSW_BASE output.tgz")
+    parser.add_option("--cache-dir", dest="cache_dir", default=None,
+                      help="Where to keep the last tarball and its manifest"
+                      " [default: CMSSW_BASE/%s]" % CACHE_DIR)
+    parser.add_option("--workers", dest="workers", type="int",
+                      default=cpu_count(), help="Number of threads to"
+                      " compress with [default: %default]")
+    parser.add_option("--chunk-size", dest="chunk_size", type="int",
+                      default=4 << 20, help="Bytes of the tar stream to"
+                      " compress at a time [default: %default]")
+    parser.add_option("--level", dest="level", type="int", default=6,
+                      help="gzip compression level [default: %default]")
+    parser.add_option("--force", dest="force", action="store_true",
+                      default=False, help="Write a new tarball even if"
+                      " nothing changed")
+    (options, args) = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error("A release area and output file are required")
+    release_area, tgz = args
+    cache_dir = options.cache_dir or os.path.join(release_area, CACHE_DIR)
+    cached_tgz = os.path.join(cache_dir, 'user_code.tgz')
+    cached_manifest = os.path.join(cache_dir, 'user_code.manifest')
+
+    old_manifest = Manifest([])
+    if os.path.exists(cached_manifest) and os.path.exists(cached_tgz):
+        old_manifest = Manifest.parse(open(cached_manifest, 'r').read())
+
+    paths = list_paths(release_area)
+    manifest = make_manifest(release_area, paths, old_manifest.hashes())
+
+    if options.force or manifest.contents() != old_manifest.contents():
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp = '%s.tmp.%i' % (cached_tgz, os.getpid())
+        fd = open(tmp, 'wb')
+        try:
+            writer = ParallelGzipWriter(fd, options.workers,
+                                        options.chunk_size, options.level)
+            write_tarball(release_area, manifest, writer)
+            writer.close()
+            fd.close()
+        except:
+            fd.close()
+            os.remove(tmp)
+            raise
+        os.rename(tmp, cached_tgz)
+        print "Packed %i files of %s" % (
+            len(manifest.hashes()), release_area)
+    else:
+        print "Reusing the packed user code of %s; nothing changed" % (
+            release_area)
+
+    # Kept even if only modification times changed, so files are not
+    # hashed again next time
+    tmp = '%s.tmp.%i' % (cached_manifest, os.getpid())
+    open(tmp, 'w').write(str(manifest))
+    os.rename(tmp, cached_manifest)
+
+    link_or_copy(cached_tgz, tgz)
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+'''
+
+Merge root files in batches as they become available.
+
+The names of the files to merge are read from stdin, one per line, e.g. from
+prefetchFiles.py --list_completed while the files are still being copied.
+Every --batch-size files are merged into a partial output as soon as they
+have all arrived, and every --batch-size partial outputs are in turn merged
+into a partial output of the next level.  When the input ends, what is left
+at each level is merged into the final output.  No single merge process
+ever handles more than a few batches' worth of files.
+
+Example:
+
+    prefetchFiles.py --copyjobfile=copy_list.txt --list_completed | \\
+        pipelinedMerge.py --work-dir=/scratch/me/cache/.partial \\
+        --merge-macro=mergeFiles.C out.root
+
+The partial outputs are written to --work-dir and removed once they have
+been merged.
+
+'''
+
+import os
+import Queue
+import sys
+import threading
+from optparse import OptionParser
+
+from mergeTree import MergeCommand
+
+class MergeWorker(threading.Thread):
+    '''
+    MergeWorker
+
+    Takes (level, output, inputs) from the work queue, merges the inputs
+    into the output, and hands the output to the merger at the next level.
+    '''
+    def __init__(self, work_queue, merger):
+        super(MergeWorker, self).__init__()
+        self.work_queue = work_queue
+        self.merger = merger
+
+    def run(self):
+        while True:
+            try:
+                item = self.work_queue.get()
+                # Poison pill to be done.
+                if item is None:
+                    break
+                level, output, inputs = item
+                self.merger.run_merge(level, output, inputs)
+            finally:
+                self.work_queue.task_done()
+
+class PipelinedMerger(object):
+    '''
+    PipelinedMerger
+
+    Collects files at each level of the merge hierarchy, and queues a merge
+    whenever a level has a full batch.  Level 0 holds the input files.
+    '''
+    def __init__(self, work_dir, batch_size, merge_command, jobs=2,
+                 log=None):
+        self.work_dir = work_dir
+        self.batch_size = batch_size
+        self.merge_command = merge_command
+        self.log = log or (lambda x: None)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.n_partials = 0
+        self.failed = False
+        self.work_queue = Queue.Queue()
+        self.workers = [MergeWorker(self.work_queue, self)
+                        for i in range(max(jobs, 1))]
+        map(lambda x: x.start(), self.workers)
+
+    def add(self, level, path):
+        self.lock.acquire()
+        try:
+            batch = self.pending.setdefault(level, [])
+            batch.append(path)
+            if len(batch) < self.batch_size:
+                return
+            self.pending[level] = []
+            self.n_partials += 1
+            output = os.path.join(self.work_dir, 'partial_%i_%05i.root'
+                                  % (level + 1, self.n_partials))
+        finally:
+            self.lock.release()
+        self.work_queue.put((level, output, batch))
+
+    def run_merge(self, level, output, inputs):
+        if self.failed:
+            return
+        self.log("Merging %i level %i files into %s"
+                 % (len(inputs), level, output))
+        if self.merge_command(output, inputs) != 0:
+            self.log("ERROR: failed to merge into %s" % output)
+            self.failed = True
+            return
+        if level > 0:
+            # Inputs are partial outputs from an earlier merge
+            for input in inputs:
+                os.remove(input)
+        self.add(level + 1, output)
+
+    def finish(self, output):
+        '''
+        Wait for the queued merges and merge everything left into output.
+        Returns True on success.
+        '''
+        self.work_queue.join()
+        for worker in self.workers:
+            self.work_queue.put(None)
+        map(lambda x: x.join(), self.workers)
+        if self.failed:
+            return False
+
+        levels = sorted(self.pending.keys())
+        inputs = []
+        for level in levels:
+            inputs.extend(self.pending[level])
+        if not inputs:
+            self.log("ERROR: no files to merge")
+            return False
+        self.log("Merging %i remaining files into %s" % (len(inputs), output))
+        if self.merge_command(output, inputs) != 0:
+            return False
+        for level in levels:
+            if level > 0:
+                for input in self.pending[level]:
+                    os.remove(input)
+        return True
+
+def main():
+    parser = OptionParser(usage="%prog [options] output_file < file_list")
+    parser.add_option("--work-dir", dest="work_dir",
+                      help="Directory for partial merge outputs")
+    parser.add_option("--batch-size", dest="batch_size", type="int",
+                      default=50, help="Number of files per partial merge"
+                      " [default: %default]")
+    parser.add_option("--jobs", dest="jobs", type="int", default=2,
+                      help="Number of partial merges to run at once"
+                      " [default: %default]")
+    parser.add_option("--merge-macro", dest="macro", default=None,
+                      help="Merge with this mergeFiles.C rather than hadd")
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("Exactly one output file is required")
+    output = args[0]
+    work_dir = options.work_dir or (output + '.partial')
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+
+    output_lock = threading.Lock()
+    def log(message):
+        output_lock.acquire()
+        try:
+            sys.stdout.write(message + '\n')
+            sys.stdout.flush()
+        finally:
+            output_lock.release()
+
+    merger = PipelinedMerger(work_dir, max(options.batch_size, 2),
+                             MergeCommand(options.macro), jobs=options.jobs,
+                             log=log)
+    n_files = 0
+    # Read line by line, so merging starts before the input is complete
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        name = line.strip()
+        if not name:
+            continue
+        n_files += 1
+        merger.add(0, name)
+
+    if not merger.finish(output):
+        return 1
+    log("Merged %i files into %s" % (n_files, output))
+    try:
+        os.rmdir(work_dir)
+    except OSError:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
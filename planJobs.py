@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+'''
+
+Group input files into jobs of balanced size.
+
+farmoutAnalysisJobs normally packs --input-files-per-job files into each job
+in the order they are found, so a job that happens to get the largest files
+runs for much longer than the rest, and the workflow is only done when the
+slowest job is.  This reads the input file names on stdin, weighs each file by
+its size or by its number of events, and spreads the files over the same
+number of jobs using the longest-processing-time-first heuristic: the heaviest
+remaining file always goes to the job with the least work so far.
+
+The jobs are written to stdout, one file name per line, with a blank line
+after each job.
+
+Example:
+
+    find /hdfs/store/user/me/skim -name '*.root' | \\
+        planJobs.py --files-per-job=10 --balance-by=size
+
+Event counts may be given as a listing with two columns, file name and number
+of events (e.g. the output of a DBS "find file,file.numevents" query), or as
+framework job reports from an earlier submission.  File names are matched by
+their base name.
+
+'''
+
+import heapq
+import math
+import os
+import sys
+from optparse import OptionParser
+
+# Prefer the bare metal version
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+import bulkStat
+
+def read_event_count_listing(fd):
+    '''
+    Read event counts from lines of the form "<file> <events>"
+
+    >>> from StringIO import StringIO
+    >>> counts = read_event_count_listing(StringIO("/store/a.root 10\\n"
+    ...                                   "junk\\n/store/b.root  25\\n"))
+    >>> sorted(counts.items())
+    [('a.root', 10.0), ('b.root', 25.0)]
+    '''
+    counts = {}
+    for line in fd:
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        try:
+            counts[os.path.basename(fields[0])] = float(fields[1])
+        except ValueError:
+            continue
+    return counts
+
+def read_job_report_event_counts(filename):
+    ''' Get the number of events read from each input file of a job report '''
+    counts = {}
+    try:
+        for event, elem in iterparse(filename):
+            if elem.tag == 'InputFile':
+                pfn = elem.findtext('PFN')
+                events = elem.findtext('EventsRead')
+                if pfn and events:
+                    name = os.path.basename(pfn.strip())
+                    counts[name] = counts.get(name, 0) + float(events)
+                elem.clear()
+    except SyntaxError:
+        sys.stderr.write("Failed to parse job report %s\n" % filename)
+    return counts
+
+def find_job_reports(dir):
+    ''' Find the job reports in the job directories of a submit directory '''
+    for job_dir in sorted(os.listdir(dir)):
+        job_dir = os.path.join(dir, job_dir)
+        if not os.path.isdir(job_dir):
+            continue
+        for name in os.listdir(job_dir):
+            if name.endswith('.xml'):
+                yield os.path.join(job_dir, name)
+
+def read_event_counts(sources):
+    '''
+    Read event counts from a list of sources, each of which is a listing
+    file, a job report, or a submit directory containing job reports.
+    '''
+    counts = {}
+    for source in sources:
+        if os.path.isdir(source):
+            for report in find_job_reports(source):
+                counts.update(read_job_report_event_counts(report))
+        elif source.endswith('.xml'):
+            counts.update(read_job_report_event_counts(source))
+        else:
+            counts.update(read_event_count_listing(open(source, 'r')))
+    return counts
+
+def fill_unknown_weights(weights):
+    '''
+    Replace unknown (None) weights with the average of the known ones, or 1
+    if none are known.
+
+    >>> fill_unknown_weights([2, None, 4])
+    [2, 3.0, 4]
+    '''
+    known = [x for x in weights if x is not None]
+    default = 1
+    if known:
+        default = sum(known)*1.0/len(known)
+    return [default if x is None else x for x in weights]
+
+def plan_jobs(weights, n_jobs):
+    '''
+    Distribute the items with the given weights over n_jobs jobs, using the
+    longest-processing-time-first heuristic.  Returns a list of jobs, each a
+    list of item indices in their original order.  The jobs are ordered by
+    their first item.
+
+    >>> plan_jobs([8, 1, 1, 4, 4, 1, 1], 3)
+    [[0], [1, 3, 5], [2, 4, 6]]
+    '''
+    n_jobs = max(1, min(n_jobs, len(weights)))
+    # (load, number of items, job index)
+    loads = [(0, 0, i) for i in range(n_jobs)]
+    jobs = [[] for i in range(n_jobs)]
+    # Heaviest first; ties broken by input order for reproducibility
+    by_weight = sorted(range(len(weights)), key=lambda i: (-weights[i], i))
+    for i in by_weight:
+        load, count, job = heapq.heappop(loads)
+        jobs[job].append(i)
+        heapq.heappush(loads, (load + weights[i], count + 1, job))
+    jobs = [sorted(job) for job in jobs if job]
+    jobs.sort()
+    return jobs
+
+def ceil_div(a, b):
+    return int((a + b - 1)//b)
+
+def main():
+    parser = OptionParser(usage="%prog [options] < file_list")
+    parser.add_option("--files-per-job", dest="files_per_job", type="int",
+                      default=1, help="Average number of files per job; this"
+                      " sets the number of jobs")
+    parser.add_option("--balance-by", dest="balance_by", default="size",
+                      help="Weigh files by 'size' or 'events'")
+    parser.add_option("--target-per-job", dest="target", type="float",
+                      default=0, help="Amount of work (bytes or events) per"
+                      " job.  Overrides --files-per-job in choosing the"
+                      " number of jobs")
+    parser.add_option("--prefix", dest="prefix", default="",
+                      help="Prepend this to file names to find their size")
+    parser.add_option("--event-counts", dest="event_counts", action="append",
+                      default=[], help="Event count listing, job report or"
+                      " submit directory with job reports (may be repeated)")
+    parser.add_option("--workers", dest="workers", type="int", default=20,
+                      help="Number of files to stat in parallel")
+    (options, args) = parser.parse_args()
+
+    names = [line.strip() for line in sys.stdin]
+    names = [name for name in names if name]
+    if not names:
+        return 0
+
+    if options.balance_by == 'size':
+        paths = [options.prefix + name for name in names]
+        weights = [result.st_size if result is not None else None
+                   for path, result in bulkStat.stat_files(
+                       paths, workers=options.workers)]
+    elif options.balance_by == 'events':
+        counts = read_event_counts(options.event_counts)
+        weights = [counts.get(os.path.basename(name)) for name in names]
+        n_unknown = len([x for x in weights if x is None])
+        if n_unknown:
+            sys.stderr.write("No event count for %i/%i input files\n"
+                             % (n_unknown, len(names)))
+    else:
+        sys.stderr.write("Unknown --balance-by=%s\n" % options.balance_by)
+        return 2
+
+    weights = fill_unknown_weights(weights)
+
+    if options.target > 0:
+        n_jobs = int(math.ceil(sum(weights)/options.target))
+    else:
+        n_jobs = ceil_div(len(names), max(options.files_per_job, 1))
+
+    for job in plan_jobs(weights, n_jobs):
+        for i in job:
+            sys.stdout.write(names[i] + '\n')
+        sys.stdout.write('\n')
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
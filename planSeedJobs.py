@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+'''
+
+Lay out the jobs of a random seed (Monte Carlo) production.
+
+This is run by farmoutRandomSeedJobs in the submit directory.  It plans all
+jobs up front: names, output directories, and a random seed for each
+$randomNumber macro of each job.  It then writes the configuration files of
+every job and appends their commands to the condor submit file in one go.
+
+Seeds are drawn at random below the HepJamesRandom limit and recorded in a
+seed registry, by default seeds.txt in the submit directory, with lines of
+"<seed> <job> <macro>".  Seeds already in the registry are never drawn
+again, so jobs added by a later run with --skip-existing-jobs, or by another
+production sharing the registry, cannot repeat a seed.  New seeds are
+recorded before any configuration that uses them is written.
+
+Example:
+
+    planSeedJobs.py --job-name=zmumu --events=1000000 --events-per-job=500 \\
+        --config=/path/to/zmumu.py --submit-file=submit --output-dir=/hdfs/...
+
+The number of events in the created jobs is written to stdout.
+
+With --shared-log-procs=FILE, the jobs have no user log of their own, so
+that a user log for all jobs can be given in the submit file.  The jobs of
+the submit file are numbered by condor in the order they are queued, and the
+"<proc> <job>" of each is written to FILE.
+
+With --manifest=FILE, each job is also recorded in that job manifest (see
+jobManifest.py).
+
+'''
+
+import os
+import random
+import re
+import sys
+from optparse import OptionParser
+
+from jobManifest import JobManifest
+
+# Seeds must be below the HepJamesRandom limit
+MAX_SEED = 900000000
+
+macro_matcher = re.compile(r'\$(randomNumber[0-9]*|nEventsPerJob|'
+                           r'outputFileName|jobNumber|inputFileNames)')
+
+def random_macros(text):
+    '''
+    Names of the $randomNumber macros in a template
+
+    >>> random_macros('a = $randomNumber; b = $randomNumber12, $randomNumber')
+    ['randomNumber', 'randomNumber12']
+    '''
+    return sorted(set([x for x in macro_matcher.findall(text)
+                       if x.startswith('randomNumber')]))
+
+def substitute(text, values):
+    '''
+    Replace the macros in text which have a value.  A macro is always taken
+    as a whole, so $randomNumber1 never matches the start of $randomNumber12.
+
+    >>> substitute('$randomNumber1 $randomNumber12 $jobNumber $other',
+    ...            {'randomNumber1': '7', 'randomNumber12': '8'})
+    '7 8 $jobNumber $other'
+    '''
+    def replace(match):
+        return values.get(match.group(1), match.group(0))
+    return macro_matcher.sub(replace, text)
+
+class SeedRegistry(object):
+    '''
+    SeedRegistry
+
+    The seeds used so far, and new seeds which differ from all of them.
+
+    >>> import tempfile
+    >>> name = os.path.join(tempfile.mkdtemp(), 'seeds.txt')
+    >>> seeds = SeedRegistry(name, max_seed=4)
+    >>> seeds.used.add(2)
+    >>> sorted([seeds.new_seed('job-%i' % i, 'randomNumber') for i in range(2)])
+    [1, 3]
+    >>> seeds.save()
+    >>> sorted(SeedRegistry(name).used)
+    [1, 3]
+    '''
+    def __init__(self, filename, rng=None, max_seed=MAX_SEED):
+        self.filename = filename
+        self.rng = rng or random.Random()
+        self.max_seed = max_seed
+        self.used = set()
+        self.new = []
+        if os.path.exists(filename):
+            for line in open(filename, 'r'):
+                fields = line.split()
+                if not fields:
+                    continue
+                try:
+                    self.used.add(int(fields[0]))
+                except ValueError:
+                    continue
+
+    def new_seed(self, job, macro):
+        while True:
+            seed = self.rng.randint(1, self.max_seed - 1)
+            if seed not in self.used:
+                break
+        self.used.add(seed)
+        self.new.append("%i %s %s\n" % (seed, job, macro))
+        return seed
+
+    def save(self):
+        ''' Append the new seeds to the registry with a single write '''
+        if not self.new:
+            return
+        fd = open(self.filename, 'a')
+        fd.write(''.join(self.new))
+        fd.close()
+        self.new = []
+
+def output_file_exists(fname):
+    '''
+    Check for an output file, given a path or an srm URL of a local path
+
+    >>> output_file_exists('srm://se.example.com:8443/srm/v2/server?SFN=/no/such/file.root')
+    False
+    '''
+    # Strip off srm://hostname:8443 and '/blah/blah?SFN=' to get raw path
+    local_fname = re.sub('^srm://[^/]*:8443', '', fname)
+    local_fname = re.sub('^.*?SFN=', '', local_fname)
+    return os.path.isfile(local_fname)
+
+def plan_jobs(options, seeds, template_macros):
+    '''
+    Generate a dictionary for each job to create.  As in the original shell
+    loop, skipped jobs do not count towards the requested events.
+    '''
+    n_submitted = 0
+    job = 0
+    output_file_count = 0
+    while options.events > n_submitted:
+        job_output_dir = options.output_dir
+        if options.output_dir != '.' and options.output_files_per_subdir:
+            job_output_dir = '%s/%i' % (
+                job_output_dir,
+                output_file_count//options.output_files_per_subdir + 1)
+        output_file_count += 1
+
+        jobtag = '%s-%04i' % (options.job_name, job)
+        job += 1
+        if options.skip_existing_jobs and os.path.isdir(jobtag):
+            continue
+        output_file_name = jobtag + '.root'
+        if options.skip_existing_output and output_file_exists(
+                '%s/%s' % (job_output_dir, output_file_name)):
+            continue
+
+        values = {
+            'nEventsPerJob': str(options.events_per_job),
+            'jobNumber': str(job - 1),
+        }
+        for macro in template_macros:
+            values[macro] = str(seeds.new_seed(jobtag, macro))
+        yield {
+            'jobtag': jobtag,
+            'output_dir': job_output_dir,
+            'output_file_name': output_file_name,
+            'values': values,
+        }
+        n_submitted += options.events_per_job
+
+def write_job(job, options, config, chained, shared_log=False):
+    ''' Write the configuration files of a job; return the submit commands '''
+    jobtag = job['jobtag']
+    ext = options.config_extension
+    output_file_name = job['output_file_name']
+    values = dict(job['values'])
+
+    jobcfg = '%s.%s' % (jobtag, ext)
+    step1_output_file_name = output_file_name
+    if chained:
+        jobcfg = '%s-step1.%s' % (jobtag, ext)
+        step1_output_file_name = 'intermediate/%s-step1.root' % jobtag
+    values['outputFileName'] = step1_output_file_name
+
+    if not os.path.isdir(jobtag):
+        os.makedirs(jobtag)
+    fd = open(os.path.join(jobtag, jobcfg), 'w')
+    fd.write(substitute(config, values))
+    fd.close()
+
+    job_extra_args = ''
+    if options.extra_args:
+        job_extra_args = substitute(options.extra_args, values)
+
+    jobcfgs = [jobcfg]
+    last_output_file_name = step1_output_file_name
+    for i, template in enumerate(chained):
+        step = i + 2
+        step_cfg = '%s-step%i.%s' % (jobtag, step, ext)
+        jobcfgs.append(step_cfg)
+        step_output_file_name = 'intermediate/%s-step%i.root' % (jobtag, step)
+        if step == len(chained) + 1:
+            step_output_file_name = output_file_name
+        fd = open(os.path.join(jobtag, step_cfg), 'w')
+        fd.write(substitute(template, {
+            'inputFileNames': '"file:%s"' % last_output_file_name,
+            'outputFileName': step_output_file_name}))
+        fd.close()
+        last_output_file_name = step_output_file_name
+
+    jobinputfiles = ','.join(jobcfgs)
+    if options.extra_inputs:
+        jobinputfiles += ',' + options.extra_inputs
+
+    logs = [jobtag + '.out', jobtag + '.err', jobtag + '.log']
+    log_attr = 'Log                  = %s\n' % logs[2]
+    if shared_log:
+        # The job logs to the shared user log instead
+        log_attr = ''
+        logs = logs[:2]
+    for log in logs:
+        path = os.path.join(jobtag, log)
+        open(path, 'a').close()
+        if options.shared_logs:
+            shared = os.path.join(options.shared_logs, log)
+            if os.path.lexists(shared):
+                os.remove(shared)
+            os.link(path, shared)
+
+    return '''
+InitialDir           = %s
+Arguments            = "%s %s %s%s"
+Transfer_Input_Files = %s
+output               = %s
+error                = %s
+%sQueue
+''' % (jobtag, ','.join(jobcfgs), output_file_name, job['output_dir'],
+       job_extra_args, jobinputfiles, logs[0], logs[1], log_attr)
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--job-name", dest="job_name",
+                      help="Prefix of the job names")
+    parser.add_option("--events", dest="events", type="int",
+                      help="Number of events to generate")
+    parser.add_option("--events-per-job", dest="events_per_job", type="int",
+                      help="Number of events per job")
+    parser.add_option("--config", dest="config",
+                      help="Configuration template")
+    parser.add_option("--chained-config", dest="chained", action="append",
+                      default=[], help="Template of a further step, which"
+                      " reads the output of the one before (repeatable)")
+    parser.add_option("--extra-args", dest="extra_args", default="",
+                      help="Extra cmsRun arguments, in condor syntax")
+    parser.add_option("--extra-inputs", dest="extra_inputs", default="",
+                      help="Comma separated files to send with each job")
+    parser.add_option("--output-dir", dest="output_dir", default=".",
+                      help="Output directory of the jobs")
+    parser.add_option("--output-files-per-subdir", type="int",
+                      dest="output_files_per_subdir", default=0,
+                      help="Number of output files per subdirectory"
+                      " (0 for no subdirectories)")
+    parser.add_option("--skip-existing-jobs", dest="skip_existing_jobs",
+                      action="store_true", default=False,
+                      help="Do not create jobs which already have a directory")
+    parser.add_option("--skip-existing-output", dest="skip_existing_output",
+                      action="store_true", default=False,
+                      help="Do not create jobs whose output file exists")
+    parser.add_option("--submit-file", dest="submit_file",
+                      help="Append the commands of each job to this file")
+    parser.add_option("--shared-logs", dest="shared_logs", default="",
+                      help="Also link the job logs into this directory")
+    parser.add_option("--shared-log-procs", dest="shared_log_procs",
+                      default=None, help="Do not give jobs their own user"
+                      " log; write the proc number of each job to this file")
+    parser.add_option("--manifest", dest="manifest", default=None,
+                      help="Record the jobs in this job manifest")
+    parser.add_option("--seed-registry", dest="seed_registry",
+                      default="seeds.txt",
+                      help="File of seeds used so far [default: %default]")
+    (options, args) = parser.parse_args()
+
+    for required in ('job_name', 'events', 'events_per_job', 'config',
+                     'submit_file'):
+        if getattr(options, required) is None:
+            parser.error("--%s is required" % required.replace('_', '-'))
+    if options.events_per_job <= 0:
+        parser.error("--events-per-job must be positive")
+    options.config_extension = options.config.split('.')[-1]
+
+    config = open(options.config, 'r').read()
+    chained = [open(x, 'r').read() for x in options.chained]
+    template_macros = random_macros(config + '\n' + options.extra_args)
+
+    seeds = SeedRegistry(options.seed_registry)
+    jobs = list(plan_jobs(options, seeds, template_macros))
+    # Record the seeds before anything uses them
+    seeds.save()
+
+    proc_fd = None
+    if options.shared_log_procs:
+        proc_fd = open(options.shared_log_procs, 'w')
+    submit_commands = []
+    for proc, job in enumerate(jobs):
+        submit_commands.append(write_job(job, options, config, chained,
+                                         proc_fd is not None))
+        if proc_fd is not None:
+            proc_fd.write('%i %s\n' % (proc, job['jobtag']))
+    fd = open(options.submit_file, 'a')
+    fd.write(''.join(submit_commands))
+    fd.close()
+    if proc_fd is not None:
+        proc_fd.close()
+
+    if options.manifest:
+        manifest = JobManifest(options.manifest)
+        for job in jobs:
+            manifest.add_job(job['jobtag'], job['jobtag'], job['output_dir'],
+                             job['output_file_name'], [])
+        manifest.close()
+
+    sys.stdout.write('%i\n' % (len(jobs)*options.events_per_job))
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+
+'''
+
+Copy input files into a local cache directory, several at a time.
+
+This replaces dccp_many in mergeFiles.  The copy job file has one
+"<source> <destination>" pair per line.  Each file is copied to a hidden
+temporary name next to its destination, checked against the source, and
+only then renamed into place, so a file with its final name in the cache is
+always complete.  Verified files are recorded in a hidden manifest in the
+cache directory; when the copy is started again, files in the manifest are
+skipped and everything else is copied again, so an interrupted prefetch
+picks up where it stopped.
+
+Example:
+
+    prefetchFiles.py --copyjobfile=copy_list.txt --parallel=8 \\
+        --copy_timeout=600 --continue_on_error --failed_files=failed.txt
+
+With --verify=size, a copy must have the same size as its source.  With
+--verify=adler32, the adler32 checksums must also match; the checksum is
+stored in the manifest and checked again when the cache is reused.
+
+With --list_completed, the destination of each file is written to stdout as
+soon as it is in the cache, and messages go to stderr instead, so that the
+files can be processed while the rest are still being copied.
+
+'''
+
+import os
+import Queue
+import shlex
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+import stageOut
+from fileChecksum import adler32_file
+
+MANIFEST_NAME = '.prefetch-manifest'
+
+def partial_name(dest):
+    ''' Hidden name used while a file is being copied
+
+    >>> partial_name('/cache/a.root')
+    '/cache/.a.root.part'
+    '''
+    dir, name = os.path.split(dest)
+    return os.path.join(dir, '.%s.part' % name)
+
+class Manifest(object):
+    '''
+    Manifest
+
+    Record of the files in a cache directory which have been verified, as
+    lines of "<name> <size> <adler32 or ->".  Entries are appended as files
+    are completed, so the record survives an interruption.
+    '''
+    def __init__(self, dir):
+        self.path = os.path.join(dir, MANIFEST_NAME)
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.exists(self.path):
+            for line in open(self.path, 'r'):
+                fields = line.split()
+                if len(fields) != 3:
+                    continue
+                name, size, checksum = fields
+                if checksum == '-':
+                    checksum = None
+                self.entries[name] = (int(size), checksum)
+        self.fd = open(self.path, 'a')
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def add(self, name, size, checksum):
+        self.lock.acquire()
+        try:
+            self.entries[name] = (size, checksum)
+            self.fd.write("%s %i %s\n" % (name, size, checksum or '-'))
+            self.fd.flush()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.fd.close()
+
+def source_size(src):
+    ''' Size of the source file, or None if it cannot be stat-ed '''
+    try:
+        return os.path.getsize(src)
+    except OSError:
+        return None
+
+def is_cached(src, dest, manifest, verify):
+    '''
+    Check whether dest already holds a verified copy of src.  Copies left
+    behind by an older prefetch, which are not in the manifest, are checked
+    and added to it.
+    '''
+    name = os.path.basename(dest)
+    try:
+        size = os.path.getsize(dest)
+    except OSError:
+        return False
+    entry = manifest.get(name)
+    if entry is not None:
+        recorded_size, checksum = entry
+        if size != recorded_size:
+            return False
+        if verify == 'adler32' and checksum and adler32_file(dest) != checksum:
+            return False
+        return True
+    expected = source_size(src)
+    if size == 0 or (expected is not None and size != expected):
+        return False
+    checksum = None
+    if verify == 'adler32':
+        checksum = adler32_file(dest)
+        if checksum != adler32_file(src):
+            return False
+    manifest.add(name, size, checksum)
+    return True
+
+class PrefetchWorker(threading.Thread):
+    '''
+    PrefetchWorker
+
+    Takes (source, destination) pairs from the work queue, copies and
+    verifies them, and puts (source, destination, bytes or None) in the
+    results queue.  None means the copy failed.
+    '''
+    def __init__(self, work_queue, results_queue, options, manifests, log,
+                 abort, completed):
+        super(PrefetchWorker, self).__init__()
+        self.work_queue = work_queue
+        self.results_queue = results_queue
+        self.options = options
+        self.manifests = manifests
+        self.log = log
+        self.abort = abort
+        self.completed = completed
+
+    def run(self):
+        while True:
+            try:
+                item = self.work_queue.get()
+                # Poison pill to be done.
+                if item is None:
+                    break
+                src, dest = item
+                if self.abort.isSet():
+                    self.results_queue.put((src, dest, None))
+                    continue
+                size = None
+                try:
+                    size = self.copy(src, dest)
+                except Exception, e:
+                    self.log("WARNING: failed to copy %s to %s: %s"
+                             % (src, dest, e))
+                    self.remove(partial_name(dest))
+                if size is None and not self.options.continue_on_error:
+                    self.abort.set()
+                self.results_queue.put((src, dest, size))
+            finally:
+                self.work_queue.task_done()
+
+    def copy(self, src, dest):
+        options = self.options
+        manifest = self.manifests[os.path.dirname(dest)]
+        tmp = partial_name(dest)
+        command = shlex.split(options.copy_command) + [src, tmp]
+
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        rc = stageOut.run_with_timeout(command, options.copy_timeout,
+                                       log=self.log)
+        if rc != 0:
+            self.log("WARNING: %s exited with status %i when copying %s"
+                     % (command[0], rc, src))
+            self.remove(tmp)
+            return None
+
+        size = source_size(tmp)
+        expected = source_size(src)
+        if not size or (expected is not None and size != expected):
+            self.log("WARNING: copy of %s has size %s, expected %s"
+                     % (src, size, expected))
+            self.remove(tmp)
+            return None
+
+        checksum = None
+        if options.verify == 'adler32':
+            checksum = adler32_file(tmp)
+            if checksum != adler32_file(src):
+                self.log("WARNING: adler32 checksum mismatch for %s" % src)
+                self.remove(tmp)
+                return None
+
+        os.rename(tmp, dest)
+        manifest.add(os.path.basename(dest), size, checksum)
+        self.completed(dest)
+        return size
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def read_copy_jobs(filename):
+    ''' Read (source, destination) pairs from a copy job file '''
+    pairs = []
+    for line in open(filename, 'r'):
+        fields = line.split()
+        if len(fields) != 2:
+            continue
+        pairs.append(tuple(fields))
+    return pairs
+
+def main():
+    parser = OptionParser(usage="%prog [options] --copyjobfile=FILE")
+    parser.add_option("--copyjobfile", dest="copyjobfile",
+                      help="File with one '<source> <destination>' per line")
+    parser.add_option("--copy_timeout", dest="copy_timeout", type="int",
+                      default=0, help="Seconds to allow for each copy"
+                      " (0 for no limit)")
+    parser.add_option("--continue_on_error", dest="continue_on_error",
+                      action="store_true", default=False,
+                      help="Keep copying the other files if one fails")
+    parser.add_option("--failed_files", dest="failed_files", default="",
+                      help="Write the names of files that failed to copy here")
+    parser.add_option("--parallel", dest="parallel", type="int", default=3,
+                      help="Number of files to copy at once [default: %default]")
+    parser.add_option("--copy_command", dest="copy_command", default="dccp",
+                      help="Command to copy a file, given source and"
+                      " destination [default: %default]")
+    parser.add_option("--verify", dest="verify", default="size",
+                      help="How to check copies: 'size' or 'adler32'"
+                      " [default: %default]")
+    parser.add_option("--list_completed", dest="list_completed",
+                      action="store_true", default=False,
+                      help="Write each file to stdout once it is in the cache")
+    (options, args) = parser.parse_args()
+
+    if not options.copyjobfile:
+        parser.error("--copyjobfile is required")
+    if options.verify not in ('size', 'adler32'):
+        parser.error("--verify must be size or adler32")
+
+    log_fd = sys.stdout
+    if options.list_completed:
+        log_fd = sys.stderr
+
+    output_lock = threading.Lock()
+    def log(message):
+        output_lock.acquire()
+        try:
+            log_fd.write(message + '\n')
+            log_fd.flush()
+        finally:
+            output_lock.release()
+
+    def completed(dest):
+        if not options.list_completed:
+            return
+        output_lock.acquire()
+        try:
+            sys.stdout.write(dest + '\n')
+            sys.stdout.flush()
+        finally:
+            output_lock.release()
+
+    pairs = read_copy_jobs(options.copyjobfile)
+    manifests = {}
+    for src, dest in pairs:
+        dir = os.path.dirname(dest)
+        if dir not in manifests:
+            manifests[dir] = Manifest(dir)
+
+    work_queue = Queue.Queue()
+    results_queue = Queue.Queue()
+    n_cached = 0
+    to_copy = []
+    for src, dest in pairs:
+        if is_cached(src, dest, manifests[os.path.dirname(dest)],
+                     options.verify):
+            n_cached += 1
+            completed(dest)
+            continue
+        to_copy.append((src, dest))
+        work_queue.put((src, dest))
+    if n_cached:
+        log("Already in local cache: %i files." % n_cached)
+
+    abort = threading.Event()
+    workers = [PrefetchWorker(work_queue, results_queue, options, manifests,
+                              log, abort, completed)
+               for i in range(max(options.parallel, 1))]
+    for worker in workers:
+        work_queue.put(None)
+
+    start = time.time()
+    map(lambda x: x.start(), workers)
+    map(lambda x: x.join(), workers)
+    elapsed = time.time() - start
+
+    for manifest in manifests.values():
+        manifest.close()
+
+    copied_bytes = 0
+    n_copied = 0
+    copied = set()
+    while not results_queue.empty():
+        src, dest, size = results_queue.get()
+        if size is not None:
+            copied.add((src, dest))
+            n_copied += 1
+            copied_bytes += size
+    # Anything without a successful result failed, however it failed
+    failed = [src for src, dest in to_copy if (src, dest) not in copied]
+
+    if n_copied:
+        log("Copied %i files (%.1f MB) in %.1f seconds: %.2f MB/s"
+            % (n_copied, copied_bytes/1e6, elapsed,
+               copied_bytes/1e6/max(elapsed, 1e-3)))
+
+    if options.failed_files:
+        fd = open(options.failed_files, 'w')
+        for src in failed:
+            fd.write(src + '\n')
+        fd.close()
+
+    if failed:
+        log("WARNING: failed to copy %i of %i files."
+            % (len(failed), len(pairs)))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+'''
+
+Find the failed jobs of a submit directory and plan their resubmission.
+
+farmoutAnalysisJobs --resubmit-failed-jobs runs this in the submit
+directory.  The status of every job is read in this one process, from the
+shared user log of the directory and the user logs of the jobs.  The status
+found in each job's user log is kept in a cache, .resubmit-cache in the
+submit directory, with the size and modification time of the log, so only
+logs which have changed since the last run are read again.
+
+The jobs are taken from the job manifest (see jobManifest.py), or from the
+job directories if there is none.  With --submit-file, the commands each
+failed job was last submitted with are appended to that submit file, so the
+jobs are resubmitted without listing the input files again:
+
+    resubmitPlanner.py --submit-file=submit.3 /path/to/submit/dir
+
+The configuration files of the jobs are reused as they are.
+
+With --list-failed, the names of the failed jobs are written to stdout.
+With --summary, the number of jobs, and how many of them succeeded, failed
+or are not done, are written as for CondorUserLog.py --job-summary.
+
+'''
+
+import os
+import re
+import sys
+from optparse import OptionParser
+
+import CondorUserLog
+from jobManifest import JobManifest, MANIFEST_NAME, job_status
+
+CACHE_NAME = '.resubmit-cache'
+
+class LogStatusCache(object):
+    '''
+    LogStatusCache
+
+    Status of the job in each user log, in a file with one line per log of
+    the form "<status> <size> <mtime> <path>".  An entry is only used if the
+    size and modification time of the log still match.
+
+    >>> import tempfile
+    >>> dir = tempfile.mkdtemp()
+    >>> log = os.path.join(dir, 'a.log')
+    >>> open(log, 'w').write('...')
+    >>> cache = LogStatusCache(os.path.join(dir, CACHE_NAME))
+    >>> cache.add(log, os.stat(log), 'failed')
+    >>> cache.save()
+    >>> cache = LogStatusCache(os.path.join(dir, CACHE_NAME))
+    >>> cache.lookup(log, os.stat(log))
+    'failed'
+    >>> open(log, 'a').write('...')
+    >>> print cache.lookup(log, os.stat(log))
+    None
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        self.changed = False
+        if os.path.exists(filename):
+            for line in open(filename, 'r'):
+                fields = line.rstrip('\n').split(' ', 3)
+                if len(fields) != 4:
+                    continue
+                try:
+                    status, size, mtime, path = fields
+                    self.entries[path] = (int(size), int(mtime), status)
+                except ValueError:
+                    continue
+
+    def lookup(self, path, stat_result):
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        size, mtime, status = entry
+        if size != stat_result.st_size or mtime != int(stat_result.st_mtime):
+            return None
+        return status
+
+    def add(self, path, stat_result, status):
+        self.entries[path] = (stat_result.st_size, int(stat_result.st_mtime),
+                              status)
+        self.changed = True
+
+    def save(self):
+        ''' Rewrite the cache, if anything was added '''
+        if not self.changed:
+            return
+        tmp = self.filename + '.tmp'
+        fd = open(tmp, 'w')
+        for path, (size, mtime, status) in self.entries.iteritems():
+            fd.write("%s %i %i %s\n" % (status, size, mtime, path))
+        fd.close()
+        os.rename(tmp, self.filename)
+        self.changed = False
+
+def list_jobs(submit_dir):
+    ''' Names and directories of the jobs of a submit directory '''
+    manifest_file = os.path.join(submit_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_file):
+        manifest = JobManifest(manifest_file)
+        return [(x['name'], manifest.job_dir(x['name']))
+                for x in manifest.jobs()]
+    jobs = []
+    for name in sorted(os.listdir(submit_dir)):
+        dir = os.path.join(submit_dir, name)
+        if os.path.exists(os.path.join(dir, name + '.log')):
+            jobs.append((name, dir))
+    return jobs
+
+def load_status(submit_dir, jobs, cache):
+    '''
+    Return a dictionary of the status of each job: done, failed, or None if
+    it has not finished (or has not been submitted).
+    '''
+    shared_logs = {}
+    shared_log = os.path.join(submit_dir, 'jobs.log')
+    if os.path.exists(CondorUserLog.SharedUserLogIndex(shared_log)):
+        shared_logs = CondorUserLog.ReadSharedUserLog(shared_log)
+
+    status = {}
+    for name, dir in jobs:
+        if name in shared_logs:
+            status[name] = job_status(shared_logs[name])
+            continue
+        status[name] = None
+        log = os.path.join(dir, name + '.log')
+        try:
+            stat_result = os.stat(log)
+        except OSError:
+            continue
+        if not stat_result.st_size:
+            continue
+        cached = cache.lookup(log, stat_result)
+        if cached is not None:
+            status[name] = cached != 'none' and cached or None
+            continue
+        status[name] = job_status(CondorUserLog.ReadCondorUserLog(log))
+        cache.add(log, stat_result, status[name] or 'none')
+    return status
+
+def submit_files(submit_dir, exclude=None):
+    '''
+    The submit files of a submit directory, oldest first: submit, submit.1,
+    submit.2 and so on.
+    '''
+    files = []
+    for name in os.listdir(submit_dir):
+        match = re.match(r'^submit(\.([0-9]+))?$', name)
+        if match is None:
+            continue
+        path = os.path.join(submit_dir, name)
+        if exclude and os.path.abspath(path) == os.path.abspath(exclude):
+            continue
+        files.append((int(match.group(2) or 0), path))
+    files.sort()
+    return [x[1] for x in files]
+
+def read_job_commands(lines):
+    '''
+    Return a dictionary of the submit commands of each job in a submit
+    file, from its InitialDir line up to and including its Queue line.  The
+    job is named by the last part of its InitialDir.
+
+    >>> commands = read_job_commands("""Universe = vanilla
+    ...
+    ... InitialDir           = /submit/a
+    ... Arguments            = "a.py a.root /out"
+    ... Queue
+    ... """.splitlines(True))
+    >>> print ''.join(commands['a']),
+    InitialDir           = /submit/a
+    Arguments            = "a.py a.root /out"
+    Queue
+    '''
+    commands = {}
+    current = None
+    for line in lines:
+        if re.match(r'^InitialDir\s*=', line):
+            current = [line]
+        elif current is not None:
+            current.append(line)
+            if re.match(r'^Queue\b', line):
+                dir = current[0].split('=', 1)[1].strip()
+                commands[os.path.basename(dir.rstrip('/'))] = current
+                current = None
+    return commands
+
+def main():
+    parser = OptionParser(usage="%prog [options] submit_dir")
+    parser.add_option("--submit-file", dest="submit_file", default=None,
+                      help="Append the commands of the failed jobs to this"
+                      " submit file")
+    parser.add_option("--shared-log-procs", dest="shared_log_procs",
+                      default=None, help="Leave out the user logs of the"
+                      " jobs, and write the proc number of each job to this"
+                      " file")
+    parser.add_option("--max-jobs", dest="max_jobs", type="int", default=0,
+                      help="Resubmit at most this many jobs (0 for all)")
+    parser.add_option("--list-failed", dest="list_failed",
+                      action="store_true", default=False,
+                      help="Write the names of the failed jobs to stdout")
+    parser.add_option("--summary", dest="summary", action="store_true",
+                      default=False, help="Print the number of jobs, and"
+                      " how many succeeded, failed or are not done")
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("A submit directory is required")
+    submit_dir = args[0]
+
+    jobs = list_jobs(submit_dir)
+    cache = LogStatusCache(os.path.join(submit_dir, CACHE_NAME))
+    status = load_status(submit_dir, jobs, cache)
+    cache.save()
+    failed = [name for name, dir in jobs if status[name] == 'failed']
+
+    if options.summary:
+        values = status.values()
+        sys.stdout.write("%i %i %i %i\n" % (
+            len(values), values.count('done'), values.count('failed'),
+            values.count(None)))
+    if options.list_failed:
+        for name in failed:
+            sys.stdout.write(name + '\n')
+    if not options.submit_file:
+        return 0
+
+    if options.max_jobs:
+        failed = failed[:options.max_jobs]
+    # The last commands each job was submitted with
+    commands = {}
+    for fname in submit_files(submit_dir, exclude=options.submit_file):
+        commands.update(read_job_commands(open(fname, 'r')))
+
+    resubmit = []
+    for name in failed:
+        if name not in commands:
+            sys.stderr.write("No submit commands for failed job %s\n" % name)
+            continue
+        lines = commands[name]
+        if options.shared_log_procs:
+            lines = [x for x in lines if not re.match(r'^Log\s*=', x)]
+        resubmit.append((name, lines))
+        sys.stdout.write("Resubmitting failed job %s\n" % name)
+
+    fd = open(options.submit_file, 'a')
+    fd.write(''.join(['\n' + ''.join(lines) for name, lines in resubmit]))
+    fd.close()
+
+    if options.shared_log_procs:
+        fd = open(options.shared_log_procs, 'w')
+        for proc, (name, lines) in enumerate(resubmit):
+            fd.write('%i %s\n' % (proc, name))
+        fd.close()
+
+    # The jobs have not finished again yet
+    manifest_file = os.path.join(submit_dir, MANIFEST_NAME)
+    if resubmit and os.path.exists(manifest_file):
+        manifest = JobManifest(manifest_file)
+        for name, lines in resubmit:
+            job = manifest.entries.get(name)
+            if job is not None:
+                manifest.add_job(name, job['dir'], job['output_dir'],
+                                 job['output'], job['inputs'])
+        manifest.close()
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)
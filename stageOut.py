@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+'''
+
+Copy job output files to their destination, several at a time.
+
+cmsRun.sh used to copy the outputs of a job one after the other, each under
+the same fixed timeout, so a job with many outputs spent most of its stage-out
+phase waiting for one transfer to finish before starting the next.  This
+copies up to --parallel files at once.  Each copy is waited for directly, so
+a transfer is done as soon as the copy command exits.
+
+The timeout of each copy grows with the size of the file.  Until a copy has
+finished, the transfer rate is assumed to be --assumed-rate; afterwards the
+measured rate is used, with a safety margin.  Failed copies are cleaned up
+and retried after a delay which doubles with each attempt, as does the
+timeout.
+
+Example:
+
+    stageOut.py --dest-dir=srm://cmssrm.hep.wisc.edu:8443/srm/v2/server?SFN=/hdfs/store/user/me/out \\
+        --remove-source *.root
+
+Any command taking a source and a destination can stand in for lcg-cp, e.g.
+--copy-command=cp --delete-command="rm -f" to test locally.
+
+'''
+
+import os
+import Queue
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+class Throughput(object):
+    '''
+    Throughput
+
+    Keeps track of the bytes copied and time spent by completed transfers.
+
+    >>> t = Throughput()
+    >>> print t.rate()
+    None
+    >>> t.record(2000, 1.0)
+    >>> t.record(1000, 2.0)
+    >>> t.rate()
+    1000.0
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def record(self, bytes, seconds):
+        self.lock.acquire()
+        try:
+            self.bytes += bytes
+            self.seconds += seconds
+        finally:
+            self.lock.release()
+
+    def rate(self):
+        ''' Bytes/second per transfer, or None if nothing was measured '''
+        if self.seconds <= 0:
+            return None
+        return self.bytes/self.seconds
+
+def transfer_timeout(size, rate, min_timeout, safety=4.0, max_timeout=0):
+    '''
+    Seconds to allow for copying size bytes at the given rate, with a
+    safety factor, but at least min_timeout (and at most max_timeout if
+    that is set).
+
+    >>> transfer_timeout(10**9, 10**6, 300)
+    4300
+    >>> transfer_timeout(10**9, 10**6, 300, max_timeout=3600)
+    3600
+    >>> transfer_timeout(0, 10**6, 300)
+    300
+    '''
+    timeout = int(min_timeout + safety*size/rate)
+    if max_timeout > 0:
+        timeout = min(timeout, max_timeout)
+    return timeout
+
+def run_with_timeout(command, timeout, kill_delay=60, log=None):
+    '''
+    Run command, sending it SIGTERM if it is still running after timeout
+    seconds and SIGKILL kill_delay seconds later.  A timeout of 0 means
+    wait forever.  Returns the exit status, or 127 if the command could
+    not be run.
+    '''
+    try:
+        proc = subprocess.Popen(command)
+    except OSError, e:
+        if log:
+            log("Failed to run %s: %s" % (command[0], e))
+        return 127
+    if not timeout:
+        return proc.wait()
+
+    def soft_kill():
+        if log:
+            log("Timed out after waiting %i seconds." % timeout)
+        try:
+            os.kill(proc.pid, signal.SIGTERM)
+        except OSError:
+            pass
+        hard_timer.start()
+
+    def hard_kill():
+        if log:
+            log("Hard killing pid %i." % proc.pid)
+        try:
+            os.kill(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    hard_timer = threading.Timer(kill_delay, hard_kill)
+    soft_timer = threading.Timer(timeout, soft_kill)
+    soft_timer.start()
+    try:
+        return proc.wait()
+    finally:
+        soft_timer.cancel()
+        # If the soft timer already fired, it has started the hard timer
+        soft_timer.join()
+        hard_timer.cancel()
+
+class StageOutWorker(threading.Thread):
+    '''
+    StageOutWorker
+
+    Takes (source, destination) pairs from the work queue, copies them, and
+    puts (source, destination, success) in the results queue.
+    '''
+    def __init__(self, work_queue, results_queue, options, throughput, log):
+        super(StageOutWorker, self).__init__()
+        self.work_queue = work_queue
+        self.results_queue = results_queue
+        self.options = options
+        self.throughput = throughput
+        self.log = log
+
+    def run(self):
+        while True:
+            try:
+                item = self.work_queue.get()
+                # Poison pill to be done.
+                if item is None:
+                    break
+                src, dest = item
+                success = False
+                try:
+                    success = self.copy(src, dest)
+                except Exception, e:
+                    self.log("Failed to copy %s to %s: %s" % (src, dest, e))
+                self.results_queue.put((src, dest, success))
+            finally:
+                self.work_queue.task_done()
+
+    def copy(self, src, dest):
+        options = self.options
+        copy_command = shlex.split(options.copy_command) + [src, dest]
+        command_str = " ".join(copy_command)
+        size = os.path.getsize(src)
+
+        for attempt in range(options.tries):
+            rate = self.throughput.rate()
+            if rate is None:
+                rate = options.assumed_rate
+            timeout = transfer_timeout(size, rate, options.min_timeout,
+                                       max_timeout=options.max_timeout)
+            # Allow more time and wait longer on each retry
+            timeout = timeout*2**attempt
+            if attempt > 0:
+                delay = options.retry_delay*2**(attempt - 1)
+                self.log("Trying again in %i seconds: %s" % (delay, command_str))
+                time.sleep(delay)
+
+            start = time.time()
+            rc = run_with_timeout(copy_command, timeout, log=self.log)
+            elapsed = time.time() - start
+
+            if rc == 0:
+                self.throughput.record(size, max(elapsed, 1e-3))
+                self.log("successful file transfer: %s (%i bytes in %.1f"
+                         " seconds)" % (command_str, size, elapsed))
+                return True
+
+            self.log("%s exited with non-zero status %i at %s.\n"
+                     "This happened when copying %s to %s."
+                     % (copy_command[0], rc, time.ctime(), src, dest))
+            self.cleanup(dest)
+
+        self.log("Giving up after %i attempts to copy %s to %s."
+                 % (options.tries, src, dest))
+        return False
+
+    def cleanup(self, dest):
+        if not self.options.delete_command:
+            return
+        # The destination usually does not exist, so be quiet about it
+        devnull = open(os.devnull, 'w')
+        try:
+            subprocess.call(shlex.split(self.options.delete_command) + [dest],
+                            stdout=devnull, stderr=devnull)
+        finally:
+            devnull.close()
+
+def stage_out(pairs, options, log):
+    '''
+    Copy the (source, destination) pairs, up to options.parallel at a time.
+    Returns the list of pairs that could not be copied.
+    '''
+    work_queue = Queue.Queue()
+    results_queue = Queue.Queue()
+    throughput = Throughput()
+
+    def size(pair):
+        try:
+            return os.path.getsize(pair[0])
+        except OSError:
+            # The worker reports it as failed
+            return 0
+
+    # Biggest files first, so they do not end up being copied last, alone
+    pairs = sorted(pairs, key=lambda x: -size(x))
+    for pair in pairs:
+        work_queue.put(pair)
+
+    workers = [StageOutWorker(work_queue, results_queue, options, throughput,
+                              log) for i in range(max(options.parallel, 1))]
+    for worker in workers:
+        work_queue.put(None)
+    map(lambda x: x.start(), workers)
+    map(lambda x: x.join(), workers)
+
+    copied = set()
+    while not results_queue.empty():
+        src, dest, success = results_queue.get()
+        if success:
+            copied.add((src, dest))
+            if options.remove_source:
+                os.remove(src)
+    # Anything without a successful result failed, however it failed
+    failed = [pair for pair in pairs if pair not in copied]
+
+    rate = throughput.rate()
+    if rate is not None:
+        log("Average transfer rate: %.2f MB/s" % (rate/1e6))
+    return failed
+
+def main():
+    parser = OptionParser(usage="%prog [options] --dest-dir=DIR FILE...")
+    parser.add_option("--dest-dir", dest="dest_dir",
+                      help="Destination directory (or SRM URL)")
+    parser.add_option("--copy-command", dest="copy_command",
+                      default="lcg-cp -bD srmv2",
+                      help="Command to copy a file, given source and"
+                      " destination [default: %default]")
+    parser.add_option("--delete-command", dest="delete_command",
+                      default="lcg-del -l -bD srmv2",
+                      help="Command to remove a failed destination file"
+                      " [default: %default]")
+    parser.add_option("--parallel", dest="parallel", type="int", default=4,
+                      help="Number of files to copy at once [default: %default]")
+    parser.add_option("--tries", dest="tries", type="int", default=3,
+                      help="Attempts to copy each file [default: %default]")
+    parser.add_option("--min-timeout", dest="min_timeout", type="int",
+                      default=300, help="Seconds to allow for any transfer,"
+                      " however small [default: %default]")
+    parser.add_option("--max-timeout", dest="max_timeout", type="int",
+                      default=0, help="Upper limit on the timeout of the"
+                      " first attempt to copy a file (0 for none)")
+    parser.add_option("--assumed-rate", dest="assumed_rate", type="float",
+                      default=1e6, help="Transfer rate in bytes/second to"
+                      " assume until one has been measured [default: %default]")
+    parser.add_option("--retry-delay", dest="retry_delay", type="int",
+                      default=30, help="Seconds to wait before the first"
+                      " retry; doubled for each further retry [default: %default]")
+    parser.add_option("--remove-source", dest="remove_source",
+                      action="store_true", default=False,
+                      help="Remove each file once it has been copied")
+    (options, args) = parser.parse_args()
+
+    if not options.dest_dir:
+        parser.error("--dest-dir is required")
+
+    output_lock = threading.Lock()
+    def log(message):
+        output_lock.acquire()
+        try:
+            sys.stdout.write(message + '\n')
+            sys.stdout.flush()
+        finally:
+            output_lock.release()
+
+    pairs = []
+    for src in args:
+        if not os.path.isfile(src):
+            log("No such file %s" % src)
+            return 1
+        pairs.append((src, "%s/%s" % (options.dest_dir.rstrip('/'),
+                                      os.path.basename(src))))
+
+    failed = stage_out(pairs, options, log)
+    if failed:
+        log("Failed to copy %i of %i files." % (len(failed), len(pairs)))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    try:
+        ret = main()
+    except KeyboardInterrupt:
+        ret = None
+    sys.exit(ret)